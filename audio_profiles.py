@@ -0,0 +1,43 @@
+"""Delivery formats a user can choose for the audio the bot sends.
+
+A profile decides whether the downloaded source is sent as is or transcoded
+with ffmpeg, and is part of the key under which uploaded files are cached,
+so the same track in two formats is uploaded once per format.
+"""
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+
+class AudioProfile(NamedTuple):
+    key: str
+    label: str
+    extension: Optional[str]  # None: send the source file unchanged
+    codec: Optional[str]
+    ffmpeg_args: tuple[str, ...] = ()
+    passthrough_suffixes: tuple[str, ...] = ()  # sources already in this format are not re-encoded
+
+    def needs_transcode(self, source_suffix: str) -> bool:
+        return self.extension is not None and source_suffix.lower() not in self.passthrough_suffixes
+
+    def transcode_command(self, source_file: Path, output_file: Path) -> list[str]:
+        # -progress writes key=value lines (out_time_us=...) to stdout for the track progress bar
+        return ["ffmpeg", "-y", "-nostats", "-progress", "pipe:1", "-i", str(source_file), "-vn", *self.ffmpeg_args,
+                str(output_file)]
+
+
+_MP3_ARGS = ("-ar", "44100", "-ac", "2", "-c:a", "libmp3lame")
+
+AUDIO_PROFILES: dict[str, AudioProfile] = {
+    profile.key: profile for profile in (
+        AudioProfile("original", "Оригинал (без перекодирования)", None, None),
+        AudioProfile("mp3_128", "MP3 128 kbps", ".mp3", "mp3", (*_MP3_ARGS, "-b:a", "128k"), (".mp3",)),
+        AudioProfile("mp3_192", "MP3 192 kbps", ".mp3", "mp3", (*_MP3_ARGS, "-b:a", "192k"), (".mp3",)),
+        AudioProfile("mp3_320", "MP3 320 kbps", ".mp3", "mp3", (*_MP3_ARGS, "-b:a", "320k"), (".mp3",)),
+        AudioProfile("opus", "Opus 128 kbps", ".opus", "opus", ("-c:a", "libopus", "-b:a", "128k"), (".opus", ".ogg")),
+    )
+}
+DEFAULT_AUDIO_PROFILE = "mp3_192"
+
+
+def get_profile(key: Optional[str]) -> AudioProfile:
+    return AUDIO_PROFILES.get(key or DEFAULT_AUDIO_PROFILE, AUDIO_PROFILES[DEFAULT_AUDIO_PROFILE])
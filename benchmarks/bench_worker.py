@@ -0,0 +1,55 @@
+"""worker.py wired to the benchmark stubs; started by e2e_benchmark.py --backend workers.
+
+Uses the benchmark database (BENCH_DB_FILE), a stub Bot API, a stub Pyrogram
+client and the fake SoundCloud API, and writes its counters to
+BENCH_WORKER_STATS_DIR when it is stopped.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+
+async def run(worker_index: int, stats_dir: Path):
+    import httpx
+    import db
+    import pyrogram_sender
+    import soundcloud_api
+    import worker
+    from benchmarks.stubs import StubBot, StubPyrogramClient, FakeSoundCloud
+
+    db.DATABASE_FILE = Path(os.environ["BENCH_DB_FILE"])
+    fake_soundcloud = FakeSoundCloud()
+    soundcloud_api._http = httpx.AsyncClient(transport=httpx.MockTransport(fake_soundcloud.handle))
+    stub_bot = StubBot()
+    stub_pyrogram = StubPyrogramClient()
+    pyrogram_sender._pyro_client = stub_pyrogram
+
+    (stats_dir / f"ready-{worker_index}").touch()
+    try:
+        await worker.serve(worker_index, stub_bot)
+    finally:
+        (stats_dir / f"worker-{worker_index}-{os.getpid()}.json").write_text(json.dumps({
+            "uploads": stub_pyrogram.uploads, "cached_sends": stub_pyrogram.cached_sends,
+            "flood_waits": stub_pyrogram.flood_waits, "bot_api_calls": stub_bot.calls,
+            "soundcloud_requests": fake_soundcloud.requests,
+        }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker-id", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("BENCH_LOG_LEVEL", "ERROR"),
+                        format=f"%(asctime)s - worker-{args.worker_id} %(name)s [%(levelname)s] - %(message)s")
+    asyncio.run(run(args.worker_id, Path(os.environ["BENCH_WORKER_STATS_DIR"])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Per-track overhead of spawning scdl for every track vs warm yt-dlp downloader processes.
+
+Downloads --tracks tracks, --concurrency at a time, once through a fresh
+`scdl` process per track (what the pipeline does with WARM_DOWNLOADERS=0)
+and once through warm_downloader with --concurrency warm workers. For each
+mode it reports per-track wall time and overhead, i.e. wall time minus the
+simulated transfer time. The first warm track per worker pays for the
+process start, so it is reported separately.
+
+Offline by default: the fake scdl from benchmarks/fake_bin and the fake
+yt_dlp module from benchmarks/fake_modules stand in for the real tools, and
+--client-id-delay simulates the SoundCloud client_id discovery (once per scdl
+process, once per warm worker). With --url the installed scdl and yt-dlp
+download that real track repeatedly, and overhead equals wall time.
+
+    python benchmarks/downloader_overhead_benchmark.py --tracks 20 --concurrency 2
+    python benchmarks/downloader_overhead_benchmark.py --tracks 5 --url https://soundcloud.com/artist/track
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FAKE_BIN = Path(__file__).resolve().parent / "fake_bin"
+FAKE_MODULES = Path(__file__).resolve().parent / "fake_modules"
+DOWNLOAD_TIMEOUT = 300
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _prepare_environment(args: argparse.Namespace):
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ["WARM_DOWNLOADERS"] = str(args.concurrency)
+    if not args.url:
+        os.environ["PATH"] = f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, (str(FAKE_MODULES), os.environ.get("PYTHONPATH"))))
+        os.environ["BENCH_SCDL_DELAY"] = str(args.transfer_seconds)
+        os.environ["BENCH_CLIENT_ID_DELAY"] = str(args.client_id_delay)
+        os.environ["BENCH_TRACK_SECONDS"] = str(args.track_seconds)
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+async def _spawn_download(url: str, target_dir: Path):
+    import subprocess_runner
+    result = await subprocess_runner.run(["scdl", "-l", url, "-c", "--path", str(target_dir), "--overwrite"],
+                                         DOWNLOAD_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"scdl failed: {result.stderr.decode(errors='ignore').strip()[-200:]}")
+
+
+async def _warm_download(url: str, target_dir: Path):
+    import warm_downloader
+    error = await warm_downloader.download(url, target_dir, DOWNLOAD_TIMEOUT)
+    if error: raise RuntimeError(f"yt-dlp failed: {error[:200]}")
+
+
+async def run_mode(mode: str, args: argparse.Namespace, work_dir: Path) -> dict:
+    import warm_downloader
+    download = _warm_download if mode == "warm" else _spawn_download
+    slots = asyncio.Semaphore(args.concurrency)
+    track_seconds: list[float] = []
+    first_on_worker: list[float] = []
+
+    async def one_track(index: int):
+        url = args.url or f"https://soundcloud.com/bench-artist/overhead-{index}"
+        target_dir = work_dir / f"{mode}-{index}"
+        target_dir.mkdir()
+        async with slots:
+            cold = mode == "warm" and warm_downloader.stats()["processes"] < args.concurrency
+            started = time.perf_counter()
+            await download(url, target_dir)
+            (first_on_worker if cold else track_seconds).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_track(index) for index in range(args.tracks)))
+    elapsed = time.perf_counter() - started
+    if mode == "warm": await warm_downloader.stop()
+    transfer = 0.0 if args.url else args.transfer_seconds
+    return {
+        "mode": mode,
+        "tracks": args.tracks,
+        "concurrency": args.concurrency,
+        "wall_seconds": round(elapsed, 3),
+        "track_seconds_p50": round(_percentile(track_seconds, 0.50), 3),
+        "track_seconds_p99": round(_percentile(track_seconds, 0.99), 3),
+        "overhead_seconds_p50": round(_percentile(track_seconds, 0.50) - transfer, 3),
+        "overhead_seconds_p99": round(_percentile(track_seconds, 0.99) - transfer, 3),
+        "first_track_on_worker_seconds": round(max(first_on_worker), 3) if first_on_worker else None,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    with tempfile.TemporaryDirectory(prefix="syncloud_overhead_") as tmp:
+        modes = ["spawn", "warm"] if args.mode == "both" else [args.mode]
+        return [await run_mode(mode, args, Path(tmp)) for mode in modes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=2, help="parallel downloads, and warm workers")
+    parser.add_argument("--mode", choices=["spawn", "warm", "both"], default="both")
+    parser.add_argument("--transfer-seconds", type=float, default=0.2, help="simulated audio transfer per track")
+    parser.add_argument("--client-id-delay", type=float, default=0.5,
+                        help="simulated SoundCloud client_id discovery per process")
+    parser.add_argument("--track-seconds", type=float, default=60, help="duration of generated audio")
+    parser.add_argument("--url", help="download this real SoundCloud track with the installed tools instead")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    _prepare_environment(args)
+
+    report = json.dumps(asyncio.run(main_async(args)), indent=2)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""End-to-end benchmark of the sync and direct download paths against local fakes.
+
+Runs sync_user_likes_command (mode "sync") or download_track (mode "direct")
+for N users x M likes with fake yt-dlp/scdl binaries, a stub Bot API, a stub
+Pyrogram client and a fake SoundCloud web server, then reports tracks/sec,
+per-track latency, event-loop lag and peak RSS. With --backend workers the
+tracks go through the download queue to --workers bench_worker.py processes.
+With --throttle-seconds the fake scdl answers like a rate-limited SoundCloud
+for that long, --throttle-after seconds into the run; the report then counts
+the throttled downloads and the tracks that ended up in failed_tracks.
+
+    python benchmarks/e2e_benchmark.py --users 3 --likes 10 --mode sync
+    python benchmarks/e2e_benchmark.py --users 8 --likes 10 --mode direct --backend workers --workers 4
+    python benchmarks/e2e_benchmark.py --users 1 --likes 300 --sync-order new_first --listing-page-delay 2
+    python benchmarks/e2e_benchmark.py --users 4 --likes 25 --mode direct --throttle-after 1 --throttle-seconds 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FAKE_BIN = Path(__file__).resolve().parent / "fake_bin"
+FAKE_MODULES = Path(__file__).resolve().parent / "fake_modules"
+BENCH_WORKER = Path(__file__).resolve().parent / "bench_worker.py"
+LOOP_LAG_INTERVAL = 0.05
+WORKER_START_TIMEOUT = 60
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _prepare_environment(work_dir: Path, args: argparse.Namespace):
+    os.environ["PATH"] = f"{FAKE_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+    os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, (str(FAKE_MODULES), os.environ.get("PYTHONPATH"))))
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ["DOWNLOAD_FOLDER"] = str(work_dir / "downloads")
+    os.environ["BENCH_LIKES_PER_USER"] = str(args.likes)
+    os.environ["BENCH_TRACK_SECONDS"] = str(args.track_seconds)
+    os.environ["BENCH_SCDL_DELAY"] = str(args.scdl_delay)
+    os.environ["BENCH_FLOOD_WAIT_EVERY"] = str(args.flood_wait_every)
+    os.environ["BENCH_SHARED_LIKES"] = "1" if args.shared_tracks else "0"
+    os.environ["BENCH_LISTING_PAGE_DELAY"] = str(args.listing_page_delay)
+    os.environ["DOWNLOAD_BACKEND"] = args.backend
+    os.environ["WARM_DOWNLOADERS"] = str(args.warm_downloaders)
+    os.environ["BENCH_DB_FILE"] = str(work_dir / "benchmark.db")
+    os.environ["BENCH_WORKER_STATS_DIR"] = str(work_dir / "worker_stats")
+    os.environ["BENCH_LOG_LEVEL"] = args.log_level.upper()
+    os.environ["BENCH_THROTTLE_FROM"] = str(time.time() + args.throttle_after)
+    os.environ["BENCH_THROTTLE_UNTIL"] = str(time.time() + args.throttle_after + args.throttle_seconds)
+    os.environ["BENCH_THROTTLE_LOG"] = str(work_dir / "throttled.log")
+    os.environ["CIRCUIT_BREAKER_THRESHOLD"] = str(args.breaker_threshold)
+    os.environ["CIRCUIT_BREAKER_BASE_SECONDS"] = str(args.breaker_seconds)
+    sys.path.insert(0, str(REPO_ROOT))
+
+
+async def _sample_loop_lag(samples: list[float], stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def _start_bench_workers(count: int, stats_dir: Path):
+    import download_queue
+    stats_dir.mkdir(exist_ok=True)
+    await download_queue.start_workers(count, (sys.executable, str(BENCH_WORKER)))
+    deadline = time.monotonic() + WORKER_START_TIMEOUT
+    while len(list(stats_dir.glob("ready-*"))) < count:
+        if time.monotonic() > deadline: raise RuntimeError("benchmark workers did not start")
+        await asyncio.sleep(0.1)
+
+
+def _collect_worker_stats(stats_dir: Path) -> dict:
+    totals = {"uploads": 0, "cached_sends": 0, "flood_waits": 0, "soundcloud_requests": 0, "bot_api_calls": {}}
+    for stats_file in stats_dir.glob("worker-*.json"):
+        worker_stats = json.loads(stats_file.read_text())
+        for key in ("uploads", "cached_sends", "flood_waits", "soundcloud_requests"):
+            totals[key] += worker_stats[key]
+        for method, count in worker_stats["bot_api_calls"].items():
+            totals["bot_api_calls"][method] = totals["bot_api_calls"].get(method, 0) + count
+    return totals
+
+
+async def run_benchmark(args: argparse.Namespace, work_dir: Path) -> dict:
+    import httpx
+    import db
+    import download_queue
+    import pyrogram_sender
+    import handlers_direct_download
+    import handlers_sync
+    import soundcloud_api
+    import warm_downloader
+    from benchmarks.stubs import StubBot, StubPyrogramClient, FakeSoundCloud
+
+    db.DATABASE_FILE = Path(os.environ["BENCH_DB_FILE"])
+    db.initialize_db()
+
+    fake_soundcloud = FakeSoundCloud()
+    soundcloud_api._http = httpx.AsyncClient(transport=httpx.MockTransport(fake_soundcloud.handle))
+    stub_bot = StubBot()
+    stub_pyrogram = StubPyrogramClient()
+    pyrogram_sender._pyro_client = stub_pyrogram
+
+    track_latencies: list[float] = []
+    track_starts: list[float] = []
+    # With workers the bot only sees the whole round trip through the queue
+    timed_module, timed_name = ((download_queue, "run_in_worker") if args.backend == "workers" else
+                                (handlers_direct_download, "_process_soundcloud_track"))
+    original_process_track = getattr(timed_module, timed_name)
+
+    async def timed_process_track(*pargs, **kwargs):
+        started = time.perf_counter()
+        track_starts.append(started)
+        try:
+            return await original_process_track(*pargs, **kwargs)
+        finally:
+            track_latencies.append(time.perf_counter() - started)
+
+    setattr(timed_module, timed_name, timed_process_track)
+    stats_dir = Path(os.environ["BENCH_WORKER_STATS_DIR"])
+    if args.backend == "workers":
+        await _start_bench_workers(args.workers, stats_dir)
+
+    user_ids = [900000 + i for i in range(args.users)]
+    for user_id in user_ids:
+        db.update_user_settings(user_id, is_new_user_setup=True)
+        db.update_user_settings(user_id, soundcloud_username=f"bench_user_{user_id}", sync_enabled=True,
+                                audio_profile=args.audio_profile, sync_order=args.sync_order)
+
+    context = SimpleNamespace(bot=stub_bot, bot_data={"user_sync_locks": {}}, user_data={})
+    lag_samples: list[float] = []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(_sample_loop_lag(lag_samples, stop_lag))
+
+    started = time.perf_counter()
+    if args.mode == "sync":
+        await asyncio.gather(*(handlers_sync.sync_user_likes_command(None, context, direct_user_id=user_id,
+                                                                     direct_chat_id=user_id)
+                               for user_id in user_ids))
+    else:
+        async def direct_user(user_id: int):
+            results = await asyncio.gather(*(
+                handlers_direct_download.download_track(
+                    url=(f"https://soundcloud.com/artist{i % 97}/direct-shared-{i}" if args.shared_tracks else
+                         f"https://soundcloud.com/artist{user_id % 97}/direct-{user_id}-{i}"), user_id=user_id,
+                    chat_id=user_id, context=context, status_message_id_to_edit=1)
+                for i in range(args.likes)))
+            return results
+        await asyncio.gather(*(direct_user(user_id) for user_id in user_ids))
+    elapsed = time.perf_counter() - started
+
+    stop_lag.set()
+    await lag_task
+    setattr(timed_module, timed_name, original_process_track)
+    await soundcloud_api.close_http_client()
+    await warm_downloader.stop()
+    bot_api_calls = dict(stub_bot.calls)
+    uploads, cached_sends, flood_waits = stub_pyrogram.uploads, stub_pyrogram.cached_sends, stub_pyrogram.flood_waits
+    soundcloud_requests = fake_soundcloud.requests
+    if args.backend == "workers":
+        await download_queue.stop_workers()
+        worker_totals = _collect_worker_stats(stats_dir)
+        uploads += worker_totals["uploads"]
+        cached_sends += worker_totals["cached_sends"]
+        flood_waits += worker_totals["flood_waits"]
+        soundcloud_requests += worker_totals["soundcloud_requests"]
+        for method, count in worker_totals["bot_api_calls"].items():
+            bot_api_calls[method] = bot_api_calls.get(method, 0) + count
+    throttle_log = work_dir / "throttled.log"
+    with sqlite3.connect(os.environ["BENCH_DB_FILE"]) as bench_db:
+        failed_tracks = bench_db.execute("SELECT COUNT(*) FROM failed_tracks").fetchone()[0]
+
+    return {
+        "mode": args.mode,
+        "backend": args.backend,
+        "workers": args.workers if args.backend == "workers" else 0,
+        "warm_downloaders": args.warm_downloaders,
+        "audio_profile": args.audio_profile,
+        "sync_order": args.sync_order,
+        "shared_tracks": args.shared_tracks,
+        "users": args.users,
+        "likes_per_user": args.likes,
+        "tracks_uploaded": uploads,
+        "tracks_resent_by_file_id": cached_sends,
+        "flood_waits": flood_waits,
+        "throttled_downloads": len(throttle_log.read_text().splitlines()) if throttle_log.exists() else 0,
+        "failed_tracks": failed_tracks,
+        "wall_seconds": round(elapsed, 3),
+        "first_track_seconds": round(min(track_starts) - started, 3) if track_starts else None,
+        "tracks_per_second": round(uploads / elapsed, 3) if elapsed else 0.0,
+        "track_latency_p50": round(_percentile(track_latencies, 0.50), 3),
+        "track_latency_p99": round(_percentile(track_latencies, 0.99), 3),
+        "loop_lag_p50_ms": round(_percentile(lag_samples, 0.50) * 1000, 2),
+        "loop_lag_p99_ms": round(_percentile(lag_samples, 0.99) * 1000, 2),
+        "loop_lag_max_ms": round(max(lag_samples, default=0.0) * 1000, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "bot_api_calls": bot_api_calls,
+        "soundcloud_requests": soundcloud_requests,
+        "soundcloud_requests_by_path": fake_soundcloud.requests_by_path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--likes", type=int, default=10, help="liked tracks per user (tracks per user in direct mode)")
+    parser.add_argument("--mode", choices=("sync", "direct"), default="sync")
+    parser.add_argument("--backend", choices=("inprocess", "workers"), default="inprocess",
+                        help="download in the benchmark process or in worker processes via the download queue")
+    parser.add_argument("--workers", type=int, default=2, help="worker processes with --backend workers")
+    parser.add_argument("--warm-downloaders", type=int, default=0,
+                        help="download with N warm yt-dlp processes (fake yt_dlp module) instead of scdl per track")
+    parser.add_argument("--shared-tracks", action="store_true",
+                        help="all users request the same tracks at the same time")
+    parser.add_argument("--sync-order", choices=("old_first", "new_first"), default="old_first",
+                        help="order in which sync mode delivers the likes")
+    parser.add_argument("--listing-page-delay", type=float, default=0,
+                        help="simulated fetch time of each page of 50 likes in the yt-dlp listing")
+    parser.add_argument("--audio-profile", default="mp3_192", help="delivery format of the benchmark users")
+    parser.add_argument("--track-seconds", type=float, default=180, help="duration of generated audio")
+    parser.add_argument("--scdl-delay", type=float, default=0.5, help="simulated download time per track")
+    parser.add_argument("--flood-wait-every", type=int, default=0,
+                        help="make every N-th Pyrogram send fail with FloodWait (0: never)")
+    parser.add_argument("--throttle-after", type=float, default=0, help="seconds into the run SoundCloud throttles")
+    parser.add_argument("--throttle-seconds", type=float, default=0,
+                        help="how long the fake scdl fails with HTTP 429 (0: never)")
+    parser.add_argument("--breaker-threshold", type=int, default=3, help="CIRCUIT_BREAKER_THRESHOLD, 0 disables it")
+    parser.add_argument("--breaker-seconds", type=int, default=1, help="CIRCUIT_BREAKER_BASE_SECONDS")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--log-level", default="ERROR", help="log level of the bot modules during the run")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(name)s [%(levelname)s] - %(message)s")
+
+    with tempfile.TemporaryDirectory(prefix="syncloud_bench_") as tmp:
+        work_dir = Path(tmp)
+        _prepare_environment(work_dir, args)
+        report = asyncio.run(run_benchmark(args, work_dir))
+
+    report_json = json.dumps(report, indent=2, ensure_ascii=False)
+    print(report_json)
+    if args.output:
+        Path(args.output).write_text(report_json + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""Helpers shared by the fake command-line tools."""
+import zlib
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, joint stereo: 417-byte frames of 1152 samples
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x44])
+MP3_FRAME_SIZE = 417
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+
+def fake_track_id(url: str) -> int:
+    return 100000000 + zlib.crc32(url.rstrip("/").lower().encode()) % 900000000
+
+
+def generate_mp3(seconds: float) -> bytes:
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return frame * max(1, int(seconds * MP3_FRAMES_PER_SECOND))
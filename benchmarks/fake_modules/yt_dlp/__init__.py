@@ -0,0 +1,42 @@
+"""Offline stand-in for the yt_dlp Python API used by ytdlp_worker.py in the benchmarks.
+
+YoutubeDL.download() writes a generated silent MP3 named "<artist> - <title>.mp3"
+into params["paths"]["home"], reporting progress hooks over BENCH_SCDL_DELAY like
+the fake scdl. The client_id discovery (BENCH_CLIENT_ID_DELAY) happens once per
+YoutubeDL instance, as yt-dlp caches it.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "fake_bin"))
+from fake_common import generate_mp3  # noqa: E402
+
+from . import utils  # noqa: E402
+
+PROGRESS_STEPS = 10
+
+
+class YoutubeDL:
+    def __init__(self, params: dict):
+        self.params = dict(params)
+        self._client_id = None
+
+    def download(self, urls: list) -> int:
+        if self._client_id is None:
+            time.sleep(float(os.getenv("BENCH_CLIENT_ID_DELAY", "0")))
+            self._client_id = "fake-client-id"
+        for url in urls:
+            if "/error-" in url: raise utils.DownloadError(f"ERROR: [soundcloud] {url}: Unable to download")
+            audio = generate_mp3(float(os.getenv("BENCH_TRACK_SECONDS", "180")))
+            delay = float(os.getenv("BENCH_SCDL_DELAY", "0.5"))
+            for step in range(1, PROGRESS_STEPS + 1):
+                time.sleep(delay / PROGRESS_STEPS)
+                for hook in self.params.get("progress_hooks", ()):
+                    hook({"status": "downloading", "downloaded_bytes": len(audio) * step // PROGRESS_STEPS,
+                          "total_bytes": len(audio)})
+            artist, title = url.rstrip("/").split("/")[-2:]
+            target_dir = self.params.get("paths", {}).get("home", ".")
+            with open(os.path.join(target_dir, f"{artist} - {title}.mp3"), "wb") as mp3_file:
+                mp3_file.write(audio)
+        return 0
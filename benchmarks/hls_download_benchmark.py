@@ -0,0 +1,98 @@
+"""Sequential vs concurrent HLS segment downloading against the local HLS fixture server.
+
+Points soundcloud_api at benchmarks/hls_fixture_server.py and downloads
+--downloads tracks at once through hls_download.download_track. It does
+this with one connection per download, like scdl fetching segments one
+after another, and again with --connections per download. It reports wall
+time, throughput and the peak of segment requests the server saw in flight,
+which must stay within --connections x --downloads and --max-connections.
+It also checks that every output file is byte-identical to its segments
+concatenated in playlist order.
+
+    python benchmarks/hls_download_benchmark.py --segments 60 --latency 0.05 --connections 4 --downloads 3
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FIXTURE_PORT = 18090
+FIRST_TRACK_ID = 500000001
+
+
+async def run_mode(connections: int, args: argparse.Namespace, fixture, work_dir: Path) -> dict:
+    import hls_download
+    fixture.peak_segments_in_flight = 0
+    target_dir = work_dir / f"connections-{connections}"
+    target_dir.mkdir()
+    track_ids = [FIRST_TRACK_ID + index for index in range(args.downloads)]
+
+    started = time.perf_counter()
+    files = await asyncio.gather(*(hls_download.download_track(str(track_id), target_dir, f"track-{track_id}",
+                                                                connections=connections) for track_id in track_ids))
+    elapsed = time.perf_counter() - started
+    intact = all(output_file and output_file.read_bytes() == fixture.expected_bytes(track_id)
+                 for track_id, output_file in zip(track_ids, files))
+    total_bytes = sum(output_file.stat().st_size for output_file in files if output_file)
+    return {
+        "connections_per_download": connections,
+        "downloads": args.downloads,
+        "segments_per_track": args.segments,
+        "wall_seconds": round(elapsed, 3),
+        "mb_per_second": round(total_bytes / elapsed / 1e6, 2) if elapsed else 0.0,
+        "peak_segments_in_flight": fixture.peak_segments_in_flight,
+        "files_intact": intact,
+    }
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    import hls_download
+    import soundcloud_api
+    from benchmarks.hls_fixture_server import HlsFixture
+
+    fixture = HlsFixture(args.segments, args.latency, args.fail_every)
+    fixture.start(FIXTURE_PORT)
+    soundcloud_api.API_BASE_URL = fixture.base_url
+    soundcloud_api._client_id = "fixture"
+    try:
+        with tempfile.TemporaryDirectory(prefix="syncloud_hls_") as tmp:
+            return [await run_mode(connections, args, fixture, Path(tmp))
+                    for connections in dict.fromkeys((1, args.connections))]
+    finally:
+        fixture.stop()
+        await hls_download.close_http_client()
+        await soundcloud_api.close_http_client()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--segments", type=int, default=60, help="10 s segments per track")
+    parser.add_argument("--latency", type=float, default=0.05, help="fixture response time of each segment")
+    parser.add_argument("--connections", type=int, default=4, help="segment requests in flight per download")
+    parser.add_argument("--max-connections", type=int, default=16, help="HLS_MAX_CONNECTIONS across downloads")
+    parser.add_argument("--downloads", type=int, default=1, help="tracks downloaded at the same time")
+    parser.add_argument("--fail-every", type=int, default=0, help="fixture answers every N-th segment with 503")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("tornado.access").setLevel(logging.CRITICAL)  # --fail-every answers are expected
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ.setdefault("API_ID", "1")
+    os.environ.setdefault("API_HASH", "benchmark")
+    os.environ["HLS_MAX_CONNECTIONS"] = str(args.max_connections)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    report = json.dumps(asyncio.run(main_async(args)), indent=2)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
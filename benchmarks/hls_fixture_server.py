@@ -0,0 +1,130 @@
+"""Local HLS fixture server playing SoundCloud's api-v2 and CDN for hls_download.
+
+Serves, for any numeric track id:
+  GET /tracks/<id>                        -> track JSON with one plain HLS MP3 transcoding
+  GET /media/<id>/stream/hls              -> {"url": <playlist url>}
+  GET /playlists/<id>.m3u8                -> media playlist of --segments relative segment URIs
+  GET /playlists/segments/<id>/<n>.mp3    -> MP3 frames whose padding byte encodes n, after --latency seconds
+It counts requests per path kind and the peak of segment requests in flight,
+so a client's connection limits and segment order can be checked.
+
+    python benchmarks/hls_fixture_server.py --port 18090 --segments 60 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+import tornado.web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_bin"))
+from fake_common import MP3_FRAME_HEADER, MP3_FRAME_SIZE  # noqa: E402
+
+SEGMENT_SECONDS = 10
+FRAMES_PER_SEGMENT = 383  # ~10 s of 128 kbit/s MP3
+
+
+def segment_bytes(track_id: int, index: int) -> bytes:
+    padding = bytes([(track_id + index) % 256]) * (MP3_FRAME_SIZE - len(MP3_FRAME_HEADER))
+    return (MP3_FRAME_HEADER + padding) * FRAMES_PER_SEGMENT
+
+
+class HlsFixture:
+    def __init__(self, segments: int, latency: float, fail_every: int = 0):
+        self.segments = segments
+        self.latency = latency
+        self.fail_every = fail_every  # every N-th segment request answers 503 once
+        self.base_url = ""
+        self.requests: dict[str, int] = {}
+        self.segments_in_flight = 0
+        self.peak_segments_in_flight = 0
+        self._server = None
+
+    def expected_bytes(self, track_id: int) -> bytes:
+        return b"".join(segment_bytes(track_id, index) for index in range(self.segments))
+
+    def start(self, port: int):
+        self.base_url = f"http://127.0.0.1:{port}"
+        self._server = tornado.web.Application([
+            (r"/tracks/(\d+)", _TrackHandler, {"fixture": self}),
+            (r"/media/(\d+)/stream/hls", _StreamHandler, {"fixture": self}),
+            (r"/playlists/(\d+)\.m3u8", _PlaylistHandler, {"fixture": self}),
+            (r"/playlists/segments/(\d+)/(\d+)\.mp3", _SegmentHandler, {"fixture": self}),
+        ]).listen(port, address="127.0.0.1")
+
+    def stop(self):
+        if self._server: self._server.stop()
+
+    def count(self, kind: str):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+
+class _FixtureHandler(tornado.web.RequestHandler):
+    def initialize(self, fixture: HlsFixture):
+        self.fixture = fixture
+
+
+class _TrackHandler(_FixtureHandler):
+    def get(self, track_id: str):
+        self.fixture.count("track")
+        self.write({"kind": "track", "id": int(track_id), "track_authorization": "fixture",
+                    "media": {"transcodings": [
+                        {"url": f"{self.fixture.base_url}/media/{track_id}/stream/progressive",
+                         "format": {"protocol": "progressive", "mime_type": "audio/mpeg"}, "snipped": False},
+                        {"url": f"{self.fixture.base_url}/media/{track_id}/stream/hls",
+                         "format": {"protocol": "hls", "mime_type": "audio/mpeg"}, "snipped": False}]}})
+
+
+class _StreamHandler(_FixtureHandler):
+    def get(self, track_id: str):
+        self.fixture.count("stream")
+        self.write({"url": f"{self.fixture.base_url}/playlists/{track_id}.m3u8"})
+
+
+class _PlaylistHandler(_FixtureHandler):
+    def get(self, track_id: str):
+        self.fixture.count("playlist")
+        lines = ["#EXTM3U", "#EXT-X-VERSION:6", f"#EXT-X-TARGETDURATION:{SEGMENT_SECONDS}", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for index in range(self.fixture.segments):
+            lines += [f"#EXTINF:{SEGMENT_SECONDS}.0,", f"segments/{track_id}/{index}.mp3"]
+        lines.append("#EXT-X-ENDLIST")
+        self.set_header("Content-Type", "application/vnd.apple.mpegurl")
+        self.write("\n".join(lines) + "\n")
+
+
+class _SegmentHandler(_FixtureHandler):
+    async def get(self, track_id: str, index: str):
+        fixture = self.fixture
+        fixture.count("segment")
+        fixture.segments_in_flight += 1
+        fixture.peak_segments_in_flight = max(fixture.peak_segments_in_flight, fixture.segments_in_flight)
+        try:
+            await asyncio.sleep(fixture.latency)
+        finally:
+            fixture.segments_in_flight -= 1
+        if fixture.fail_every and fixture.requests["segment"] % fixture.fail_every == 0:
+            self.set_status(503)
+            return
+        self.set_header("Content-Type", "audio/mpeg")
+        self.write(segment_bytes(int(track_id), int(index)))
+
+
+async def _serve(args: argparse.Namespace):
+    fixture = HlsFixture(args.segments, args.latency, args.fail_every)
+    fixture.start(args.port)
+    print(json.dumps({"api_base_url": fixture.base_url, "segments": args.segments}), flush=True)
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--segments", type=int, default=60, help="segments per track (10 s each)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before each segment response")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every N-th segment request with 503")
+    asyncio.run(_serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
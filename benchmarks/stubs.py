@@ -0,0 +1,143 @@
+"""Local stand-ins for the Telegram Bot API, the Pyrogram client and SoundCloud web/API requests."""
+import asyncio
+import functools
+import inspect
+import io
+import itertools
+import os
+from types import SimpleNamespace
+from typing import Any
+
+import httpx
+from PIL import Image
+from pyrogram.errors import FloodWait
+
+from benchmarks.fake_bin.fake_common import fake_track_id
+
+BOT_API_LATENCY = float(os.getenv("BENCH_BOT_API_LATENCY", "0.03"))
+UPLOAD_BYTES_PER_SECOND = float(os.getenv("BENCH_UPLOAD_BPS", str(20 * 1024 * 1024)))
+UPLOAD_PART_SIZE = 512 * 1024
+FLOOD_WAIT_EVERY = int(os.getenv("BENCH_FLOOD_WAIT_EVERY", "0"))
+FLOOD_WAIT_SECONDS = int(os.getenv("BENCH_FLOOD_WAIT_SECONDS", "3"))
+FAKE_COVER_URL = "https://i1.sndcdn.com/artworks-benchmark-t500x500.jpg"
+FAKE_PLAYER_SCRIPT_URL = "https://a-v2.sndcdn.com/assets/0-benchmark.js"
+FAKE_CLIENT_ID = "benchmark0client0id0000000000000"
+
+
+def _generate_cover_jpeg(size: int = 500) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (size, size), (200, 80, 20)).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+class StubBot:
+    """Implements the subset of telegram.Bot the handlers call; counts calls per method."""
+
+    def __init__(self, latency: float = BOT_API_LATENCY):
+        self.latency = latency
+        self.calls: dict[str, int] = {}
+        self._message_ids = itertools.count(1000)
+
+    async def _call(self, method: str) -> None:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> SimpleNamespace:
+        await self._call("send_message")
+        return SimpleNamespace(message_id=next(self._message_ids), chat_id=chat_id, text=text)
+
+    async def edit_message_text(self, text: str = "", chat_id: int = 0, message_id: int = 0, **kwargs: Any) -> bool:
+        await self._call("edit_message_text")
+        return True
+
+    async def delete_message(self, chat_id: int, message_id: int, **kwargs: Any) -> bool:
+        await self._call("delete_message")
+        return True
+
+    async def pin_chat_message(self, chat_id: int, message_id: int, **kwargs: Any) -> bool:
+        await self._call("pin_chat_message")
+        return True
+
+
+class StubPyrogramClient:
+    """Pretends to upload audio at UPLOAD_BYTES_PER_SECOND; every FLOOD_WAIT_EVERY-th send raises FloodWait."""
+
+    def __init__(self, bytes_per_second: float = UPLOAD_BYTES_PER_SECOND):
+        self.bytes_per_second = bytes_per_second
+        self.is_connected = True
+        self.uploads = 0
+        self.cached_sends = 0
+        self.uploaded_bytes = 0
+        self.flood_waits = 0
+        self._send_attempts = 0
+        self._message_ids = itertools.count(500000)
+
+    async def start(self):
+        self.is_connected = True
+
+    async def stop(self):
+        self.is_connected = False
+
+    async def send_audio(self, chat_id: int, audio: Any, **kwargs: Any) -> SimpleNamespace:
+        self._send_attempts += 1
+        if FLOOD_WAIT_EVERY and self._send_attempts % FLOOD_WAIT_EVERY == 0:
+            self.flood_waits += 1
+            raise FloodWait(value=FLOOD_WAIT_SECONDS)
+        if isinstance(audio, str) and audio.startswith("stub-"):  # re-send by file_id, nothing is uploaded
+            self.cached_sends += 1
+            return SimpleNamespace(id=next(self._message_ids), audio=SimpleNamespace(file_id=audio))
+        if isinstance(audio, (str, os.PathLike)):
+            size = os.path.getsize(audio)
+        elif hasattr(audio, "getbuffer"):
+            size = audio.getbuffer().nbytes
+        else:
+            size = 0
+        progress = kwargs.get("progress")
+        uploaded = 0
+        while uploaded < size:  # 512 KB parts, like Pyrogram
+            part = min(UPLOAD_PART_SIZE, size - uploaded)
+            await asyncio.sleep(part / self.bytes_per_second)
+            uploaded += part
+            if progress:  # dispatched like Pyrogram's save_file
+                if inspect.iscoroutinefunction(progress):
+                    await progress(uploaded, size)
+                else:
+                    await asyncio.get_running_loop().run_in_executor(None, functools.partial(progress, uploaded, size))
+        self.uploads += 1
+        self.uploaded_bytes += size
+        return SimpleNamespace(id=next(self._message_ids), audio=SimpleNamespace(file_id=f"stub-{self.uploads}"))
+
+
+class FakeSoundCloud:
+    """httpx.MockTransport handler serving the web player page, its client_id bundle, api-v2 and a generated cover."""
+
+    def __init__(self):
+        self.cover = _generate_cover_jpeg()
+        self.requests = 0
+        self.requests_by_path: dict[str, int] = {}
+
+    def _track(self, track_id: int, permalink_url: str) -> dict:
+        return {"kind": "track", "id": track_id, "permalink_url": permalink_url, "title": f"Track {track_id}",
+                "duration": 180000, "artwork_url": FAKE_COVER_URL.replace("-t500x500.", "-large."),
+                "user": {"username": f"artist{track_id % 97}", "avatar_url": None}}
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        path = request.url.path
+        self.requests_by_path[path] = self.requests_by_path.get(path, 0) + 1
+        if str(request.url) == FAKE_COVER_URL:
+            return httpx.Response(200, content=self.cover)
+        if request.url.host == "soundcloud.com":
+            return httpx.Response(200, text=f'<script crossorigin src="{FAKE_PLAYER_SCRIPT_URL}"></script>')
+        if str(request.url) == FAKE_PLAYER_SCRIPT_URL:
+            return httpx.Response(200, text=f'({{client_id:"{FAKE_CLIENT_ID}",env:"production"}})')
+        if request.url.params.get("client_id") != FAKE_CLIENT_ID:
+            return httpx.Response(401)
+        if path == "/tracks":
+            ids = [int(track_id) for track_id in request.url.params.get("ids", "").split(",") if track_id]
+            return httpx.Response(200, json=[self._track(track_id, f"https://soundcloud.com/bench/{track_id}")
+                                             for track_id in ids])
+        if path == "/resolve":
+            url = request.url.params.get("url", "")
+            return httpx.Response(200, json=self._track(fake_track_id(url), url))
+        return httpx.Response(404)
@@ -0,0 +1,183 @@
+"""Update-to-handler latency of long polling vs webhook against a local fake Bot API.
+
+A small tornado server plays the Bot API: it answers getMe/setWebhook/
+deleteWebhook, holds getUpdates long polls open until an update arrives and,
+once a webhook is registered, POSTs updates to it with the secret token
+header instead. A PTB Application pointed at it via base_url records when
+each update reaches its MessageHandler; the benchmark reports p50/p99 of that
+delay per mode as JSON. --network-latency delays every fake API response and
+webhook delivery, like the round trip to Telegram does.
+
+    python benchmarks/update_latency_benchmark.py --updates 200 --interval 0.01 --mode both
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import tornado.web
+from telegram import Update
+from telegram.ext import Application, ContextTypes, MessageHandler, filters
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BOT_TOKEN = "123456:benchmark"
+FAKE_API_PORT = 18081
+WEBHOOK_PORT = 18082
+WEBHOOK_SECRET = "benchmark-secret"
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FakeBotApi:
+    """Queues injected updates for getUpdates, or pushes them to the registered webhook."""
+
+    def __init__(self, network_latency: float):
+        self.network_latency = network_latency
+        self.updates: list[dict] = []
+        self.update_arrived = asyncio.Event()
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.sent_at: dict[int, float] = {}
+        self.calls: dict[str, int] = {}
+        self._http = httpx.AsyncClient()
+
+    async def handle(self, method: str, params: dict) -> object:
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return {"id": int(BOT_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "setWebhook":
+            self.webhook_url, self.webhook_secret = params["url"], params.get("secret_token", "")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            return True
+        if method == "getUpdates":
+            return await self._get_updates(int(params.get("offset", 0)), float(params.get("timeout", 0)))
+        return True
+
+    async def _get_updates(self, offset: int, timeout: float) -> list[dict]:
+        self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout:
+            self.update_arrived.clear()
+            try:
+                await asyncio.wait_for(self.update_arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [update for update in self.updates if update["update_id"] >= offset]
+
+    async def inject(self, update_id: int):
+        update = {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": "ping",
+            "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "Bench"}}}
+        self.sent_at[update_id] = time.monotonic()
+        if self.webhook_url:
+            await asyncio.sleep(self.network_latency)
+            await self._http.post(self.webhook_url, json=update,
+                                  headers={"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret})
+        else:
+            self.updates.append(update)
+            self.update_arrived.set()
+
+    async def close(self):
+        await self._http.aclose()
+
+
+class _BotApiHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotApi):
+        self.api = api
+
+    async def post(self, token: str, method: str):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:  # PTB sends form fields with JSON-encoded values
+            params = {}
+            for name, values in self.request.body_arguments.items():
+                raw = values[-1].decode()
+                try:
+                    params[name] = json.loads(raw)
+                except ValueError:
+                    params[name] = raw
+        result = await self.api.handle(method, params)
+        await asyncio.sleep(self.api.network_latency)
+        self.write({"ok": True, "result": result})
+
+    get = post
+
+
+async def run_mode(mode: str, args: argparse.Namespace, api: FakeBotApi) -> dict:
+    latencies: list[float] = []
+    all_handled = asyncio.Event()
+
+    async def on_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        latencies.append(time.monotonic() - api.sent_at[update.update_id])
+        if len(latencies) == args.updates: all_handled.set()
+
+    application = (Application.builder().token(BOT_TOKEN)
+                   .base_url(f"http://127.0.0.1:{FAKE_API_PORT}/bot").build())
+    application.add_handler(MessageHandler(filters.ALL, on_message))
+    api.sent_at.clear()
+    async with application:
+        if mode == "webhook":
+            await application.updater.start_webhook(
+                listen="127.0.0.1", port=WEBHOOK_PORT, url_path="telegram", secret_token=WEBHOOK_SECRET,
+                webhook_url=f"http://127.0.0.1:{WEBHOOK_PORT}/telegram", allowed_updates=[Update.MESSAGE])
+        else:
+            await application.updater.start_polling(poll_interval=0.0, timeout=10, allowed_updates=[Update.MESSAGE])
+        await application.start()
+        started = time.monotonic()
+        for update_id in range(1, args.updates + 1):
+            asyncio.create_task(api.inject(update_id))
+            await asyncio.sleep(args.interval)
+        try:
+            await asyncio.wait_for(all_handled.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            logging.warning(f"{mode}: handled {len(latencies)}/{args.updates} updates before the timeout")
+        elapsed = time.monotonic() - started
+        await application.updater.stop()
+        await application.stop()
+    return {"mode": mode, "updates": args.updates, "handled": len(latencies), "elapsed_seconds": round(elapsed, 3),
+            "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 2),
+            "latency_p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            "latency_max_ms": round(max(latencies, default=0.0) * 1000, 2)}
+
+
+async def main_async(args: argparse.Namespace) -> list[dict]:
+    api = FakeBotApi(args.network_latency)
+    server = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _BotApiHandler, {"api": api})]).listen(
+        FAKE_API_PORT, address="127.0.0.1")
+    modes = ["polling", "webhook"] if args.mode == "both" else [args.mode]
+    try:
+        return [await run_mode(mode, args, api) for mode in modes]
+    finally:
+        server.stop()
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between injected updates")
+    parser.add_argument("--network-latency", type=float, default=0.02,
+                        help="Added to every fake Bot API response and webhook delivery")
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    sys.path.insert(0, str(REPO_ROOT))
+
+    report = json.dumps(asyncio.run(main_async(args)), indent=2)
+    print(report)
+    if args.output:
+        Path(args.output).write_text(report + "\n", encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
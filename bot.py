@@ -2,10 +2,11 @@ import logging
 from pathlib import Path
 from typing import Optional, cast
 import asyncio
+import secrets
 
 from telegram import Update, Message
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters,
+    Application, BaseHandler, CommandHandler, MessageHandler, filters,
     CallbackQueryHandler, ContextTypes, ConversationHandler, Defaults
 )
 import telegram.error
@@ -23,7 +24,7 @@ import db
 import ui_texts
 from handlers_direct_download import handle_soundcloud_link
 from handlers_menu import (
-    MAIN_MENU, SETTINGS_MENU, AWAIT_SC_USERNAME, AWAIT_SYNC_PERIOD, INFO_MENU, ERROR_LOG_MENU,
+    MAIN_MENU, SETTINGS_MENU, AWAIT_SC_USERNAME, AWAIT_SYNC_PERIOD, INFO_MENU, ERROR_LOG_MENU, STATS_MENU,
     AWAITING_TEXT_INPUT_KEY,
     menu_command, main_menu_callback, info_menu_callback,
     display_settings_menu, settings_menu_callback,
@@ -32,7 +33,19 @@ from handlers_menu import (
     display_error_log_menu, error_log_menu_callback,
     update_user_status_message
 )
-from handlers_sync import sync_user_likes_command, scheduled_sync_task
+from handlers_sync import synclikesnow_command, scheduled_sync_task
+from handlers_admin import stages_command, stats_command, stats_menu_callback
+import metrics
+import download_queue
+import hls_download
+import jobs
+import loop_monitor
+import outbox
+import temp_storage
+import warm_downloader
+from config import (METRICS_HTTP_HOST, METRICS_HTTP_PORT, METRICS_EXPORT_FILE, LOOP_MONITOR_ENABLED,
+                    TEMP_SWEEP_INTERVAL_MINUTES, TEMP_SWEEP_MAX_AGE_MINUTES, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT,
+                    WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, DOWNLOAD_BACKEND, WORKER_PROCESSES)
 
 log_formatter = logging.Formatter("%(asctime)s - %(name)s [%(levelname)s] - %(message)s (%(filename)s:%(lineno)d)")
 root_logger = logging.getLogger()
@@ -45,6 +58,8 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram.ext").setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 
+METRICS_EXPORT_INTERVAL = 60
+
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error("Исключение при обработке обновления:", exc_info=context.error)
@@ -64,8 +79,7 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
                     settings = db.get_user_settings(user_id_for_db)
                     if settings and settings.get('status_message_id'):
                         try:
-                            await context.bot.delete_message(chat_id=user_id_for_db,
-                                                             message_id=settings['status_message_id'])
+                            await outbox.delete(context.bot, user_id_for_db, settings['status_message_id'])
                             logger.info(
                                 f"Status message {settings['status_message_id']} deleted for user {user_id_for_db} due to blocking/deactivation.")
                         except telegram.error.TelegramError as e_del_status:
@@ -80,6 +94,21 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 
 async def post_shutdown(application: Application) -> None:
+    metrics_server = application.bot_data.pop("metrics_server", None)
+    if metrics_server:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await jobs.shutdown()
+    if DOWNLOAD_BACKEND == "workers":
+        await download_queue.stop_workers()
+    await warm_downloader.stop()
+    if LOOP_MONITOR_ENABLED:
+        await loop_monitor.stop()
+    from media_tasks import shutdown_media_executor
+    shutdown_media_executor()
+    from soundcloud_api import close_http_client
+    await close_http_client()
+    await hls_download.close_http_client()
     from pyrogram_sender import stop_pyrogram_client
     await stop_pyrogram_client()
     logger.info("Bot post_shutdown: Pyrogram client stopped.")
@@ -89,13 +118,31 @@ async def post_init(application: Application) -> None:
     application.bot_data["BOT_VERSION"] = BOT_VERSION
     logger.info(f"Bot post_init: Установлена версия бота: {BOT_VERSION}")
 
-    # Pre-init Pyrogram client so first upload is fast
-    try:
-        from pyrogram_sender import get_pyrogram_client
-        await get_pyrogram_client()
-        logger.info("Bot post_init: Pyrogram client pre-initialized.")
-    except Exception as e:
-        logger.warning(f"Bot post_init: Failed to pre-init Pyrogram client: {e}")
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+    # Nothing is being downloaded yet, so everything left in the temp folders is from a previous run
+    temp_storage.storage.sweep(max_age_seconds=0)
+
+    if METRICS_HTTP_PORT:
+        try:
+            application.bot_data["metrics_server"] = await metrics.start_metrics_server(METRICS_HTTP_HOST,
+                                                                                       METRICS_HTTP_PORT)
+        except OSError as e_metrics:
+            logger.error(f"Bot post_init: Не удалось запустить HTTP-эндпоинт метрик: {e_metrics}")
+
+    if DOWNLOAD_BACKEND == "workers":
+        # Tracks are downloaded and uploaded by the worker processes, each with its own Pyrogram session
+        await download_queue.start_workers(WORKER_PROCESSES)
+        logger.info(f"Bot post_init: Запущено воркеров загрузки: {WORKER_PROCESSES}.")
+    else:
+        # Pre-init Pyrogram client so first upload is fast
+        try:
+            from pyrogram_sender import get_pyrogram_client
+            await get_pyrogram_client()
+            logger.info("Bot post_init: Pyrogram client pre-initialized.")
+        except Exception as e:
+            logger.warning(f"Bot post_init: Failed to pre-init Pyrogram client: {e}")
     logger.info("Bot post_init: Обновление статусных сообщений для активных пользователей...")
     all_users_with_status_msg = db.get_all_users_with_status_message()
 
@@ -133,6 +180,32 @@ async def post_init(application: Application) -> None:
         f"Bot post_init: Обновление статусных сообщений ({len(all_users_with_status_msg)} пользователей) завершено.")
 
 
+def allowed_update_types(handlers: list[BaseHandler]) -> list[str]:
+    """Update types the registered handlers can react to, so Telegram does not send the rest."""
+    update_types: set[str] = set()
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = [*handler.entry_points, *handler.fallbacks,
+                      *(state_handler for state_handlers in handler.states.values() for state_handler in state_handlers)]
+            update_types.update(allowed_update_types(nested))
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            update_types.add(Update.MESSAGE)
+        elif isinstance(handler, CallbackQueryHandler):
+            update_types.add(Update.CALLBACK_QUERY)
+        else:
+            logger.warning(f"Неизвестный тип обработчика {type(handler).__name__}, подписываемся на все типы обновлений.")
+            return list(Update.ALL_TYPES)
+    return sorted(update_types)
+
+
+async def export_metrics_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    metrics.export_to_file(METRICS_EXPORT_FILE)
+
+
+async def sweep_temp_storage_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    temp_storage.storage.sweep(max_age_seconds=TEMP_SWEEP_MAX_AGE_MINUTES * 60)
+
+
 def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
         logger.critical("TELEGRAM_BOT_TOKEN не найден в config.py!")
@@ -156,10 +229,11 @@ def main() -> None:
     application.add_error_handler(error_handler)
 
     menu_conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", menu_command), CommandHandler("menu", menu_command)],
+        entry_points=[CommandHandler("start", menu_command), CommandHandler("menu", menu_command),
+                      CommandHandler("stats", stats_command)],
         states={
             MAIN_MENU: [CallbackQueryHandler(main_menu_callback,
-                                             pattern="^(settings_menu_nav|info_bot_nav|sync_now_nav|error_log_nav|close_menu_nav|back_to_main_menu_nav)$")],
+                                             pattern="^(settings_menu_nav|info_bot_nav|sync_now_nav|error_log_nav|stats_nav|close_menu_nav|back_to_main_menu_nav)$")],
             INFO_MENU: [CallbackQueryHandler(info_menu_callback, pattern="^back_to_main_menu_nav$")],
             SETTINGS_MENU: [CallbackQueryHandler(settings_menu_callback)],
             AWAIT_SC_USERNAME: [
@@ -171,9 +245,11 @@ def main() -> None:
                 CallbackQueryHandler(back_to_settings_from_input_callback, pattern="^back_to_settings_from_input$")
             ],
             ERROR_LOG_MENU: [CallbackQueryHandler(error_log_menu_callback,
-                                                  pattern="^(clear_error_log|back_to_main_from_log|err_log_prev_page|err_log_next_page)$")]
+                                                  pattern="^(clear_error_log|back_to_main_from_log|err_log_prev_page|err_log_next_page)$")],
+            STATS_MENU: [CallbackQueryHandler(stats_menu_callback, pattern="^(stats_refresh|back_to_main_from_stats)$")]
         },
-        fallbacks=[CommandHandler("start", menu_command), CommandHandler("menu", menu_command)],
+        fallbacks=[CommandHandler("start", menu_command), CommandHandler("menu", menu_command),
+                   CommandHandler("stats", stats_command)],
         name="user_menu_conversation",
         persistent=False
     )
@@ -183,7 +259,8 @@ def main() -> None:
     application.add_handler(
         MessageHandler(filters.TEXT & ~filters.COMMAND & soundcloud_link_filter, handle_soundcloud_link), group=1)
 
-    application.add_handler(CommandHandler("synclikesnow", sync_user_likes_command))
+    application.add_handler(CommandHandler("synclikesnow", synclikesnow_command))
+    application.add_handler(CommandHandler("stages", stages_command))
 
     job_queue = application.job_queue
     num_users_for_post_init_estimate = len(db.get_all_users_with_status_message())
@@ -193,12 +270,28 @@ def main() -> None:
     job_queue_first_run_delay = post_init_estimated_duration + 30
 
     job_queue.run_repeating(scheduled_sync_task, interval=600   , first=job_queue_first_run_delay)
+    job_queue.run_repeating(sweep_temp_storage_job, interval=TEMP_SWEEP_INTERVAL_MINUTES * 60,
+                            first=TEMP_SWEEP_INTERVAL_MINUTES * 60)
+    if METRICS_EXPORT_FILE:
+        job_queue.run_repeating(export_metrics_job, interval=METRICS_EXPORT_INTERVAL, first=METRICS_EXPORT_INTERVAL)
+
     logger.info(
         f"Планировщик задач запущен (проверка каждый час, первая через ~{job_queue_first_run_delay:.0f} сек, "
         f"исходя из {num_users_for_post_init_estimate} пользователей в post_init).")
 
-    logger.info("Бот запускается...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    allowed_updates = allowed_update_types(
+        [handler for group_handlers in application.handlers.values() for handler in group_handlers])
+    if WEBHOOK_URL:
+        # Without a configured secret a fresh one per start is enough: run_webhook registers it with Telegram
+        secret_token = WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+        logger.info(f"Бот запускается в режиме webhook ({WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}), "
+                    f"обновления: {', '.join(allowed_updates)}...")
+        application.run_webhook(listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, url_path=WEBHOOK_PATH,
+                                webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}", secret_token=secret_token,
+                                allowed_updates=allowed_updates)
+    else:
+        logger.info(f"Бот запускается (long polling), обновления: {', '.join(allowed_updates)}...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
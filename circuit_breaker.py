@@ -0,0 +1,176 @@
+"""Circuit breaker shared by all SoundCloud-bound work of the process.
+
+When SoundCloud starts throttling (HTTP 429, or 403 for every track), each
+track would still run the whole pipeline, fail and land in failed_tracks.
+Instead, every SoundCloud download or listing runs inside request() and
+reports its outcome here, as do api-v2 metadata and artwork requests. After
+CIRCUIT_BREAKER_THRESHOLD throttled failures without a successful request in
+between, the breaker opens. All requests then wait for the pause to pass, so
+no track goes ahead with metadata or a cover missing because of the pause.
+Requests made inside another request (the api-v2 lookups of an HLS download)
+neither wait nor probe: the outer request already did. When the pause is over,
+a single request is let through as the probe. If it succeeds, the breaker
+closes and the waiting requests continue. If it is throttled again, the breaker
+reopens with twice the pause, up to CIRCUIT_BREAKER_MAX_SECONDS. A pause that
+ends well halves the next one, back down to CIRCUIT_BREAKER_BASE_SECONDS.
+
+    async with circuit_breaker.request() as soundcloud_call:
+        error = await download(...)
+        soundcloud_call.report(error)  # None on success, else the tool's error text
+"""
+import logging
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Optional
+
+from config import CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_BASE_SECONDS, CIRCUIT_BREAKER_MAX_SECONDS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_RATE_LIMITED_RE = re.compile(r"\b429\b|too many requests|rate.?limit", re.IGNORECASE)
+_FORBIDDEN_RE = re.compile(r"\b403\b|forbidden", re.IGNORECASE)
+
+_state = CLOSED
+_failures = 0  # throttled failures since the last successful request
+_pause = float(CIRCUIT_BREAKER_BASE_SECONDS)
+_open_until = 0.0
+_changed = asyncio.Event()
+_in_request: ContextVar[bool] = ContextVar("soundcloud_request", default=False)
+
+
+def classify(error_text: str) -> Optional[str]:
+    """"rate_limited" or "forbidden" if an error message looks like SoundCloud throttling, else None."""
+    if _RATE_LIMITED_RE.search(error_text): return "rate_limited"
+    if _FORBIDDEN_RE.search(error_text): return "forbidden"
+    return None
+
+
+def enabled() -> bool:
+    return CIRCUIT_BREAKER_THRESHOLD > 0
+
+
+def is_closed() -> bool:
+    return _state == CLOSED
+
+
+def stats() -> dict:
+    return {"state": _state, "seconds_left": max(0, int(_open_until - time.monotonic())) if _state == OPEN else 0,
+            "pause": int(_pause)}
+
+
+def _set_state(state: str):
+    global _state, _changed
+    _state = state
+    metrics.registry.gauge("soundcloud_circuit_state",
+                           help_text="SoundCloud circuit breaker: 0 closed, 1 probing, 2 open").set(_STATE_VALUES[state])
+    # Wake the waiters; later waiters wait on a fresh event
+    _changed.set()
+    _changed = asyncio.Event()
+
+
+def _open(pause: float, reason: str):
+    global _pause, _open_until
+    _pause = min(float(CIRCUIT_BREAKER_MAX_SECONDS), pause)
+    _open_until = time.monotonic() + _pause
+    _set_state(OPEN)
+    metrics.record_event("soundcloud_circuit_opened", help_text="Times the SoundCloud circuit breaker opened")
+    logger.warning(f"SoundCloud ограничивает запросы ({reason}): загрузки приостановлены на {_pause:.0f} с.")
+
+
+def record_throttled(kind: str, probe: bool = False):
+    """A SoundCloud request was throttled; opens the breaker at the threshold, or again after a failed probe."""
+    global _failures
+    _failures += 1
+    metrics.record_event("soundcloud_throttled", labels={"kind": kind},
+                         help_text="SoundCloud requests rejected as throttled")
+    if not enabled(): return
+    if probe and _state == HALF_OPEN:
+        _open(_pause * 2, f"пробный запрос: {kind}")
+    elif _state == CLOSED and _failures >= CIRCUIT_BREAKER_THRESHOLD:
+        _open(CIRCUIT_BREAKER_BASE_SECONDS, f"{_failures} ответов {kind} подряд")
+
+
+def record_success(probe: bool = False):
+    global _failures, _pause
+    _failures = 0
+    if probe and _state == HALF_OPEN:
+        _pause = max(float(CIRCUIT_BREAKER_BASE_SECONDS), _pause / 2)
+        _set_state(CLOSED)
+        logger.info("Пробный запрос к SoundCloud прошёл, загрузки возобновлены.")
+
+
+def _release_probe():
+    """The probe ended without telling whether SoundCloud still throttles: let the next request probe."""
+    if _state == HALF_OPEN:
+        _set_state(OPEN)  # _open_until has passed, so the next waiter becomes the probe right away
+
+
+async def _wait_ready() -> bool:
+    """Wait until SoundCloud requests are allowed; True if the caller was let through as the probe."""
+    while _state != CLOSED:
+        changed = _changed
+        if _state == OPEN:
+            remaining = _open_until - time.monotonic()
+            if remaining <= 0:
+                _set_state(HALF_OPEN)
+                return True
+        else:
+            remaining = None  # a probe is in flight
+        try:
+            await asyncio.wait_for(changed.wait(), remaining)
+        except asyncio.TimeoutError:
+            pass
+    return False
+
+
+class SoundCloudCall:
+    def __init__(self, probe: bool):
+        self.probe = probe
+        self.reported = False
+        self.error: Optional[str] = None
+
+    def report(self, error: Optional[str]):
+        """Outcome of the request: None on success, else the error text to classify."""
+        self.reported, self.error = True, error
+
+    @property
+    def throttled(self) -> bool:
+        return bool(self.error) and classify(self.error) is not None
+
+    def _settle(self):
+        if not self.reported:
+            if self.probe: _release_probe()
+        elif self.error is None:
+            record_success(self.probe)
+        elif kind := classify(self.error):
+            record_throttled(kind, self.probe)
+        elif self.probe:
+            # SoundCloud answered with something else (a deleted track, say): it is not throttling any more
+            record_success(self.probe)
+
+
+@asynccontextmanager
+async def request() -> AsyncIterator[SoundCloudCall]:
+    """Wait for the breaker, then run one SoundCloud request; report() its outcome before leaving the block."""
+    if _in_request.get():
+        # The outer request waited and may be the probe: waiting again here would wait for the outer one
+        soundcloud_call = SoundCloudCall(False)
+        try:
+            yield soundcloud_call
+        finally:
+            soundcloud_call._settle()
+        return
+    soundcloud_call = SoundCloudCall(await _wait_ready() if enabled() else False)
+    token = _in_request.set(True)
+    try:
+        yield soundcloud_call
+    finally:
+        _in_request.reset(token)
+        soundcloud_call._settle()
@@ -15,6 +15,31 @@ def _require_env(name: str) -> str:
 	return value
 
 
+def _int_list_env(name: str) -> tuple[int, ...]:
+	value = os.getenv(name, "")
+	try:
+		return tuple(int(item) for item in value.replace(";", ",").split(",") if item.strip())
+	except ValueError as exc:
+		raise RuntimeError(f"Environment variable {name} must be a comma-separated list of integers") from exc
+
+
+def _bool_env(name: str, default: bool = False) -> bool:
+	value = os.getenv(name)
+	if not value:
+		return default
+	return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _int_env(name: str, default: int) -> int:
+	value = os.getenv(name)
+	if not value:
+		return default
+	try:
+		return int(value)
+	except ValueError as exc:
+		raise RuntimeError(f"Environment variable {name} must be an integer") from exc
+
+
 TELEGRAM_BOT_TOKEN = _require_env("TELEGRAM_BOT_TOKEN")
 DOWNLOAD_FOLDER = os.getenv("DOWNLOAD_FOLDER", "downloads")
 BOT_VERSION = os.getenv("BOT_VERSION", "1.1.0")
@@ -24,3 +49,59 @@ try:
 	API_ID = int(_require_env("API_ID"))
 except ValueError as exc:
 	raise RuntimeError("Environment variable API_ID must be an integer") from exc
+
+DOWNLOAD_CONCURRENCY = max(1, _int_env("DOWNLOAD_CONCURRENCY", 2))
+DIRECT_BATCH_MAX_TRACKS = max(1, _int_env("DIRECT_BATCH_MAX_TRACKS", 100))
+# Stop reading the likes listing after this many consecutive already synced likes, 0 reads it all
+SYNC_EARLY_STOP_KNOWN_LIKES = max(0, _int_env("SYNC_EARLY_STOP_KNOWN_LIKES", 0))
+JOB_MAX_CONCURRENT = max(1, _int_env("JOB_MAX_CONCURRENT", 8))
+# "inprocess" downloads in the bot process, "workers" hands tracks to worker.py processes through the DB queue
+DOWNLOAD_BACKEND = os.getenv("DOWNLOAD_BACKEND", "inprocess").strip().lower()
+if DOWNLOAD_BACKEND not in ("inprocess", "workers"):
+	raise RuntimeError("Environment variable DOWNLOAD_BACKEND must be 'inprocess' or 'workers'")
+WORKER_PROCESSES = max(1, _int_env("WORKER_PROCESSES", os.cpu_count() or 1))
+WORKER_LEASE_SECONDS = max(30, _int_env("WORKER_LEASE_SECONDS", 120))
+SOUNDCLOUD_CLIENT_ID = os.getenv("SOUNDCLOUD_CLIENT_ID", "")
+MEDIA_WORKERS = max(1, _int_env("MEDIA_WORKERS", min(4, os.cpu_count() or 1)))
+# Long-lived yt-dlp processes that download tracks instead of one scdl process per track, 0 keeps scdl
+WARM_DOWNLOADERS = max(0, _int_env("WARM_DOWNLOADERS", 0))
+# Fetch HLS streams segment by segment ourselves, several segments at a time
+HLS_DOWNLOAD_ENABLED = _bool_env("HLS_DOWNLOAD_ENABLED")
+HLS_CONNECTIONS_PER_DOWNLOAD = max(1, _int_env("HLS_CONNECTIONS_PER_DOWNLOAD", 4))
+HLS_MAX_CONNECTIONS = max(1, _int_env("HLS_MAX_CONNECTIONS", 16))
+# Pause SoundCloud downloads after this many throttled (HTTP 429/403) failures in a row, 0 disables the breaker
+CIRCUIT_BREAKER_THRESHOLD = max(0, _int_env("CIRCUIT_BREAKER_THRESHOLD", 3))
+CIRCUIT_BREAKER_BASE_SECONDS = max(1, _int_env("CIRCUIT_BREAKER_BASE_SECONDS", 30))
+CIRCUIT_BREAKER_MAX_SECONDS = max(CIRCUIT_BREAKER_BASE_SECONDS, _int_env("CIRCUIT_BREAKER_MAX_SECONDS", 900))
+# Limits for yt-dlp/scdl/ffmpeg processes, 0 means no limit
+SUBPROCESS_CPU_SECONDS = max(0, _int_env("SUBPROCESS_CPU_SECONDS", 0))
+SUBPROCESS_MEMORY_MB = max(0, _int_env("SUBPROCESS_MEMORY_MB", 0))
+PYROGRAM_MAX_CONCURRENT_TRANSMISSIONS = max(1, _int_env("PYROGRAM_MAX_CONCURRENT_TRANSMISSIONS", 4))
+UPLOAD_PROGRESS_INTERVAL_SECONDS = max(1, _int_env("UPLOAD_PROGRESS_INTERVAL_SECONDS", 3))
+# Minimum seconds between progress edits of a track status message (download, transcode, upload)
+PROGRESS_UPDATE_INTERVAL_SECONDS = max(1, _int_env("PROGRESS_UPDATE_INTERVAL_SECONDS", UPLOAD_PROGRESS_INTERVAL_SECONDS))
+
+TEMP_STORAGE_BUDGET_MB = max(0, _int_env("TEMP_STORAGE_BUDGET_MB", 4096))
+TEMP_STORAGE_MIN_FREE_MB = max(0, _int_env("TEMP_STORAGE_MIN_FREE_MB", 512))
+TEMP_RAM_FOLDER = os.getenv("TEMP_RAM_FOLDER", "")
+TEMP_RAM_BUDGET_MB = max(0, _int_env("TEMP_RAM_BUDGET_MB", 256))
+TEMP_RAM_MAX_ITEM_MB = max(0, _int_env("TEMP_RAM_MAX_ITEM_MB", 40))
+TEMP_SWEEP_INTERVAL_MINUTES = max(1, _int_env("TEMP_SWEEP_INTERVAL_MINUTES", 30))
+TEMP_SWEEP_MAX_AGE_MINUTES = max(1, _int_env("TEMP_SWEEP_MAX_AGE_MINUTES", 120))
+
+ADMIN_USER_IDS = _int_list_env("ADMIN_USER_IDS")
+METRICS_HTTP_HOST = os.getenv("METRICS_HTTP_HOST", "127.0.0.1")
+METRICS_HTTP_PORT = _int_env("METRICS_HTTP_PORT", 0)
+METRICS_EXPORT_FILE = os.getenv("METRICS_EXPORT_FILE", "")
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE", "")
+
+# Webhook mode is used when WEBHOOK_URL (the public https base URL Telegram posts to) is set, long polling otherwise
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = _int_env("WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
+
+LOOP_MONITOR_ENABLED = _bool_env("LOOP_MONITOR_ENABLED")
+LOOP_SLOW_CALLBACK_MS = max(1, _int_env("LOOP_SLOW_CALLBACK_MS", 100))
+LOOP_LAG_SAMPLE_INTERVAL_MS = max(10, _int_env("LOOP_LAG_SAMPLE_INTERVAL_MS", 500))
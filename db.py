@@ -1,12 +1,30 @@
 import sqlite3
 from pathlib import Path
 import logging
+import functools
+import time
 from datetime import datetime, timezone, timedelta
 
+import metrics
+from utils import normalize_soundcloud_url
+
 logger = logging.getLogger(__name__)
 DATABASE_FILE = Path(__file__).resolve().parent / "soundcloud_bot.db"
 
 
+def _instrumented(func):
+    """Publish call latency of a DB helper to the metrics registry (op label = function name)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.record_duration("db_query", time.perf_counter() - started, {"op": func.__name__},
+                                    help_text="Latency of SQLite helper calls")
+    return wrapper
+
+
 def _add_column_if_not_exists(cursor, table_name, column_name, column_type):
     cursor.execute(f"PRAGMA table_info({table_name})")
     columns = [info[1] for info in cursor.fetchall()]
@@ -26,6 +44,41 @@ def _drop_column_if_exists(cursor, table_name, column_name):
                        f"Если она больше не нужна, рассмотрите возможность ее удаления вручную или через миграцию.")
 
 
+def _rekey_track_identifier(cursor, old_identifier: str, new_identifier: str):
+    for table_name in ("downloaded_tracks", "failed_tracks"):
+        cursor.execute(f"UPDATE OR IGNORE {table_name} SET track_identifier = ? WHERE track_identifier = ?",
+                       (new_identifier, old_identifier))
+        # Rows left behind collided with an existing row under the new key for the same user
+        cursor.execute(f"DELETE FROM {table_name} WHERE track_identifier = ?", (old_identifier,))
+
+
+def _migrate_normalize_track_identifiers(cursor):
+    cursor.execute("SELECT track_identifier FROM downloaded_tracks UNION SELECT track_identifier FROM failed_tracks")
+    raw_identifiers = [row[0] for row in cursor.fetchall() if row[0]]
+    rekeyed = 0
+    for raw_identifier in raw_identifiers:
+        normalized = normalize_soundcloud_url(raw_identifier)
+        if normalized and normalized != raw_identifier:
+            _rekey_track_identifier(cursor, raw_identifier, normalized)
+            rekeyed += 1
+    logger.info(f"Миграция: нормализовано {rekeyed} идентификаторов треков из {len(raw_identifiers)}.")
+
+
+MIGRATIONS = (
+    _migrate_normalize_track_identifiers,
+)
+
+
+def _run_migrations(cursor):
+    cursor.execute("PRAGMA user_version")
+    current_version = cursor.fetchone()[0]
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current_version: continue
+        migration(cursor)
+        cursor.execute(f"PRAGMA user_version = {version}")
+        logger.info(f"Применена миграция БД #{version} ({migration.__name__}).")
+
+
 def initialize_db():
     try:
         conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
@@ -76,10 +129,15 @@ def initialize_db():
                            DEFAULT
                            'old_first',
                            status_message_id
-                           INTEGER
+                           INTEGER,
+                           audio_profile
+                           TEXT
+                           DEFAULT
+                           'mp3_192'
                        )
                        """)
         _add_column_if_not_exists(cursor, "users", "status_message_id", "INTEGER")
+        _add_column_if_not_exists(cursor, "users", "audio_profile", "TEXT DEFAULT 'mp3_192'")
 
         cursor.execute("""
                        CREATE TABLE IF NOT EXISTS downloaded_tracks
@@ -165,6 +223,122 @@ def initialize_db():
                        ) ON DELETE CASCADE
                            )
                        """)
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS track_aliases
+                       (
+                           alias
+                           TEXT
+                           PRIMARY
+                           KEY,
+                           track_key
+                           TEXT
+                           NOT
+                           NULL
+                       )
+                       """)
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS tracks
+                       (
+                           track_key
+                           TEXT
+                           PRIMARY
+                           KEY,
+                           track_id
+                           TEXT,
+                           permalink_url
+                           TEXT,
+                           title
+                           TEXT,
+                           artist
+                           TEXT,
+                           duration_ms
+                           INTEGER,
+                           artwork_url
+                           TEXT,
+                           artwork_hash
+                           TEXT,
+                           updated_at
+                           DATETIME
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       """)
+        _add_column_if_not_exists(cursor, "tracks", "artwork_hash", "TEXT")
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS track_files
+                       (
+                           track_key
+                           TEXT,
+                           profile
+                           TEXT,
+                           telegram_file_id
+                           TEXT,
+                           file_size
+                           INTEGER,
+                           codec
+                           TEXT,
+                           updated_at
+                           DATETIME
+                           DEFAULT
+                           CURRENT_TIMESTAMP,
+                           PRIMARY
+                           KEY
+                       (
+                           track_key,
+                           profile
+                       )
+                           )
+                       """)
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS download_jobs
+                       (
+                           id
+                           INTEGER
+                           PRIMARY
+                           KEY
+                           AUTOINCREMENT,
+                           user_id
+                           INTEGER,
+                           chat_id
+                           INTEGER,
+                           url
+                           TEXT,
+                           track_key
+                           TEXT,
+                           status_message_id
+                           INTEGER,
+                           text_prefix
+                           TEXT,
+                           reply_to_message_id
+                           INTEGER,
+                           status
+                           TEXT
+                           DEFAULT
+                           'queued',
+                           attempts
+                           INTEGER
+                           DEFAULT
+                           0,
+                           lease_owner
+                           TEXT,
+                           lease_expires_at
+                           REAL,
+                           success
+                           BOOLEAN,
+                           sent_message_id
+                           INTEGER,
+                           error
+                           TEXT,
+                           created_at
+                           DATETIME
+                           DEFAULT
+                           CURRENT_TIMESTAMP
+                       )
+                       """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_download_jobs_status ON download_jobs (status, id)")
+        # The bot and the download worker processes share the file; WAL lets readers run during writes
+        cursor.execute("PRAGMA journal_mode=WAL")
+        _run_migrations(cursor)
         conn.commit()
     except sqlite3.Error as e:
         logger.error(f"Ошибка БД (init): {e}")
@@ -172,6 +346,7 @@ def initialize_db():
         if conn: conn.close()
 
 
+@_instrumented
 def get_user_settings(user_id: int) -> dict | None:
     try:
         conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
@@ -187,11 +362,13 @@ def get_user_settings(user_id: int) -> dict | None:
         if conn: conn.close()
 
 
+@_instrumented
 def update_user_settings(user_id: int, soundcloud_username: str | None = None,
                          sync_enabled: bool | None = None, sync_period_hours: int | None = None,
                          last_sync_timestamp: datetime | None = None,
                          sync_order: str | None = None,
                          status_message_id: int | None = None,
+                         audio_profile: str | None = None,
                          is_new_user_setup: bool = False,
                          set_status_msg_id_to_null: bool = False):
     conn = sqlite3.connect(DATABASE_FILE);
@@ -221,6 +398,7 @@ def update_user_settings(user_id: int, soundcloud_username: str | None = None,
             fields_to_update['last_sync_timestamp'] = None
 
         add_field('sync_order', sync_order, 'old_first' if is_new_user_setup else None)
+        add_field('audio_profile', audio_profile)
 
         if status_message_id is not None:
             fields_to_update['status_message_id'] = status_message_id
@@ -263,6 +441,7 @@ def update_user_settings(user_id: int, soundcloud_username: str | None = None,
         if conn: conn.close()
 
 
+@_instrumented
 def add_downloaded_track(user_id: int, track_identifier: str, telegram_message_id: int | None):
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -277,6 +456,7 @@ def add_downloaded_track(user_id: int, track_identifier: str, telegram_message_i
         if conn: conn.close()
 
 
+@_instrumented
 def is_track_downloaded(user_id: int, track_identifier: str) -> bool:
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -292,6 +472,7 @@ def is_track_downloaded(user_id: int, track_identifier: str) -> bool:
         if conn: conn.close()
 
 
+@_instrumented
 def log_user_error(user_id: int, error_message: str, context_info: str | None = None):
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -306,6 +487,7 @@ def log_user_error(user_id: int, error_message: str, context_info: str | None =
         if conn: conn.close()
 
 
+@_instrumented
 def get_user_errors(user_id: int, limit: int = 10, offset: int = 0) -> list[dict]:
     conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     conn.row_factory = sqlite3.Row
@@ -324,6 +506,7 @@ def get_user_errors(user_id: int, limit: int = 10, offset: int = 0) -> list[dict
         if conn: conn.close()
 
 
+@_instrumented
 def count_user_errors(user_id: int) -> int:
     conn = sqlite3.connect(DATABASE_FILE)
     cursor = conn.cursor()
@@ -338,6 +521,7 @@ def count_user_errors(user_id: int) -> int:
         if conn: conn.close()
 
 
+@_instrumented
 def clear_user_errors(user_id: int):
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -350,6 +534,7 @@ def clear_user_errors(user_id: int):
         if conn: conn.close()
 
 
+@_instrumented
 def add_failed_track(user_id: int, track_identifier: str, reason: str | None = None):
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -365,6 +550,7 @@ def add_failed_track(user_id: int, track_identifier: str, reason: str | None = N
         if conn: conn.close()
 
 
+@_instrumented
 def is_track_failed(user_id: int, track_identifier: str) -> bool:
     conn = sqlite3.connect(DATABASE_FILE);
     cursor = conn.cursor()
@@ -380,6 +566,7 @@ def is_track_failed(user_id: int, track_identifier: str) -> bool:
         if conn: conn.close()
 
 
+@_instrumented
 def get_users_for_scheduled_sync() -> list[dict]:
     conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     conn.row_factory = sqlite3.Row
@@ -449,6 +636,7 @@ def get_users_for_scheduled_sync() -> list[dict]:
         if conn: conn.close()
 
 
+@_instrumented
 def get_all_users_with_status_message() -> list[dict]:
     conn = sqlite3.connect(DATABASE_FILE, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
     conn.row_factory = sqlite3.Row
@@ -460,4 +648,348 @@ def get_all_users_with_status_message() -> list[dict]:
         logger.error(f"Ошибка БД (get_all_users_with_status_message): {e}")
         return []
     finally:
-        if conn: conn.close()
\ No newline at end of file
+        if conn: conn.close()
+
+@_instrumented
+def get_track_alias(alias: str) -> str | None:
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT track_key FROM track_aliases WHERE alias = ?", (alias,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (get_track_alias '{alias}'): {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def add_track_aliases(aliases: list[tuple[str, str]]) -> int:
+    """Store alias -> canonical key pairs and move already stored rows from the alias to the key.
+
+    Returns the number of aliases that were not known before.
+    """
+    if not aliases: return 0
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    added = 0
+    try:
+        for alias, track_key in aliases:
+            if alias == track_key: continue
+            cursor.execute("INSERT OR IGNORE INTO track_aliases (alias, track_key) VALUES (?, ?)", (alias, track_key))
+            if cursor.rowcount:
+                added += 1
+                _rekey_track_identifier(cursor, alias, track_key)
+        conn.commit()
+        return added
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (add_track_aliases, {len(aliases)} шт.): {e}")
+        return 0
+    finally:
+        if conn: conn.close()
+
+
+TRACK_METADATA_FIELDS = ("track_id", "permalink_url", "title", "artist", "duration_ms", "artwork_url", "artwork_hash")
+
+
+@_instrumented
+def upsert_tracks(tracks: list[dict]) -> int:
+    """Insert or refresh canonical track metadata.
+
+    Each dict needs ``track_key`` and any of TRACK_METADATA_FIELDS; missing or None fields keep their stored value.
+    """
+    if not tracks: return 0
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        columns = ", ".join(TRACK_METADATA_FIELDS)
+        updates = ", ".join(f"{field} = COALESCE(excluded.{field}, {field})" for field in TRACK_METADATA_FIELDS)
+        cursor.executemany(
+            f"INSERT INTO tracks (track_key, {columns}, updated_at) "
+            f"VALUES (?, {', '.join('?' for _ in TRACK_METADATA_FIELDS)}, ?) "
+            f"ON CONFLICT(track_key) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+            [(track["track_key"], *(track.get(field) for field in TRACK_METADATA_FIELDS),
+              datetime.now(timezone.utc)) for track in tracks])
+        conn.commit()
+        return len(tracks)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (upsert_tracks, {len(tracks)} шт.): {e}")
+        return 0
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def get_track(track_key: str) -> dict | None:
+    conn = sqlite3.connect(DATABASE_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM tracks WHERE track_key = ?", (track_key,))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (get_track '{track_key}'): {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def get_known_track_keys(track_keys: list[str]) -> set[str]:
+    """Subset of the given keys whose ``tracks`` row holds API metadata (a track_id), not only pipeline fallbacks."""
+    if not track_keys: return set()
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    known: set[str] = set()
+    try:
+        for start in range(0, len(track_keys), 500):
+            chunk = track_keys[start:start + 500]
+            cursor.execute(f"SELECT track_key FROM tracks WHERE track_id IS NOT NULL "
+                           f"AND track_key IN ({', '.join('?' for _ in chunk)})", chunk)
+            known.update(row[0] for row in cursor.fetchall())
+        return known
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (get_known_track_keys, {len(track_keys)} шт.): {e}")
+        return known
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def get_processed_track_keys(user_id: int, track_keys: list[str]) -> set[str]:
+    """Subset of the given keys the user already has, or that failed for them (the sync skips both)."""
+    if not track_keys: return set()
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    processed: set[str] = set()
+    try:
+        for start in range(0, len(track_keys), 400):
+            chunk = track_keys[start:start + 400]  # bound twice per query, under SQLite's 999 parameters
+            placeholders = ', '.join('?' for _ in chunk)
+            cursor.execute(f"SELECT track_identifier FROM downloaded_tracks WHERE user_id = ? "
+                           f"AND track_identifier IN ({placeholders}) "
+                           f"UNION SELECT track_identifier FROM failed_tracks WHERE user_id = ? "
+                           f"AND track_identifier IN ({placeholders})", (user_id, *chunk, user_id, *chunk))
+            processed.update(row[0] for row in cursor.fetchall())
+        return processed
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (get_processed_track_keys for {user_id}, {len(track_keys)} шт.): {e}")
+        return processed
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def get_track_file(track_key: str, profile: str) -> dict | None:
+    conn = sqlite3.connect(DATABASE_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT * FROM track_files WHERE track_key = ? AND profile = ?", (track_key, profile))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (get_track_file '{track_key}', {profile}): {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def upsert_track_file(track_key: str, profile: str, telegram_file_id: str | None, file_size: int | None,
+                      codec: str | None):
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""INSERT INTO track_files (track_key, profile, telegram_file_id, file_size, codec, updated_at)
+                          VALUES (?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(track_key, profile) DO UPDATE SET
+                              telegram_file_id = excluded.telegram_file_id, file_size = excluded.file_size,
+                              codec = excluded.codec, updated_at = excluded.updated_at""",
+                       (track_key, profile, telegram_file_id, file_size, codec, datetime.now(timezone.utc)))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (upsert_track_file '{track_key}', {profile}): {e}")
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def clear_track_file_id(track_key: str, profile: str):
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("UPDATE track_files SET telegram_file_id = NULL WHERE track_key = ? AND profile = ?",
+                       (track_key, profile))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (clear_track_file_id '{track_key}', {profile}): {e}")
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def enqueue_download_job(user_id: int, chat_id: int, url: str, track_key: str | None,
+                         status_message_id: int | None, text_prefix: str,
+                         reply_to_message_id: int | None) -> int | None:
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""INSERT INTO download_jobs (user_id, chat_id, url, track_key, status_message_id, text_prefix,
+                                                     reply_to_message_id, created_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                       (user_id, chat_id, url, track_key, status_message_id, text_prefix, reply_to_message_id,
+                        datetime.now(timezone.utc)))
+        conn.commit()
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (enqueue_download_job '{url}' for {user_id}): {e}")
+        return None
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def claim_download_job(worker_id: str, lease_seconds: float, max_attempts: int) -> dict | None:
+    """Lease the oldest queued job, or one whose worker let its lease run out, to this worker.
+
+    A job that has already been leased max_attempts times is not retried again but finished as failed.
+    """
+    conn = sqlite3.connect(DATABASE_FILE, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    now = time.time()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""UPDATE download_jobs SET status = 'done', success = 0, lease_owner = NULL,
+                              error = 'Worker lease expired ' || attempts || ' times'
+                          WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?""",
+                       (now, max_attempts))
+        cursor.execute("""SELECT * FROM download_jobs
+                          WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)
+                          ORDER BY id LIMIT 1""", (now,))
+        job = cursor.fetchone()
+        if job:
+            cursor.execute("""UPDATE download_jobs SET status = 'running', attempts = attempts + 1, lease_owner = ?,
+                                  lease_expires_at = ? WHERE id = ?""", (worker_id, now + lease_seconds, job["id"]))
+        cursor.execute("COMMIT")
+        if not job: return None
+        claimed = dict(job)
+        claimed.update(status="running", attempts=claimed["attempts"] + 1, lease_owner=worker_id)
+        return claimed
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (claim_download_job, {worker_id}): {e}")
+        if conn.in_transaction: conn.rollback()
+        return None
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def renew_download_job_lease(job_id: int, worker_id: str, lease_seconds: float) -> bool:
+    """Extend the lease; False if the job is no longer leased to this worker."""
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""UPDATE download_jobs SET lease_expires_at = ?
+                          WHERE id = ? AND status = 'running' AND lease_owner = ?""",
+                       (time.time() + lease_seconds, job_id, worker_id))
+        conn.commit()
+        return cursor.rowcount == 1
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (renew_download_job_lease #{job_id}, {worker_id}): {e}")
+        return False
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def finish_download_job(job_id: int, worker_id: str, success: bool, sent_message_id: int | None,
+                        error: str | None = None):
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""UPDATE download_jobs SET status = 'done', success = ?, sent_message_id = ?, error = ?,
+                              lease_owner = NULL
+                          WHERE id = ? AND lease_owner = ?""",
+                       (success, sent_message_id, error, job_id, worker_id))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (finish_download_job #{job_id}, {worker_id}): {e}")
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def release_download_job(job_id: int, worker_id: str):
+    """Put a job this worker gave up without running it to the end back in the queue."""
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""UPDATE download_jobs SET status = 'queued', attempts = attempts - 1, lease_owner = NULL,
+                              lease_expires_at = NULL
+                          WHERE id = ? AND status = 'running' AND lease_owner = ?""", (job_id, worker_id))
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (release_download_job #{job_id}, {worker_id}): {e}")
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def pop_finished_download_jobs(job_ids: list[int]) -> list[dict]:
+    """Finished jobs among job_ids; their rows are deleted."""
+    if not job_ids: return []
+    conn = sqlite3.connect(DATABASE_FILE)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    finished: list[dict] = []
+    try:
+        for start in range(0, len(job_ids), 500):
+            chunk = job_ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(f"SELECT * FROM download_jobs WHERE status = 'done' AND id IN ({placeholders})", chunk)
+            rows = [dict(row) for row in cursor.fetchall()]
+            if rows:
+                cursor.execute(f"DELETE FROM download_jobs WHERE id IN ({', '.join('?' for _ in rows)})",
+                               [row["id"] for row in rows])
+            finished.extend(rows)
+        conn.commit()
+        return finished
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (pop_finished_download_jobs, {len(job_ids)} шт.): {e}")
+        return []
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def delete_finished_download_jobs() -> int:
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM download_jobs WHERE status = 'done'")
+        conn.commit()
+        return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (delete_finished_download_jobs): {e}")
+        return 0
+    finally:
+        if conn: conn.close()
+
+
+@_instrumented
+def count_download_jobs() -> dict[str, int]:
+    conn = sqlite3.connect(DATABASE_FILE)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT status, COUNT(*) FROM download_jobs GROUP BY status")
+        return {status: count for status, count in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка БД (count_download_jobs): {e}")
+        return {}
+    finally:
+        if conn: conn.close()
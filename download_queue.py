@@ -0,0 +1,136 @@
+"""Durable download queue between the bot process and download worker processes.
+
+With DOWNLOAD_BACKEND=workers the bot only handles updates: run_in_worker()
+stores each track in the download_jobs table and waits for its result, while
+worker.py processes, started and restarted from here, claim jobs with a
+lease, run the track pipeline with their own Pyrogram session and write the
+result back. A job whose worker died is claimed again once its lease runs
+out, and a crashing worker never takes the bot process down with it.
+"""
+import logging
+import asyncio
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Sequence, Tuple
+
+import db
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "worker.py"
+MAX_ATTEMPTS = 3  # leases per job before a job whose workers keep dying is given up
+RESULT_POLL_INTERVAL = 0.5
+RESTART_DELAY_SECONDS = 1.0
+MAX_RESTART_DELAY_SECONDS = 60.0
+STOP_TIMEOUT_SECONDS = 15.0
+
+_waiters: dict[int, asyncio.Future] = {}
+_poller: Optional[asyncio.Task] = None
+_workers: dict[int, asyncio.subprocess.Process] = {}
+_supervisors: list[asyncio.Task] = []
+_stopping = False
+
+
+def _publish():
+    metrics.registry.gauge("download_jobs_awaited", help_text="Tracks the bot waits on from worker processes").set(
+        len(_waiters))
+    metrics.registry.gauge("download_workers", help_text="Running download worker processes").set(len(_workers))
+
+
+async def run_in_worker(url: str, user_id: int, chat_id: int, status_message_id_to_edit: Optional[int] = None,
+                        text_prefix_for_status: str = "", reply_to_message_id_for_final_audio: Optional[int] = None,
+                        track_key: Optional[str] = None) -> Tuple[bool, Optional[int]]:
+    """Queue one track for the worker processes and wait for its (success, sent message id)."""
+    global _poller
+    job_id = db.enqueue_download_job(user_id, chat_id, url, track_key, status_message_id_to_edit,
+                                     text_prefix_for_status, reply_to_message_id_for_final_audio)
+    if job_id is None:
+        return False, None
+    future = asyncio.get_running_loop().create_future()
+    _waiters[job_id] = future
+    if _poller is None:
+        _poller = asyncio.create_task(_poll_results(), name="download-queue-results")
+    _publish()
+    try:
+        return await future
+    finally:
+        # If the waiting handler is cancelled the job stays queued and is still delivered by a worker
+        _waiters.pop(job_id, None)
+        _publish()
+
+
+async def _poll_results():
+    global _poller
+    try:
+        while _waiters:
+            await asyncio.sleep(RESULT_POLL_INTERVAL)
+            for job in db.pop_finished_download_jobs(list(_waiters)):
+                future = _waiters.pop(job["id"], None)
+                if job["error"]:
+                    logger.warning(f"Задача загрузки #{job['id']} ({job['url']}) завершилась ошибкой: {job['error']}")
+                if future and not future.done():
+                    future.set_result((bool(job["success"]), job["sent_message_id"]))
+            _publish()
+    finally:
+        _poller = None
+
+
+async def _supervise(index: int, command: Sequence[str]):
+    restart_delay = RESTART_DELAY_SECONDS
+    while not _stopping:
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(*command, "--worker-id", str(index))
+        _workers[index] = process
+        _publish()
+        logger.info(f"Запущен воркер загрузки #{index} (pid {process.pid}).")
+        returncode = await process.wait()
+        del _workers[index]
+        _publish()
+        if _stopping: break
+        metrics.record_event("download_worker_exits", labels={"returncode": str(returncode)},
+                             help_text="Download worker processes that exited unexpectedly")
+        if time.monotonic() - started > MAX_RESTART_DELAY_SECONDS:
+            restart_delay = RESTART_DELAY_SECONDS
+        logger.error(f"Воркер загрузки #{index} завершился с кодом {returncode}, "
+                     f"перезапуск через {restart_delay:.0f}с.")
+        await asyncio.sleep(restart_delay)
+        restart_delay = min(restart_delay * 2, MAX_RESTART_DELAY_SECONDS)
+
+
+async def start_workers(count: int, command: Optional[Sequence[str]] = None):
+    """Start count worker processes (python worker.py by default) and restart them when they exit."""
+    global _stopping
+    _stopping = False
+    # Results of jobs finished while no bot process was waiting for them
+    dropped = db.delete_finished_download_jobs()
+    if dropped: logger.info(f"Удалено {dropped} результатов загрузок, которые никто не ждет.")
+    command = list(command or (sys.executable, str(WORKER_SCRIPT)))
+    for index in range(1, count + 1):
+        _supervisors.append(asyncio.create_task(_supervise(index, command), name=f"download-worker-{index}"))
+
+
+async def stop_workers():
+    """Ask the workers to put their jobs back in the queue and exit; kill the ones that do not."""
+    global _stopping
+    _stopping = True
+    processes = list(_workers.values())
+    for process in processes:
+        if process.returncode is None: process.terminate()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), STOP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        for process in processes:
+            if process.returncode is None:
+                logger.warning(f"Воркер загрузки (pid {process.pid}) не завершился, принудительная остановка.")
+                process.kill()
+    for supervisor in _supervisors:
+        supervisor.cancel()
+    await asyncio.gather(*_supervisors, return_exceptions=True)
+    _supervisors.clear()
+
+
+def stats() -> dict[str, int]:
+    counts = db.count_download_jobs()
+    return {"workers": len(_workers), "queued": counts.get("queued", 0), "running": counts.get("running", 0)}
@@ -0,0 +1,175 @@
+import logging
+import time
+from typing import Optional, cast
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+from telegram.ext import ContextTypes
+
+import ui_texts
+import tracing
+import circuit_breaker
+import download_queue
+import jobs
+import loop_monitor
+import outbox
+import subprocess_runner
+import warm_downloader
+from metrics import registry
+from config import ADMIN_USER_IDS, LOOP_MONITOR_ENABLED, DOWNLOAD_BACKEND
+from utils import format_bytes
+from handlers_menu import STATS_MENU, LAST_MENU_MSG_ID_KEY, _edit_or_reply_menu_message, menu_command
+
+logger = logging.getLogger(__name__)
+
+STATS_SHORT_WINDOW = 300
+STATS_LONG_WINDOW = 900
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_USER_IDS
+
+
+def build_stages_report() -> str:
+    summary = tracing.stage_summary()
+    if not summary:
+        return ui_texts.ADMIN_STAGES_EMPTY
+    report = ui_texts.ADMIN_STAGES_TITLE
+    for stage_stats in summary:
+        report += ui_texts.ADMIN_STAGES_ROW_FORMAT.format(
+            **{**stage_stats, "bytes_in": format_bytes(stage_stats["bytes_in"]),
+               "bytes_out": format_bytes(stage_stats["bytes_out"])})
+    if tracing.recent_traces:
+        last_trace = tracing.recent_traces[-1]
+        stages_line = " → ".join(f"{stage['stage']} {stage['seconds']:.2f}с" for stage in last_trace["stages"])
+        report += ui_texts.ADMIN_STAGES_RECENT_FORMAT.format(
+            track=last_trace["track"], outcome=last_trace["outcome"], seconds=last_trace["seconds"], stages=stages_line)
+    return report
+
+
+def _rolling_values(name: str, seconds: float, labels: Optional[dict] = None) -> list[float]:
+    """Values of all rolling series called `name` (optionally only those matching `labels`) within the window."""
+    values: list[float] = []
+    for label_key, window in registry.rolling_windows.get(name, {}).items():
+        if labels and any(dict(label_key).get(k) != str(v) for k, v in labels.items()):
+            continue
+        values.extend(window.values(seconds))
+    return values
+
+
+def _gauge_value(name: str) -> float:
+    return sum(gauge.value for gauge in registry.gauges.get(name, {}).values())
+
+
+def build_stats_report(bot_data: dict) -> str:
+    short_window, long_window = STATS_SHORT_WINDOW, STATS_LONG_WINDOW
+    running_syncs = sum(1 for lock in bot_data.get("user_sync_locks", {}).values() if lock.locked())
+    report = ui_texts.STATS_TITLE
+    report += ui_texts.STATS_SYNCS_FORMAT.format(
+        running_syncs=running_syncs,
+        scheduled_5m=len(_rolling_values("scheduled_syncs", short_window)),
+        scheduled_15m=len(_rolling_values("scheduled_syncs", long_window)),
+        scheduler_pending=int(_gauge_value("scheduler_pending_users")))
+    report += ui_texts.STATS_POOL_FORMAT.format(active=int(_gauge_value("download_pool_active")),
+                                                waiting=int(_gauge_value("download_pool_waiting")))
+    if DOWNLOAD_BACKEND == "workers":
+        report += ui_texts.STATS_WORKERS_FORMAT.format(**download_queue.stats())
+    report += ui_texts.STATS_JOBS_FORMAT.format(**jobs.stats())
+    live_processes = subprocess_runner.live_counts()
+    report += ui_texts.STATS_SUBPROCESS_FORMAT.format(
+        live=sum(live_processes.values()),
+        by_kind=", ".join(f"{kind} {count}" for kind, count in sorted(live_processes.items())) or "—",
+        killed_15m=len(_rolling_values("subprocess_killed", long_window)) - len(
+            _rolling_values("subprocess_killed", long_window, {"reason": "closed"})),
+        timeouts_15m=len(_rolling_values("subprocess_killed", long_window, {"reason": "timeout"})))
+    if warm_downloader.enabled():
+        report += ui_texts.STATS_WARM_DOWNLOADERS_FORMAT.format(**warm_downloader.stats())
+    if circuit_breaker.enabled():
+        breaker = circuit_breaker.stats()
+        report += ui_texts.STATS_SOUNDCLOUD_FORMAT.format(
+            state={circuit_breaker.CLOSED: ui_texts.STATS_SOUNDCLOUD_CLOSED,
+                   circuit_breaker.HALF_OPEN: ui_texts.STATS_SOUNDCLOUD_HALF_OPEN,
+                   circuit_breaker.OPEN: ui_texts.STATS_SOUNDCLOUD_OPEN_FORMAT.format(**breaker)}[breaker["state"]],
+            throttled_15m=len(_rolling_values("soundcloud_throttled", long_window)),
+            opened_15m=len(_rolling_values("soundcloud_circuit_opened", long_window)))
+
+    outbox_work = outbox.outstanding()
+    report += ui_texts.STATS_OUTBOX_FORMAT.format(
+        queued=sum(work["queued"] + work["in_flight"] for work in outbox_work.values()),
+        uploads=sum(work["uploads"] for work in outbox_work.values()), chats=len(outbox_work))
+    if outbox_work:
+        busiest_chat_id = max(outbox_work, key=lambda chat_id: sum(outbox_work[chat_id].values()))
+        report += ui_texts.STATS_OUTBOX_BUSIEST_FORMAT.format(chat_id=busiest_chat_id,
+                                                             count=sum(outbox_work[busiest_chat_id].values()))
+
+    delivered_short = _rolling_values("tracks_processed", short_window, {"outcome": "ok"})
+    delivered_long = _rolling_values("tracks_processed", long_window, {"outcome": "ok"})
+    report += ui_texts.STATS_TRACKS_FORMAT.format(
+        rate_5m=len(delivered_short) * 60 / short_window, rate_15m=len(delivered_long) * 60 / long_window,
+        ok_15m=len(delivered_long),
+        errors_15m=len(_rolling_values("tracks_processed", long_window, {"outcome": "error"})))
+
+    upload_seconds = _rolling_values("upload", long_window)
+    uploaded_bytes = sum(_rolling_values("uploaded_bytes", long_window))
+    report += ui_texts.STATS_UPLOAD_FORMAT.format(
+        uploads_15m=len(upload_seconds), bytes_15m=format_bytes(uploaded_bytes),
+        speed=format_bytes(uploaded_bytes / sum(upload_seconds) if sum(upload_seconds) else 0))
+
+    flood_waits = _rolling_values("flood_wait", long_window)
+    report += ui_texts.STATS_FLOOD_FORMAT.format(
+        count=len(flood_waits), avg=sum(flood_waits) / len(flood_waits) if flood_waits else 0.0,
+        max=max(flood_waits, default=0.0))
+
+    db_short = _rolling_values("db_query", short_window)
+    report += ui_texts.STATS_DB_FORMAT.format(
+        rate_5m=len(db_short) * 60 / short_window,
+        avg_ms=(sum(db_short) / len(db_short) * 1000) if db_short else 0.0,
+        max_ms=max(db_short, default=0.0) * 1000)
+
+    if LOOP_MONITOR_ENABLED:
+        loop_lag = _rolling_values("loop_lag", short_window)
+        recent_slow = [item for item in loop_monitor.recent_slow_callbacks if time.time() - item["at"] <= long_window]
+        report += ui_texts.STATS_LOOP_FORMAT.format(
+            lag_avg_ms=(sum(loop_lag) / len(loop_lag) * 1000) if loop_lag else 0.0,
+            lag_max_ms=max(loop_lag, default=0.0) * 1000, slow_count=len(recent_slow))
+        if recent_slow:
+            slowest = max(recent_slow, key=lambda item: item["seconds"])
+            report += ui_texts.STATS_LOOP_SLOWEST_FORMAT.format(detail=slowest["detail"], ms=slowest["seconds"] * 1000)
+    return report
+
+
+async def stages_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message or not update.effective_user: return
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        logger.info(f"User {user_id} запросил /stages без прав администратора, игнорируем.")
+        return
+    await update.message.reply_text(build_stages_report())
+
+
+async def display_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             query: Optional[CallbackQuery] = None) -> str:
+    keyboard = [
+        [InlineKeyboardButton(ui_texts.BUTTON_STATS_REFRESH, callback_data="stats_refresh")],
+        [InlineKeyboardButton(ui_texts.BUTTON_BACK_TO_MAIN, callback_data="back_to_main_from_stats")]
+    ]
+    await _edit_or_reply_menu_message(update, context, query, build_stats_report(context.bot_data),
+                                      InlineKeyboardMarkup(keyboard), parse_mode=None)
+    return STATS_MENU
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        logger.info(f"User {user_id} запросил /stats без прав администратора, игнорируем.")
+        return None
+    context.user_data.pop(LAST_MENU_MSG_ID_KEY, None)
+    return await display_stats_menu(update, context)
+
+
+async def stats_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    query = cast(CallbackQuery, update.callback_query)
+    await query.answer()
+    if query.data == "back_to_main_from_stats":
+        return await menu_command(update, context)
+    if query.message: context.user_data[LAST_MENU_MSG_ID_KEY] = query.message.message_id
+    return await display_stats_menu(update, context, query)
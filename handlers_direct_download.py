@@ -2,130 +2,242 @@ import logging
 import asyncio
 import re
 from pathlib import Path
-import io
-from typing import Optional, Tuple, Any, cast
+from typing import AsyncIterator, Awaitable, Optional, Tuple, Callable
 import os
 from datetime import datetime, timezone
-from PIL import Image
-import httpx
+from contextlib import aclosing
+from functools import partial
 
-from telegram import Update, Message
+from telegram import Update
 from telegram.ext import ContextTypes
 import telegram.error
 
-from mutagen.id3 import ID3, APIC, TIT2, TPE1
-from mutagen.mp3 import MP3
-from mutagen.easyid3 import EasyID3
-from mutagen.mp4 import MP4, MP4Cover
-from mutagen.flac import FLAC
-
-from config import DOWNLOAD_FOLDER
-from utils import sanitize_filename, create_progress_bar
+from config import DOWNLOAD_CONCURRENCY, DIRECT_BATCH_MAX_TRACKS, DOWNLOAD_BACKEND, HLS_DOWNLOAD_ENABLED
+from utils import sanitize_filename, create_progress_bar, normalize_soundcloud_url, is_soundcloud_collection_url
+import audio_profiles
+import circuit_breaker
 import db
+import download_queue
+import hls_download
+import jobs
+import media_tasks
+import metrics
+import outbox
+import progress_channel
+import singleflight
+import soundcloud_api
+import subprocess_runner
+import temp_storage
+import track_keys
+import tracing
 import ui_texts
+import warm_downloader
 
 logger = logging.getLogger(__name__)
 
 MAX_TELEGRAM_API_RETRIES = 3
-TELEGRAM_API_RETRY_BUFFER = 0.8
-THUMBNAIL_MAX_SIZE = 320
-THUMBNAIL_MAX_BYTES = 200 * 1024
+BATCH_PROGRESS_MIN_INTERVAL = 3.0
+UPLOAD_PROGRESS_START = 75  # the upload fills the track progress bar from here to 99%
+# Timeouts grow with the track length: (base seconds, seconds per minute of audio)
+SCDL_TIMEOUT = (60, 30)
+FFMPEG_TIMEOUT = (30, 10)
+SOURCE_CODECS = {".mp3": "mp3", ".m4a": "aac", ".ogg": "opus", ".opus": "opus", ".flac": "flac", ".wav": "pcm"}
+SOUNDCLOUD_URL_RE = re.compile(r'(https?://(?:www\.|m\.)?soundcloud\.com/[^\s]+)')
+LISTING_IDLE_TIMEOUT = 120  # seconds yt-dlp may go without printing a track (one api-v2 page)
+THROTTLED_DOWNLOAD_ATTEMPTS = 3  # downloads of a track SoundCloud throttles, each after the circuit breaker lets it
 
 
-def prepare_thumbnail_for_telegram(artwork_data: bytes) -> Optional[io.BytesIO]:
-    """Resize and convert artwork to JPEG ≤320x320, ≤200KB for Telegram thumbnail."""
-    try:
-        img = Image.open(io.BytesIO(artwork_data))
-        img = img.convert('RGB')
-        img.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.LANCZOS)
-
-        quality = 90
-        while quality >= 20:
-            buf = io.BytesIO()
-            img.save(buf, format='JPEG', quality=quality)
-            if buf.tell() <= THUMBNAIL_MAX_BYTES:
-                buf.seek(0)
-                logger.info(f"Thumbnail подготовлен: {img.size[0]}x{img.size[1]}, {buf.getbuffer().nbytes} bytes, quality={quality}")
-                return buf
-            quality -= 10
-
-        buf.seek(0)
-        return buf
-    except Exception as e_thumb:
-        logger.warning(f"Не удалось подготовить thumbnail: {e_thumb}")
+async def list_soundcloud_tracks(url: str, timeout: float = 300) -> Tuple[Optional[int], list[Tuple[str, str]], str]:
+    """Flat-list a SoundCloud collection (likes, set, profile) with yt-dlp.
+
+    Returns (returncode, [(track_url, track_id)], stderr). Raises asyncio.TimeoutError on timeout.
+    """
+    async with circuit_breaker.request() as soundcloud_call:
+        result = await subprocess_runner.run(_listing_command(url), timeout)
+        stderr_str = result.stderr.decode(errors='ignore').strip()
+        soundcloud_call.report((stderr_str or f"RC {result.returncode}") if result.returncode != 0 else None)
+    id_url_pairs = []
+    for line in result.stdout.decode(errors='ignore').splitlines():
+        if pair := _parse_listing_line(line): id_url_pairs.append(pair)
+    return result.returncode, id_url_pairs, stderr_str
+
+
+async def iter_soundcloud_tracks(url: str, idle_timeout: float = LISTING_IDLE_TIMEOUT
+                                 ) -> AsyncIterator[Tuple[str, str]]:
+    """(track_url, track_id) pairs of a collection as yt-dlp prints them, page by page.
+
+    Raises subprocess_runner.ProcessError if yt-dlp fails and asyncio.TimeoutError if it stalls; close the
+    generator (contextlib.aclosing) to stop the listing early.
+    """
+    async with aclosing(subprocess_runner.stream_lines(_listing_command(url), idle_timeout)) as lines:
+        # Only the first page waits for (and may probe) the circuit breaker: the consumer downloads tracks meanwhile
+        async with circuit_breaker.request() as soundcloud_call:
+            try:
+                line = await anext(lines, None)
+            except subprocess_runner.ProcessError as e_listing:
+                soundcloud_call.report(e_listing.stderr or str(e_listing))
+                raise
+            soundcloud_call.report(None)
+        try:
+            while line is not None:
+                if pair := _parse_listing_line(line): yield pair
+                line = await anext(lines, None)
+        except subprocess_runner.ProcessError as e_listing:
+            if kind := circuit_breaker.classify(e_listing.stderr): circuit_breaker.record_throttled(kind)
+            raise
+
+
+def _listing_command(url: str) -> list[str]:
+    return ["yt-dlp", "--flat-playlist", "--print", "%(id)s %(url)s", "--no-warnings", "-q", url]
+
+
+def _parse_listing_line(line: str) -> Optional[Tuple[str, str]]:
+    track_id_str, _, track_url = line.strip().partition(" ")
+    if not track_url.strip().startswith("https://soundcloud.com/"): return None
+    return track_url.strip(), track_id_str
+
+
+_download_slots = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+
+async def _download_source(url: str, track_metadata: dict, target_dir: Path, timeout: float,
+                           progress: progress_channel.ProgressChannel) -> Optional[Tuple[str, str]]:
+    """Download a track's audio into target_dir. Returns (reason for failed_tracks, error message) on failure."""
+    if HLS_DOWNLOAD_ENABLED and track_metadata.get("track_id"):
+        hls_file = await asyncio.wait_for(hls_download.download_track(
+            track_metadata["track_id"], target_dir,
+            sanitize_filename(f"{track_metadata.get('artist')} - {track_metadata.get('title')}"),
+            on_progress=progress.update), timeout=timeout)
+        if hls_file: return None  # picked up with the other downloaded files
+    if warm_downloader.enabled():
+        err_msg_ytdlp = await warm_downloader.download(url, target_dir, timeout, on_progress=progress.update)
+        if err_msg_ytdlp:
+            return f"yt-dlp: {err_msg_ytdlp[:100]}", f"yt-dlp failed: {err_msg_ytdlp[:250]}"
         return None
+    scdl_cmd = ["scdl", "-l", url, "-c", "--path", str(target_dir), "--overwrite"]
+    scdl_result = await subprocess_runner.run(scdl_cmd, timeout,
+                                              on_line=progress_channel.download_output_parser(progress))
+    if scdl_result.returncode != 0:
+        err_msg_scdl = scdl_result.stderr.decode(errors='ignore').strip()
+        return (f"scdl: {err_msg_scdl.splitlines()[-1][:100] if err_msg_scdl else 'unknown'}",
+                f"scdl failed: {err_msg_scdl.splitlines()[-1][:250] if err_msg_scdl else 'Неизвестная ошибка scdl'}")
+    return None
+
+
+async def download_track(
+        url: str, user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE,
+        status_message_id_to_edit: Optional[int] = None,
+        text_prefix_for_status: str = "",
+        reply_to_message_id_for_final_audio: Optional[int] = None,
+        track_key: Optional[str] = None
+) -> Tuple[bool, Optional[int]]:
+    """Deliver one track: in this process, or by a download worker process with DOWNLOAD_BACKEND=workers."""
+    if DOWNLOAD_BACKEND == "workers":
+        return await download_queue.run_in_worker(
+            url=url, user_id=user_id, chat_id=chat_id, status_message_id_to_edit=status_message_id_to_edit,
+            text_prefix_for_status=text_prefix_for_status,
+            reply_to_message_id_for_final_audio=reply_to_message_id_for_final_audio, track_key=track_key)
+    return await modified_handle_soundcloud_link(
+        url=url, user_id=user_id, chat_id=chat_id, context=context,
+        status_message_id_to_edit=status_message_id_to_edit, text_prefix_for_status=text_prefix_for_status,
+        reply_to_message_id_for_final_audio=reply_to_message_id_for_final_audio, track_key=track_key)
+
 
+async def modified_handle_soundcloud_link(
+        url: str, user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE,
+        status_message_id_to_edit: Optional[int] = None,
+        text_prefix_for_status: str = "",
+        reply_to_message_id_for_final_audio: Optional[int] = None,
+        track_key: Optional[str] = None
+) -> Tuple[bool, Optional[int]]:
+    """Process one track in a slot of the download pool shared by syncs and direct downloads.
 
-def fetch_artwork_from_soundcloud(url: str, save_path: Path) -> Optional[Path]:
-    """Fetch track artwork from SoundCloud og:image meta tag.
-    
-    scdl 3.0.2 has a bug: it downloads the thumbnail jpg but deletes it
-    after failing to embed it into m4a files. We fetch it ourselves.
+    The slot is given back early when the upload is parked by the FloodWait limiter,
+    or while waiting for another request processing the same track, so other chats
+    keep downloading while this one waits.
     """
+    waiting_gauge = metrics.registry.gauge("download_pool_waiting", help_text="Tracks waiting for a download slot")
+    active_gauge = metrics.registry.gauge("download_pool_active", help_text="Tracks being processed")
+    slot_held = False
+
+    async def acquire_download_slot():
+        nonlocal slot_held
+        if slot_held: return
+        waiting_gauge.inc()
+        try:
+            await _download_slots.acquire()
+        finally:
+            waiting_gauge.dec()
+        slot_held = True
+        active_gauge.inc()
+
+    def release_download_slot():
+        nonlocal slot_held
+        if slot_held:
+            slot_held = False
+            active_gauge.dec()
+            _download_slots.release()
+
+    await acquire_download_slot()
     try:
-        import re as _re
-        resp = httpx.get(url, follow_redirects=True, timeout=15,
-                         headers={'User-Agent': 'Mozilla/5.0'})
-        match = _re.search(r'<meta property="og:image" content="([^"]+)"', resp.text)
-        if not match:
-            logger.warning(f"og:image не найден на странице {url}")
-            return None
-        img_url = match.group(1)
-        img_url = _re.sub(r'-t\d+x\d+\.', '-t500x500.', img_url)
-        img_resp = httpx.get(img_url, timeout=15)
-        if img_resp.status_code == 200 and len(img_resp.content) > 100:
-            artwork_file = save_path / "cover.jpg"
-            artwork_file.write_bytes(img_resp.content)
-            logger.info(f"Обложка скачана с SoundCloud: {len(img_resp.content)} bytes -> {artwork_file}")
-            return artwork_file
-        else:
-            logger.warning(f"Не удалось скачать обложку: HTTP {img_resp.status_code}, {len(img_resp.content)} bytes")
-            return None
-    except Exception as e:
-        logger.warning(f"Ошибка при скачивании обложки с SoundCloud: {e}")
-        return None
+        return await _process_soundcloud_track(
+            url=url, user_id=user_id, chat_id=chat_id, context=context,
+            status_message_id_to_edit=status_message_id_to_edit,
+            text_prefix_for_status=text_prefix_for_status,
+            reply_to_message_id_for_final_audio=reply_to_message_id_for_final_audio,
+            track_key=track_key,
+            release_download_slot=release_download_slot,
+            acquire_download_slot=acquire_download_slot,
+        )
+    finally:
+        release_download_slot()
 
 
-async def modified_handle_soundcloud_link(
+async def _process_soundcloud_track(
         url: str, user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE,
         status_message_id_to_edit: Optional[int] = None,
         text_prefix_for_status: str = "",
-        reply_to_message_id_for_final_audio: Optional[int] = None
+        reply_to_message_id_for_final_audio: Optional[int] = None,
+        track_key: Optional[str] = None,
+        release_download_slot: Optional[Callable[[], None]] = None,
+        acquire_download_slot: Optional[Callable[[], Awaitable[None]]] = None
 ) -> Tuple[bool, Optional[int]]:
     is_sync_mode = bool(text_prefix_for_status)
     logger.info(f"Processing URL ({'sync_mode' if is_sync_mode else 'direct_download'}): {url} for user {user_id}")
+    if not track_key:
+        track_key = await track_keys.resolve_track_key(url)
 
     import hashlib
-    url_hash = hashlib.md5(url.encode()).hexdigest()[:8]
+    url_hash = hashlib.md5(track_key.encode()).hexdigest()[:8]
 
     timestamp_str = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
-    request_temp_path_base = Path(DOWNLOAD_FOLDER) / str(user_id)
-    request_temp_path = request_temp_path_base / f"dl_{url_hash}_{timestamp_str}"
-
-    try:
-        request_temp_path.mkdir(parents=True, exist_ok=True)
-    except Exception as e_mkdir:
-        logger.error(f"Не удалось создать временную папку {request_temp_path}: {e_mkdir}")
-        db.log_user_error(user_id, f"Ошибка создания временной папки: {e_mkdir}", context_info=url)
-        return False, None
+    workspace_name = f"{temp_storage.WORKSPACE_PREFIX}{url_hash}_{timestamp_str}"
+    request_temp_path: Optional[Path] = None
+    storage_failed = False
 
     original_downloaded_file: Optional[Path] = None
-    mp3_final_file: Optional[Path] = None
+    delivery_file: Optional[Path] = None
     artwork_from_original_data: Optional[bytes] = None
     artwork_from_original_mime: Optional[str] = None
     artwork_external_file_path: Optional[Path] = None
-    embedded_artwork_data_io: Optional[io.BytesIO] = None
+    thumbnail_bytes: Optional[bytes] = None
+    artwork_hash: Optional[str] = None
     artwork_data_to_embed_final: Optional[bytes] = None
-    artwork_mime_type_final: Optional[str] = None
     sent_audio_message_id: Optional[int] = None
+    flight_key: Optional[Tuple[str, str]] = None
+    uploaded_file_id: Optional[str] = None
     error_occurred_for_logging = False
     error_reason_for_db = "Unknown error"
+    soundcloud_throttled = False
+    trace = tracing.TrackTrace(track_key)
+    progress: Optional[progress_channel.ProgressChannel] = None
 
     try:
-        async def update_progress_display(percent: int, stage_msg_local_key: str):
+        async def update_progress_display(percent: int, stage_msg_local_key: str, detail: str = ""):
             stage_msg_local = getattr(ui_texts, stage_msg_local_key, stage_msg_local_key)
             progress_bar_and_percent = create_progress_bar(percent)
-            current_track_progress_line = f"{progress_bar_and_percent} {stage_msg_local.strip()}"
+            current_track_progress_line = " ".join(
+                part for part in (progress_bar_and_percent, stage_msg_local.strip(), detail) if part)
 
             full_message_text: str
             target_message_id_for_edit: Optional[int] = None
@@ -143,54 +255,91 @@ async def modified_handle_soundcloud_link(
                 target_message_id_for_edit = status_message_id_to_edit
 
             if target_message_id_for_edit:
-                for attempt in range(1, MAX_TELEGRAM_API_RETRIES + 1):
-                    try:
-                        await context.bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=target_message_id_for_edit,
-                            text=full_message_text
-                        )
-                        break
-                    except telegram.error.RetryAfter as e_retry_progress:
-                        wait_time = e_retry_progress.retry_after + TELEGRAM_API_RETRY_BUFFER
-                        logger.warning(
-                            f"Flood control in update_progress_display for {url}. Retrying in {wait_time:.2f}s (attempt {attempt}/{MAX_TELEGRAM_API_RETRIES}).")
-                        await asyncio.sleep(wait_time)
-                        if attempt == MAX_TELEGRAM_API_RETRIES:
-                            logger.error(
-                                f"Max retries for update_progress_display for {url}. Giving up on this edit attempt.")
-                    except telegram.error.BadRequest as e_edit:
-                        if "Message is not modified" not in str(e_edit).lower() and \
-                                "message to edit not found" not in str(e_edit).lower():
-                            logger.warning(
-                                f"Ошибка редактирования сообщения (progress) {target_message_id_for_edit} (chat {chat_id}): {e_edit}")
-                        break
-                    except Exception as e_unexp:
-                        logger.error(
-                            f"Неожиданная ошибка при обновлении сообщения (progress) {target_message_id_for_edit} (chat {chat_id}): {e_unexp}")
-                        break
-
-        await update_progress_display(0, "TRACK_STAGE_STARTING")
-
-        artwork_external_file_path = fetch_artwork_from_soundcloud(url, request_temp_path)
-
-        await update_progress_display(5, "TRACK_STAGE_DOWNLOADING")
-        scdl_cmd = ["scdl", "-l", url, "-c", "--path", str(request_temp_path), "--overwrite", "--hide-progress"]
-        process_scdl = await asyncio.create_subprocess_exec(*scdl_cmd, stdout=asyncio.subprocess.PIPE,
-                                                            stderr=asyncio.subprocess.PIPE)
-        scdl_stdout, scdl_stderr = await asyncio.wait_for(process_scdl.communicate(), timeout=300)
-
-        if process_scdl.returncode != 0:
-            err_msg_scdl = scdl_stderr.decode(errors='ignore').strip()
-            error_reason_for_db = f"scdl: {err_msg_scdl.splitlines()[-1][:100] if err_msg_scdl else 'unknown'}"
-            full_error_message = f"scdl failed: {err_msg_scdl.splitlines()[-1][:250] if err_msg_scdl else 'Неизвестная ошибка scdl'}"
-            raise RuntimeError(full_error_message)
+                # Not awaited: a queued edit of the same message is replaced by this one
+                outbox.edit_text(context.bot, chat_id, target_message_id_for_edit, full_message_text)
+
+        async def show_error_in_status(text: str):
+            if is_sync_mode or not status_message_id_to_edit: return
+            try:
+                await outbox.edit_text(context.bot, chat_id, status_message_id_to_edit, text,
+                                       priority=outbox.PRIORITY_STATUS)
+            except telegram.error.TelegramError:
+                pass
+
+        progress = progress_channel.ProgressChannel(update_progress_display)
+        progress.stage("starting", "TRACK_STAGE_STARTING", 0, 0)
+
+        track_metadata = await track_keys.get_track_metadata(track_key) or {}
+        profile = audio_profiles.get_profile((db.get_user_settings(user_id) or {}).get("audio_profile"))
+        from pyrogram_sender import send_cached_audio_pyrogram
+        cached_file = db.get_track_file(track_key, profile.key)
+        if cached_file and cached_file.get("telegram_file_id"):
+            trace.begin("resend")
+            sent_audio_message_id = await send_cached_audio_pyrogram(
+                chat_id, cached_file["telegram_file_id"],
+                reply_to_message_id=reply_to_message_id_for_final_audio if not is_sync_mode else None,
+                on_parked=release_download_slot)
+            if sent_audio_message_id:
+                return True, sent_audio_message_id
+            db.clear_track_file_id(track_key, profile.key)
+
+        # Another request processing the same track right now uploads it once for everybody
+        while (leader_flight := singleflight.claim((track_key, profile.key))) is not None:
+            trace.begin("singleflight_wait")
+            if release_download_slot: release_download_slot()  # the leader does the work, keep the pool free
+            leader_file_id = await singleflight.wait(leader_flight)
+            if not leader_file_id: continue  # the leader failed, the next waiter takes over
+            trace.begin("resend")
+            sent_audio_message_id = await send_cached_audio_pyrogram(
+                chat_id, leader_file_id,
+                reply_to_message_id=reply_to_message_id_for_final_audio if not is_sync_mode else None,
+                on_parked=release_download_slot)
+            if sent_audio_message_id:
+                return True, sent_audio_message_id
+        flight_key = (track_key, profile.key)
+        if acquire_download_slot: await acquire_download_slot()  # given back while waiting for a leader
+
+        trace.begin("storage_wait")
+        try:
+            request_temp_path = await temp_storage.storage.acquire(
+                user_id, workspace_name, temp_storage.estimate_workspace_bytes(track_metadata.get("duration_ms")))
+        except OSError as e_mkdir:
+            logger.error(f"Не удалось создать временную папку {workspace_name}: {e_mkdir}")
+            db.log_user_error(user_id, f"Ошибка создания временной папки: {e_mkdir}", context_info=url)
+            storage_failed = True
+            return False, None
+
+        trace.begin("artwork")
+        # scdl downloads the cover but deletes it after failing to embed it into m4a files, so we fetch it ourselves
+        if track_metadata.get("artwork_url"):
+            artwork_external_file_path = await soundcloud_api.download_artwork(track_metadata["artwork_url"],
+                                                                               request_temp_path)
+        if artwork_external_file_path: trace.add_bytes(bytes_out=artwork_external_file_path.stat().st_size)
+
+        download_timeout = subprocess_runner.duration_timeout(track_metadata.get("duration_ms"), *SCDL_TIMEOUT)
+        for download_attempt in range(1, THROTTLED_DOWNLOAD_ATTEMPTS + 1):
+            if not circuit_breaker.is_closed():
+                progress.stage("soundcloud_wait", "TRACK_STAGE_SOUNDCLOUD_PAUSED", 5, 5)
+                trace.begin("soundcloud_wait")
+            async with circuit_breaker.request() as soundcloud_call:
+                progress.stage("download", "TRACK_STAGE_DOWNLOADING", 5, 35)
+                trace.begin("download")
+                download_failure = await _download_source(url, track_metadata, request_temp_path, download_timeout,
+                                                          progress)
+                soundcloud_call.report(download_failure[1] if download_failure else None)
+            if not download_failure or not soundcloud_call.throttled or not circuit_breaker.enabled(): break
+            logger.warning(f"SoundCloud ограничил загрузку {url} (попытка {download_attempt} из "
+                           f"{THROTTLED_DOWNLOAD_ATTEMPTS}): {download_failure[1]}")
+        if download_failure:
+            error_reason_for_db, download_error = download_failure
+            soundcloud_throttled = soundcloud_call.throttled
+            raise RuntimeError(download_error)
 
         for item_name in os.listdir(request_temp_path):
             item_path = request_temp_path / item_name
             ext_lower = item_path.suffix.lower()
             if item_path.is_file():
-                if ext_lower in (".mp3", ".m4a", ".ogg", ".flac", ".wav"):
+                if ext_lower in SOURCE_CODECS:
                     original_downloaded_file = item_path
                 elif ext_lower in (".jpg", ".jpeg", ".png"):
                     artwork_external_file_path = item_path
@@ -198,135 +347,91 @@ async def modified_handle_soundcloud_link(
             error_reason_for_db = "Audio file not found post-scdl"
             raise FileNotFoundError("Файл аудио не найден после скачивания scdl.")
 
-        await update_progress_display(35, "TRACK_STAGE_INTERMEDIATE")
-        if original_downloaded_file:
-            try:
-                audio_ext = original_downloaded_file.suffix.lower()
-                audio_obj_for_art: Any = None
-                if audio_ext == ".m4a":
-                    audio_obj_for_art = MP4(str(original_downloaded_file))
-                elif audio_ext == ".mp3":
-                    audio_obj_for_art = MP3(str(original_downloaded_file), ID3=ID3)
-                elif audio_ext == ".flac":
-                    audio_obj_for_art = FLAC(str(original_downloaded_file))
-
-                if isinstance(audio_obj_for_art, MP4) and 'covr' in audio_obj_for_art and audio_obj_for_art['covr'] and \
-                        audio_obj_for_art['covr'][0]:
-                    artwork_from_original_data = bytes(audio_obj_for_art['covr'][0])
-                    img_fmt = audio_obj_for_art['covr'][0].imageformat
-                    if img_fmt == MP4Cover.FORMAT_JPEG:
-                        artwork_from_original_mime = 'image/jpeg'
-                    elif img_fmt == MP4Cover.FORMAT_PNG:
-                        artwork_from_original_mime = 'image/png'
-                elif isinstance(audio_obj_for_art, MP3) and audio_obj_for_art.tags:
-                    for tag_key in list(audio_obj_for_art.tags.keys()):
-                        if tag_key.startswith('APIC:'):
-                            artwork_from_original_data = audio_obj_for_art.tags[tag_key].data
-                            artwork_from_original_mime = audio_obj_for_art.tags[tag_key].mime;
-                            break
-                elif isinstance(audio_obj_for_art, FLAC) and audio_obj_for_art.pictures:
-                    artwork_from_original_data = audio_obj_for_art.pictures[0].data
-                    artwork_from_original_mime = audio_obj_for_art.pictures[0].mime
-            except Exception as e_art:
-                logger.warning(f"Не удалось извлечь обложку из {original_downloaded_file.name}: {e_art}")
+        trace.add_bytes(bytes_out=original_downloaded_file.stat().st_size)
+
+        progress.stage("cover_extract", "TRACK_STAGE_INTERMEDIATE", 35, 35)
+        trace.begin("cover_extract")
+        artwork_from_original_data, artwork_from_original_mime = await media_tasks.run_media_task(
+            media_tasks.extract_embedded_artwork, original_downloaded_file)
 
         base_name_sanitized = sanitize_filename(original_downloaded_file.stem)
-        is_conversion_needed = original_downloaded_file.suffix.lower() != ".mp3"
+        is_conversion_needed = profile.needs_transcode(original_downloaded_file.suffix)
 
         if is_conversion_needed:
-            await update_progress_display(40, "TRACK_STAGE_CONVERTING")
-            mp3_final_file = request_temp_path / f"{base_name_sanitized}.mp3"
-            ffmpeg_cmd = ["ffmpeg", "-y", "-i", str(original_downloaded_file), "-vn", "-ar", "44100", "-ac", "2",
-                          "-b:a", "192k", str(mp3_final_file)]
-            process_ffmpeg = await asyncio.create_subprocess_exec(*ffmpeg_cmd, stdout=asyncio.subprocess.PIPE,
-                                                                  stderr=asyncio.subprocess.PIPE)
-            ffmpeg_stdout, ffmpeg_stderr = await asyncio.wait_for(process_ffmpeg.communicate(), timeout=300)
-            if process_ffmpeg.returncode != 0:
-                err_msg_ffmpeg = ffmpeg_stderr.decode(errors='ignore').strip()
+            duration_ms = track_metadata.get("duration_ms")
+            progress.stage("transcode", "TRACK_STAGE_CONVERTING", 40, 70, progress_channel.UNIT_MEDIA_SECONDS,
+                           total=duration_ms / 1000 if duration_ms else None)
+            trace.begin("transcode")
+            trace.add_bytes(bytes_in=original_downloaded_file.stat().st_size)
+            delivery_file = request_temp_path / f"{base_name_sanitized}{profile.extension}"
+            ffmpeg_cmd = profile.transcode_command(original_downloaded_file, delivery_file)
+            ffmpeg_result = await subprocess_runner.run(
+                ffmpeg_cmd, subprocess_runner.duration_timeout(duration_ms, *FFMPEG_TIMEOUT),
+                on_line=progress_channel.ffmpeg_output_parser(progress))
+            if ffmpeg_result.returncode != 0:
+                err_msg_ffmpeg = ffmpeg_result.stderr.decode(errors='ignore').strip()
                 error_reason_for_db = f"ffmpeg: {err_msg_ffmpeg[:100]}"
                 raise RuntimeError(f"ffmpeg fail: {err_msg_ffmpeg[:250]}")
         else:
-            mp3_final_file = original_downloaded_file
+            delivery_file = original_downloaded_file
 
-        if not mp3_final_file or not mp3_final_file.exists():
-            error_reason_for_db = "MP3 file not found post-conversion/check"
-            raise FileNotFoundError("MP3 файл не найден после обработки.")
+        if not delivery_file or not delivery_file.exists():
+            error_reason_for_db = "Audio file not found post-conversion/check"
+            raise FileNotFoundError("Аудиофайл не найден после обработки.")
 
-        await update_progress_display(70, "TRACK_STAGE_PROCESSING_METADATA")
-        title_str, performer_str = "Unknown Title", "Unknown Artist"
-        audio_id3 = MP3(str(mp3_final_file), ID3=ID3)
-        if audio_id3.tags is None: audio_id3.add_tags()
-        try:
-            audio_tags_easy = EasyID3(str(mp3_final_file))
-            if 'title' in audio_tags_easy and audio_tags_easy['title']: title_str = audio_tags_easy['title'][0]
-            if 'artist' in audio_tags_easy and audio_tags_easy['artist']: performer_str = audio_tags_easy['artist'][0]
-        except Exception:
-            logger.warning(f"EasyID3 не смог прочитать теги для {mp3_final_file.name}, пробуем из имени файла.")
-
-        if title_str == "Unknown Title" or performer_str == "Unknown Artist":
-            match_filename = re.match(r"(.+?) - (.+)", original_downloaded_file.stem, re.IGNORECASE)
-            if match_filename:
-                fn_performer, fn_title = match_filename.group(1).strip(), match_filename.group(2).strip()
-                if performer_str == "Unknown Artist" and fn_performer: performer_str = fn_performer
-                if title_str == "Unknown Title" and fn_title: title_str = fn_title
-            elif title_str == "Unknown Title":
-                title_str = sanitize_filename(original_downloaded_file.stem)
-
-        audio_id3.tags.delall('TPE1');
-        audio_id3.tags.add(TPE1(encoding=3, text=performer_str))
-        audio_id3.tags.delall('TIT2');
-        audio_id3.tags.add(TIT2(encoding=3, text=title_str))
-
-        if artwork_external_file_path and artwork_external_file_path.exists():
-            with open(artwork_external_file_path, 'rb') as afp:
-                artwork_data_to_embed_final = afp.read()
-            artwork_mime_type_final = 'image/jpeg' if artwork_external_file_path.suffix.lower() in ['.jpg',
-                                                                                                    '.jpeg'] else 'image/png'
-            logger.info(f"Обложка из внешнего файла: {len(artwork_data_to_embed_final)} bytes, mime={artwork_mime_type_final}")
-        elif artwork_from_original_data:
-            artwork_data_to_embed_final = artwork_from_original_data
-            artwork_mime_type_final = artwork_from_original_mime or 'image/jpeg'
-            logger.info(f"Обложка из оригинального аудио: {len(artwork_data_to_embed_final)} bytes, mime={artwork_mime_type_final}")
-        else:
-            logger.warning(f"Обложка не найдена ни из файла, ни из оригинального аудио для {url}")
+        if is_conversion_needed: trace.add_bytes(bytes_out=delivery_file.stat().st_size)
 
-        audio_id3.tags.delall('APIC')
-        if artwork_data_to_embed_final and artwork_mime_type_final:
-            try:
-                audio_id3.tags.add(APIC(encoding=3, mime=artwork_mime_type_final, type=3, desc='Cover',
-                                        data=artwork_data_to_embed_final))
-                logger.info(f"APIC тег добавлен: {len(artwork_data_to_embed_final)} bytes")
-            except Exception as e_apic_add:
-                logger.error(f"Не удалось добавить APIC тег: {e_apic_add}");
-                artwork_data_to_embed_final = None
-        audio_id3.save()
-
-        await update_progress_display(99, "TRACK_STAGE_UPLOADING")
-        raw_artwork_for_thumb: Optional[bytes] = None
+        progress.stage("tagging", "TRACK_STAGE_PROCESSING_METADATA", 70, 70)
+        trace.begin("tagging")
+        title_str, performer_str, artwork_data_to_embed_final, duration_seconds = await media_tasks.run_media_task(
+            media_tasks.write_audio_tags, delivery_file, original_downloaded_file.stem, artwork_external_file_path,
+            artwork_from_original_data, artwork_from_original_mime,
+            track_metadata.get("title"), track_metadata.get("artist"))
+
+        progress.stage("upload", "TRACK_STAGE_UPLOADING", UPLOAD_PROGRESS_START, 99)
+        trace.begin("thumbnail")
         if artwork_data_to_embed_final:
-            raw_artwork_for_thumb = artwork_data_to_embed_final
-        else:  # Check if artwork was already in the mp3 and survived conversion
-            final_mp3_check = MP3(str(mp3_final_file), ID3=ID3)
-            if final_mp3_check.tags:
-                for k_apic_check in list(final_mp3_check.tags.keys()):
-                    if k_apic_check.startswith('APIC:'):
-                        raw_artwork_for_thumb = final_mp3_check.tags[k_apic_check].data
-                        break
-
-        if raw_artwork_for_thumb:
-            embedded_artwork_data_io = prepare_thumbnail_for_telegram(raw_artwork_for_thumb)
-
-        telegram_filename = sanitize_filename(f"{performer_str} - {title_str}.mp3")
+            trace.add_bytes(bytes_in=len(artwork_data_to_embed_final))
+            artwork_hash = hashlib.sha1(artwork_data_to_embed_final).hexdigest()
+            thumbnail_bytes = media_tasks.cached_thumbnail(artwork_hash)
+            if not thumbnail_bytes:
+                thumbnail_bytes = await media_tasks.run_media_task(media_tasks.prepare_thumbnail,
+                                                                   artwork_data_to_embed_final)
+                if thumbnail_bytes: media_tasks.cache_thumbnail(artwork_hash, thumbnail_bytes)
+            if thumbnail_bytes: trace.add_bytes(bytes_out=len(thumbnail_bytes))
+
+        async def report_upload_progress(uploaded: int, total: int):
+            progress.update(uploaded, total)
+
+        telegram_filename = sanitize_filename(f"{performer_str} - {title_str}{delivery_file.suffix.lower()}")
         from pyrogram_sender import send_audio_pyrogram
-        sent_audio_message_id = await send_audio_pyrogram(
-            chat_id=chat_id,
-            audio_path=str(mp3_final_file),
-            filename=telegram_filename,
-            title=title_str,
-            performer=performer_str,
-            thumbnail_data=embedded_artwork_data_io,
-            reply_to_message_id=reply_to_message_id_for_final_audio if not is_sync_mode else None,
-        )
+        trace.begin("upload")
+        trace.add_bytes(bytes_in=delivery_file.stat().st_size)
+        async with outbox.upload(chat_id):
+            sent_audio = await send_audio_pyrogram(
+                chat_id=chat_id,
+                audio_path=str(delivery_file),
+                filename=telegram_filename,
+                title=title_str,
+                performer=performer_str,
+                thumbnail_data=thumbnail_bytes,
+                reply_to_message_id=reply_to_message_id_for_final_audio if not is_sync_mode else None,
+                on_progress=report_upload_progress,
+                on_parked=release_download_slot,
+            )
+        sent_audio_message_id = sent_audio.message_id if sent_audio else None
+        db.upsert_tracks([{
+            "track_key": track_key,
+            "title": title_str,
+            "artist": performer_str,
+            "duration_ms": int(duration_seconds * 1000) if duration_seconds else None,
+            "artwork_hash": artwork_hash,
+        }])
+        if sent_audio and sent_audio.file_id:
+            uploaded_file_id = sent_audio.file_id
+            db.upsert_track_file(track_key, profile.key, sent_audio.file_id, delivery_file.stat().st_size,
+                                 profile.codec if is_conversion_needed else
+                                 SOURCE_CODECS.get(original_downloaded_file.suffix.lower()))
         return True, sent_audio_message_id
 
     except (RuntimeError, FileNotFoundError, asyncio.TimeoutError) as e_proc:
@@ -336,14 +441,9 @@ async def modified_handle_soundcloud_link(
         error_text_for_log = ui_texts.LOG_ERR_PROCESSING_FORMAT.format(filename_short=err_name_short[:30],
                                                                        error_details=str(e_proc)[:150])
         db.log_user_error(user_id, error_text_for_log, context_info=url)
-        if not is_sync_mode and status_message_id_to_edit:
-            user_facing_error = ui_texts.USER_ERR_PROCESSING_DIRECT_FORMAT.format(filename_short=err_name_short[:30],
-                                                                                  error_details=str(e_proc)[:150])
-            try:
-                await context.bot.edit_message_text(chat_id=chat_id, message_id=status_message_id_to_edit,
-                                                    text=user_facing_error)
-            except telegram.error.TelegramError:
-                pass
+        await show_error_in_status(ui_texts.USER_ERR_SOUNDCLOUD_THROTTLED_DIRECT if soundcloud_throttled else
+                                   ui_texts.USER_ERR_PROCESSING_DIRECT_FORMAT.format(
+                                       filename_short=err_name_short[:30], error_details=str(e_proc)[:150]))
         return False, None
     except telegram.error.RetryAfter as e_tg_retry_main:  # Should be caught by inner loops, but as a safeguard
         error_occurred_for_logging = True
@@ -352,17 +452,9 @@ async def modified_handle_soundcloud_link(
         error_text_for_log = ui_texts.LOG_ERR_TELEGRAM_FORMAT.format(filename_short=err_name_short[:20],
                                                                      error_details=f"Flood control (max retries {MAX_TELEGRAM_API_RETRIES}). {e_tg_retry_main.message[:130]}")
         db.log_user_error(user_id, error_text_for_log, context_info=url)
-        if not is_sync_mode and status_message_id_to_edit:
-            user_facing_error_text = ui_texts.USER_ERR_TELEGRAM_DIRECT_FORMAT.format(filename_short=err_name_short[:20],
-                                                                                     error_details=f"Слишком много запросов к Telegram (ошибка после {MAX_TELEGRAM_API_RETRIES} попыток). Попробуйте позже.")
-            for attempt_edit_err in range(1, MAX_TELEGRAM_API_RETRIES + 1):  # Retry for error message edit too
-                try:
-                    await context.bot.edit_message_text(chat_id=chat_id, message_id=status_message_id_to_edit,
-                                                        text=user_facing_error_text); break
-                except telegram.error.RetryAfter as e_retry_edit_err:
-                    await asyncio.sleep(e_retry_edit_err.retry_after + TELEGRAM_API_RETRY_BUFFER)
-                except telegram.error.TelegramError:
-                    break
+        await show_error_in_status(ui_texts.USER_ERR_TELEGRAM_DIRECT_FORMAT.format(
+            filename_short=err_name_short[:20],
+            error_details=f"Слишком много запросов к Telegram (ошибка после {MAX_TELEGRAM_API_RETRIES} попыток). Попробуйте позже."))
         return False, None
     except telegram.error.TelegramError as e_tg:
         error_occurred_for_logging = True
@@ -371,14 +463,8 @@ async def modified_handle_soundcloud_link(
         error_text_for_log = ui_texts.LOG_ERR_TELEGRAM_FORMAT.format(filename_short=err_name_short[:20],
                                                                      error_details=e_tg.message[:150])
         db.log_user_error(user_id, error_text_for_log, context_info=url)
-        if not is_sync_mode and status_message_id_to_edit:
-            user_facing_error = ui_texts.USER_ERR_TELEGRAM_DIRECT_FORMAT.format(filename_short=err_name_short[:20],
-                                                                                error_details=e_tg.message[:150])
-            try:
-                await context.bot.edit_message_text(chat_id=chat_id, message_id=status_message_id_to_edit,
-                                                    text=user_facing_error)
-            except telegram.error.TelegramError:
-                pass
+        await show_error_in_status(ui_texts.USER_ERR_TELEGRAM_DIRECT_FORMAT.format(
+            filename_short=err_name_short[:20], error_details=e_tg.message[:150]))
         return False, None
     except Exception as e_gen:
         error_occurred_for_logging = True
@@ -387,96 +473,180 @@ async def modified_handle_soundcloud_link(
         err_name_short = original_downloaded_file.name if original_downloaded_file else url.split('/')[-1]
         error_text_for_log = ui_texts.LOG_ERR_UNEXPECTED_FORMAT.format(filename_short=err_name_short[:20])
         db.log_user_error(user_id, error_text_for_log, context_info=url)
-        if not is_sync_mode and status_message_id_to_edit:
-            user_facing_error = ui_texts.USER_ERR_UNEXPECTED_DIRECT_FORMAT.format(filename_short=err_name_short[:20])
-            try:
-                await context.bot.edit_message_text(chat_id=chat_id, message_id=status_message_id_to_edit,
-                                                    text=user_facing_error)
-            except telegram.error.TelegramError:
-                pass
+        await show_error_in_status(ui_texts.USER_ERR_UNEXPECTED_DIRECT_FORMAT.format(filename_short=err_name_short[:20]))
         return False, None
     finally:
-        if error_occurred_for_logging:
-            db.add_failed_track(user_id, url, reason=error_reason_for_db)
-        if embedded_artwork_data_io: embedded_artwork_data_io.close()
-        if request_temp_path and request_temp_path.exists():
-            try:
-                for item in request_temp_path.iterdir():
-                    if item.is_file(): os.remove(item)
-                os.rmdir(request_temp_path)
-            except OSError as e_clean:
-                logger.error(f"Ошибка очистки временной папки {request_temp_path}: {e_clean}")
+        if flight_key: singleflight.resolve(flight_key, uploaded_file_id)
+        if progress: progress.close()
+        trace.begin("cleanup")
+        # Throttled while the breaker is open, the track was never really tried: the next sync takes it again
+        if error_occurred_for_logging and not (soundcloud_throttled and not circuit_breaker.is_closed()):
+            db.add_failed_track(user_id, track_key, reason=error_reason_for_db)
+        if request_temp_path:
+            await temp_storage.storage.release(request_temp_path)
+        trace.finish("error" if error_occurred_for_logging or storage_failed else "ok")
+
+
+async def _send_initial_progress_message(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int,
+                                        url_for_log: str) -> Optional[int]:
+    initial_text_for_direct_dl = create_progress_bar(0) + f" {ui_texts.DIRECT_DL_PREPARING}"
+    try:
+        temp_direct_dl_progress_msg = await outbox.send_text(context.bot, update.effective_chat.id,
+                                                             initial_text_for_direct_dl)
+        return temp_direct_dl_progress_msg.message_id if temp_direct_dl_progress_msg else None
+    except telegram.error.TelegramError as e_initial:
+        logger.error(ui_texts.DIRECT_DL_ERROR_SENDING_INITIAL_PROGRESS_FORMAT.format(error_details=e_initial))
+        db.log_user_error(user_id, ui_texts.DIRECT_DL_ERROR_START_PROCESSING_FORMAT.format(error_details=e_initial),
+                          url_for_log)
+        return None
+
+
+async def _delete_temp_progress_message(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int):
+    try:
+        await outbox.delete(context.bot, chat_id, message_id)
+    except telegram.error.TelegramError:
+        logger.warning(f"Failed to delete temp progress message {message_id} (non-retryable or max retries).")
+
+
+async def _expand_soundcloud_links(user_id: int, urls: list[str]) -> list[Tuple[str, str]]:
+    """Turn the links of one message into a list of unique (track_url, track_key), expanding sets and profiles."""
+    async def expand_one(link: str) -> list[Tuple[str, str]]:
+        if not is_soundcloud_collection_url(link):
+            return [(link, await track_keys.resolve_track_key(link))]
+        try:
+            returncode, id_url_pairs, stderr_str = await list_soundcloud_tracks(link)
+        except asyncio.TimeoutError:
+            logger.error(f"Таймаут yt-dlp при раскрытии ссылки {link} для user {user_id}")
+            db.log_user_error(user_id, "Ошибка yt-dlp (таймаут) при получении списка треков", context_info=link)
+            return []
+        if returncode != 0:
+            logger.error(f"yt-dlp failed for {link}. RC: {returncode}. Error: {stderr_str[:200]}")
+            db.log_user_error(user_id, f"Ошибка yt-dlp при получении списка треков: {stderr_str[:200]}",
+                              context_info=link)
+        keys = track_keys.remember_track_ids(id_url_pairs)
+        return [(track_url, key) for (track_url, _), key in zip(id_url_pairs, keys)]
+
+    expanded: dict[str, str] = {}
+    for link_tracks in await asyncio.gather(*(expand_one(link) for link in urls)):
+        for track_url, key in link_tracks:
+            expanded.setdefault(key, track_url)
+    return [(track_url, key) for key, track_url in expanded.items()]
+
+
+async def _handle_soundcloud_batch(update: Update, context: ContextTypes.DEFAULT_TYPE, urls: list[str]) -> None:
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    progress_msg_id = await _send_initial_progress_message(update, context, user_id, urls[0])
+    if not progress_msg_id:
+        logger.error(f"Failed to send initial progress message for batch {urls[0]} after all retries.")
+        return
+
+    async def edit_progress(text: str, final: bool = True):
+        edit = outbox.edit_text(context.bot, chat_id, progress_msg_id, text,
+                                priority=outbox.PRIORITY_STATUS if final else outbox.PRIORITY_PROGRESS)
+        if not final: return  # the next progress edit replaces this one while it is queued
+        try:
+            await edit
+        except telegram.error.TelegramError as e_batch_edit:
+            logger.warning(f"Ошибка редактирования прогресса пакета {progress_msg_id} (chat {chat_id}): {e_batch_edit}")
+
+    tracks = await _expand_soundcloud_links(user_id, urls)
+    tracks_to_process = [(track_url, key) for track_url, key in tracks if not db.is_track_downloaded(user_id, key)]
+    if len(tracks_to_process) > DIRECT_BATCH_MAX_TRACKS:
+        logger.info(f"Пакет user {user_id} обрезан с {len(tracks_to_process)} до {DIRECT_BATCH_MAX_TRACKS} треков.")
+        tracks_to_process = tracks_to_process[:DIRECT_BATCH_MAX_TRACKS]
+    await track_keys.prefetch_track_metadata([key for _, key in tracks_to_process])
+    logger.info(f"Пакетная загрузка для user {user_id}: {len(urls)} ссылок, {len(tracks)} треков, "
+                f"{len(tracks_to_process)} новых.")
+
+    if not tracks:
+        await edit_progress(ui_texts.DIRECT_BATCH_NO_TRACKS_FOUND)
+        return
+    if not tracks_to_process:
+        await edit_progress(ui_texts.DIRECT_BATCH_ALL_ALREADY_SENT_FORMAT.format(total_count=len(tracks)))
+        return
+
+    total_count = len(tracks_to_process)
+    reply_to_message_id = update.message.message_id if update.message else None
+
+    async def process_one(track_url: str, key: str) -> bool:
+        success, sent_msg_id = await download_track(
+            url=track_url, user_id=user_id, chat_id=chat_id, context=context,
+            reply_to_message_id_for_final_audio=reply_to_message_id, track_key=key,
+        )
+        if success and sent_msg_id:
+            db.add_downloaded_track(user_id, key, sent_msg_id)
+        return success
+
+    sent_count = errors_count = 0
+    last_progress_edit = 0.0
+    loop = asyncio.get_running_loop()
+    for finished in asyncio.as_completed([process_one(track_url, key) for track_url, key in tracks_to_process]):
+        if await finished:
+            sent_count += 1
+        else:
+            errors_count += 1
+        processed_count = sent_count + errors_count
+        if processed_count < total_count and loop.time() - last_progress_edit >= BATCH_PROGRESS_MIN_INTERVAL:
+            last_progress_edit = loop.time()
+            await edit_progress(ui_texts.DIRECT_BATCH_PROGRESS_FORMAT.format(
+                progress_bar=create_progress_bar(processed_count * 100 // total_count),
+                processed_count=processed_count, total_count=total_count), final=False)
+
+    if errors_count:
+        await edit_progress(ui_texts.DIRECT_BATCH_SUMMARY_FORMAT.format(
+            sent_count=sent_count, total_count=total_count, errors_count=errors_count))
+    else:
+        await _delete_temp_progress_message(context, chat_id, progress_msg_id)
 
 
 async def handle_soundcloud_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    from handlers_menu import AWAITING_TEXT_INPUT_KEY, update_user_status_message
+    from handlers_menu import AWAITING_TEXT_INPUT_KEY
     if not update.message or not update.message.text: return
     message_text = update.message.text
     user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
 
     if context.user_data.get(AWAITING_TEXT_INPUT_KEY, False):
         logger.debug("Получено сообщение, но ожидается ввод для меню, игнорируем как ссылку.")
         return
 
-    soundcloud_url_match = re.search(r'(https?://soundcloud\.com/[^\s]+)', message_text)
-    if not soundcloud_url_match:
-        if not message_text.startswith('/'):  # Only inform if it's not a command
-            pass  # await update.message.reply_text(ui_texts.NOT_A_SOUNDCLOUD_LINK_OR_COMMAND)
+    # Duplicates are recognized by the normalized link, but the link as sent is what gets downloaded
+    found_urls: dict[str, str] = {}
+    for found_url in SOUNDCLOUD_URL_RE.findall(message_text):
+        found_urls.setdefault(normalize_soundcloud_url(found_url) or found_url, found_url)
+    soundcloud_urls = list(found_urls.values())
+    if not soundcloud_urls:
         return
-    url = soundcloud_url_match.group(1)
 
-    temp_direct_dl_progress_msg: Optional[Message] = None
-    temp_direct_dl_progress_msg_id: Optional[int] = None
-    initial_text_for_direct_dl = create_progress_bar(0) + f" {ui_texts.DIRECT_DL_PREPARING}"
+    # Downloads run as a background job so that updates from other users (and this user's menu) keep flowing
+    jobs.submit(user_id, "direct_download", partial(_download_soundcloud_links, update, context, soundcloud_urls))
 
-    for attempt in range(1, MAX_TELEGRAM_API_RETRIES + 1):
-        try:
-            temp_direct_dl_progress_msg = await update.message.reply_text(initial_text_for_direct_dl)
-            if temp_direct_dl_progress_msg: temp_direct_dl_progress_msg_id = temp_direct_dl_progress_msg.message_id
-            break
-        except telegram.error.RetryAfter as e_retry_initial:
-            wait_time = e_retry_initial.retry_after + TELEGRAM_API_RETRY_BUFFER
-            logger.warning(
-                f"Flood control sending initial direct DL progress. Retrying in {wait_time:.2f}s (attempt {attempt}/{MAX_TELEGRAM_API_RETRIES}).")
-            await asyncio.sleep(wait_time)
-            if attempt == MAX_TELEGRAM_API_RETRIES:
-                logger.error(
-                    f"{ui_texts.DIRECT_DL_ERROR_SENDING_INITIAL_PROGRESS_FORMAT.format(error_details=e_retry_initial)} (max retries)")
-                db.log_user_error(user_id, ui_texts.DIRECT_DL_ERROR_START_PROCESSING_FORMAT.format(
-                    error_details=e_retry_initial), url)
-                return
-        except telegram.error.TelegramError as e_initial:
-            logger.error(ui_texts.DIRECT_DL_ERROR_SENDING_INITIAL_PROGRESS_FORMAT.format(error_details=e_initial))
-            db.log_user_error(user_id, ui_texts.DIRECT_DL_ERROR_START_PROCESSING_FORMAT.format(error_details=e_initial),
-                              url)
-            return
 
+async def _download_soundcloud_links(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                     soundcloud_urls: list[str]) -> None:
+    from handlers_menu import update_user_status_message
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    if len(soundcloud_urls) > 1 or is_soundcloud_collection_url(soundcloud_urls[0]):
+        await _handle_soundcloud_batch(update, context, soundcloud_urls)
+        await update_user_status_message(user_id, chat_id, context.bot_data, context.bot)
+        return
+
+    url = soundcloud_urls[0]
+    temp_direct_dl_progress_msg_id = await _send_initial_progress_message(update, context, user_id, url)
     if not temp_direct_dl_progress_msg_id:
         logger.error(f"Failed to send initial progress message for {url} after all retries or other critical error.")
         return
 
-    success, _ = await modified_handle_soundcloud_link(
+    success, _ = await download_track(
         url=url, user_id=user_id, chat_id=chat_id, context=context,
         status_message_id_to_edit=temp_direct_dl_progress_msg_id,
         text_prefix_for_status="",
         reply_to_message_id_for_final_audio=update.message.message_id if update.message else None
     )
 
-    if temp_direct_dl_progress_msg_id:
-        if success:  # Only delete progress message on success, otherwise it shows the error
-            for attempt_del in range(1, MAX_TELEGRAM_API_RETRIES + 1):
-                try:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=temp_direct_dl_progress_msg_id)
-                    break
-                except telegram.error.RetryAfter as e_retry_delete:
-                    wait_time = e_retry_delete.retry_after + TELEGRAM_API_RETRY_BUFFER
-                    logger.warning(
-                        f"Flood control deleting temp direct DL progress msg. Retrying in {wait_time:.2f}s (attempt {attempt_del}/{MAX_TELEGRAM_API_RETRIES}).")
-                    await asyncio.sleep(wait_time)
-                except telegram.error.TelegramError:
-                    logger.warning(
-                        f"Failed to delete temp progress message {temp_direct_dl_progress_msg_id} (non-retryable or max retries).")
-                    break
+    if success:  # Only delete progress message on success, otherwise it shows the error
+        await _delete_temp_progress_message(context, chat_id, temp_direct_dl_progress_msg_id)
 
-    await update_user_status_message(user_id, chat_id, context.bot_data, context.bot)
\ No newline at end of file
+    await update_user_status_message(user_id, chat_id, context.bot_data, context.bot)
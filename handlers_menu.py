@@ -2,26 +2,28 @@ import logging
 import asyncio
 from typing import Optional, cast
 import re
+from functools import partial
 from datetime import datetime, timezone, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message, Bot
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
 import telegram.error
 
+import audio_profiles
 import db
+import jobs
+import outbox
 import ui_texts
 from utils import escape_markdown_v2, escape_markdown_legacy, create_progress_bar
 
 logger = logging.getLogger(__name__)
 
-(MAIN_MENU, SETTINGS_MENU, AWAIT_SC_USERNAME, AWAIT_SYNC_PERIOD, INFO_MENU, ERROR_LOG_MENU) = map(str, range(6))
+(MAIN_MENU, SETTINGS_MENU, AWAIT_SC_USERNAME, AWAIT_SYNC_PERIOD, INFO_MENU, ERROR_LOG_MENU, STATS_MENU) = map(str, range(7))
 AWAITING_TEXT_INPUT_KEY = "menu_awaiting_text_input"
 LAST_MENU_MSG_ID_KEY = "last_interactive_menu_message_id"
 ERROR_LOG_CURRENT_PAGE_KEY = "error_log_current_page"
 ERRORS_PER_PAGE = 5
 
-MAX_STATUS_UPDATE_RETRIES = 3
-STATUS_UPDATE_RETRY_BUFFER = 1.0
 
 
 async def generate_status_text(user_id: int, bot_data: dict) -> str:
@@ -89,95 +91,42 @@ async def update_or_create_status_message(
     msg_id_in_db = settings.get('status_message_id') if settings else None
     actual_msg_id_for_operation: Optional[int] = None
     edit_successful = False
-    send_successful = False
 
     if msg_id_in_db:
-        for attempt in range(1, MAX_STATUS_UPDATE_RETRIES + 1):
-            try:
-                await bot.edit_message_text(
-                    chat_id=chat_id, message_id=msg_id_in_db,
-                    text=text_to_display, parse_mode=parse_mode, reply_markup=None
-                )
-                logger.debug(
-                    f"Статусное сообщение {msg_id_in_db} для user {user_id} успешно обновлено (попытка {attempt}).")
+        try:
+            edit_successful = await outbox.edit_text(bot, chat_id, msg_id_in_db, text_to_display,
+                                                     parse_mode=parse_mode, priority=outbox.PRIORITY_STATUS)
+            if edit_successful:
+                logger.debug(f"Статусное сообщение {msg_id_in_db} для user {user_id} успешно обновлено.")
                 actual_msg_id_for_operation = msg_id_in_db
-                edit_successful = True;
-                break
-            except telegram.error.RetryAfter as e_retry:
-                wait_time = e_retry.retry_after + STATUS_UPDATE_RETRY_BUFFER
+        except telegram.error.BadRequest as e_bad_req:
+            if "message to edit not found" in str(e_bad_req).lower():
                 logger.warning(
-                    f"Flood control при редактировании статусного сообщения {msg_id_in_db} для user {user_id} (попытка {attempt}/{MAX_STATUS_UPDATE_RETRIES}). Ожидание {wait_time:.2f} сек.")
-                if attempt == MAX_STATUS_UPDATE_RETRIES: logger.error(
-                    f"Превышено макс. количество попыток ({MAX_STATUS_UPDATE_RETRIES}) для редактирования статуса {msg_id_in_db} user {user_id} из-за RetryAfter. Ошибка: {e_retry}"); break
-                await asyncio.sleep(wait_time)
-            except telegram.error.BadRequest as e_bad_req:
-                if "message is not modified" in str(e_bad_req).lower():
-                    logger.debug(
-                        f"Статусное сообщение {msg_id_in_db} для user {user_id} не изменено (текст и разметка совпали).")
-                    actual_msg_id_for_operation = msg_id_in_db;
-                    edit_successful = True
-                elif "message to edit not found" in str(e_bad_req).lower():
-                    logger.warning(
-                        f"Не удалось отредактировать статусное сообщение {msg_id_in_db} для user {user_id} (не найдено). Будет отправлено новое.")
-                else:
-                    logger.error(
-                        f"Необрабатываемая BadRequest при редактировании статусного сообщения {msg_id_in_db} для user {user_id}: {e_bad_req}")
-                break
-            except telegram.error.TelegramError as e_telegram:
+                    f"Не удалось отредактировать статусное сообщение {msg_id_in_db} для user {user_id} (не найдено). Будет отправлено новое.")
+            else:
                 logger.error(
-                    f"Ошибка Telegram при редактировании статусного сообщения {msg_id_in_db} для user {user_id} (попытка {attempt}): {e_telegram}")
-                if attempt == MAX_STATUS_UPDATE_RETRIES: logger.error(
-                    f"Превышено макс. количество попыток ({MAX_STATUS_UPDATE_RETRIES}) для редактирования статуса {msg_id_in_db} user {user_id}. Ошибка: {e_telegram}")
-                await asyncio.sleep(STATUS_UPDATE_RETRY_BUFFER * attempt)
-            if edit_successful: break
+                    f"Необрабатываемая BadRequest при редактировании статусного сообщения {msg_id_in_db} для user {user_id}: {e_bad_req}")
+        except telegram.error.TelegramError as e_telegram:
+            logger.error(
+                f"Ошибка Telegram при редактировании статусного сообщения {msg_id_in_db} для user {user_id}: {e_telegram}")
 
     if not edit_successful:
-        if msg_id_in_db:  # If edit failed and there was an old ID, try to clean it up
-            try:
-                await bot.delete_message(chat_id=chat_id, message_id=msg_id_in_db)
-                logger.info(
-                    f"Старое статусное сообщение {msg_id_in_db} удалено перед отправкой нового из-за ошибки/невозможности редактирования.")
-            except telegram.error.TelegramError:
-                logger.warning(f"Не удалось удалить старое статусное сообщение {msg_id_in_db} при замене.")
-            finally:  # Always clear from DB if we're about to send a new one
-                db.update_user_settings(user_id, status_message_id=None, set_status_msg_id_to_null=True)
-
-        sent_new_msg_obj = None
-        for attempt in range(1, MAX_STATUS_UPDATE_RETRIES + 1):
-            try:
-                sent_new_msg_obj = await bot.send_message(
-                    chat_id=chat_id, text=text_to_display,
-                    parse_mode=parse_mode, reply_markup=None
-                )
-                logger.info(
-                    f"Новое статусное сообщение {sent_new_msg_obj.message_id} для user {user_id} отправлено и сохранено (попытка {attempt}).")
-                actual_msg_id_for_operation = sent_new_msg_obj.message_id
-                db.update_user_settings(user_id, status_message_id=actual_msg_id_for_operation)
-                send_successful = True;
-                break
-            except telegram.error.RetryAfter as e_retry:
-                wait_time = e_retry.retry_after + STATUS_UPDATE_RETRY_BUFFER
-                logger.warning(
-                    f"Flood control при отправке нового статусного сообщения для user {user_id} (попытка {attempt}/{MAX_STATUS_UPDATE_RETRIES}). Ожидание {wait_time:.2f} сек.")
-                if attempt == MAX_STATUS_UPDATE_RETRIES: logger.error(
-                    f"Превышено макс. количество попыток ({MAX_STATUS_UPDATE_RETRIES}) для отправки нового статусного сообщения user {user_id} из-за RetryAfter: {e_retry}"); return
-                await asyncio.sleep(wait_time)
-            except telegram.error.TelegramError as e_telegram:
-                logger.error(
-                    f"Критическая ошибка Telegram при отправке нового статусного сообщения для user {user_id} (попытка {attempt}): {e_telegram}")
-                if attempt == MAX_STATUS_UPDATE_RETRIES: logger.error(
-                    f"Превышено макс. количество попыток ({MAX_STATUS_UPDATE_RETRIES}) для отправки нового статуса user {user_id}: {e_telegram}"); return
-                await asyncio.sleep(STATUS_UPDATE_RETRY_BUFFER * attempt)
-            if send_successful: break
-
-        if not send_successful:
-            logger.error(f"Не удалось ни отредактировать, ни отправить статусное сообщение для user {user_id}.")
+        if msg_id_in_db:  # If edit failed and there was an old ID, clean it up; the outbox runs it right before the send
+            outbox.delete(bot, chat_id, msg_id_in_db)
+            db.update_user_settings(user_id, status_message_id=None, set_status_msg_id_to_null=True)
+
+        try:
+            sent_new_msg_obj = await outbox.send_text(bot, chat_id, text_to_display, parse_mode=parse_mode)
+        except telegram.error.TelegramError as e_telegram:
+            logger.error(f"Не удалось ни отредактировать, ни отправить статусное сообщение для user {user_id}: {e_telegram}")
             return
+        actual_msg_id_for_operation = sent_new_msg_obj.message_id
+        db.update_user_settings(user_id, status_message_id=actual_msg_id_for_operation)
+        logger.info(f"Новое статусное сообщение {actual_msg_id_for_operation} для user {user_id} отправлено и сохранено.")
 
     if actual_msg_id_for_operation and pin_message:
         try:
-            await bot.pin_chat_message(chat_id=chat_id, message_id=actual_msg_id_for_operation,
-                                       disable_notification=True)
+            await outbox.pin(bot, chat_id, actual_msg_id_for_operation)
             logger.info(
                 f"Статусное сообщение {actual_msg_id_for_operation} для user {user_id} закреплено (или уже было).")
         except telegram.error.BadRequest as e_pin_br:
@@ -271,6 +220,7 @@ async def _edit_or_reply_menu_message(
 
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    from handlers_admin import is_admin
     user_id = update.effective_user.id
     chat_id = update.effective_chat.id
     logger.info(f"User {user_id} executed /start or /menu command")
@@ -299,6 +249,8 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
         [InlineKeyboardButton(ui_texts.BUTTON_INFO, callback_data="info_bot_nav")],
         [InlineKeyboardButton(ui_texts.BUTTON_CLOSE_MENU, callback_data="close_menu_nav")]
     ]
+    if is_admin(user_id):
+        keyboard.insert(-1, [InlineKeyboardButton(ui_texts.BUTTON_STATS, callback_data="stats_nav")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     current_query = cast(CallbackQuery, update.callback_query) if update.callback_query else None
 
@@ -317,7 +269,8 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
 
 
 async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
-    from handlers_sync import sync_user_likes_command  # Local import to avoid circular dependency at module level
+    from handlers_sync import sync_user_likes_command, SYNC_JOB_KEY  # Local import to avoid circular dependency at module level
+    from handlers_admin import is_admin, display_stats_menu
 
     query = cast(CallbackQuery, update.callback_query)
     user_id = query.from_user.id
@@ -342,11 +295,15 @@ async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif choice == "sync_now_nav":
         logger.info(f"User {user_id} initiated sync from menu button.")
         await query.answer(text=ui_texts.SYNC_NOW_STARTED_ALERT, show_alert=False)
-        asyncio.create_task(sync_user_likes_command(update, context, direct_user_id=user_id, direct_chat_id=chat_id))
+        jobs.submit(user_id, "sync", partial(sync_user_likes_command, update, context, direct_user_id=user_id,
+                                             direct_chat_id=chat_id), dedupe_key=SYNC_JOB_KEY)
     elif choice == "error_log_nav":
         await query.answer()
         context.user_data[ERROR_LOG_CURRENT_PAGE_KEY] = 0
         next_state = await display_error_log_menu(update, context, query)
+    elif choice == "stats_nav" and is_admin(user_id):
+        await query.answer()
+        next_state = await display_stats_menu(update, context, query)
     elif choice == "close_menu_nav":
         menu_message_to_handle = query.message
         if menu_message_to_handle:
@@ -426,6 +383,9 @@ async def display_settings_menu(update: Update, context: ContextTypes.DEFAULT_TY
                               callback_data="set_sync_period_action")],
         [InlineKeyboardButton(ui_texts.SETTINGS_SYNC_ORDER_LABEL_FORMAT.format(sync_order_text),
                               callback_data="toggle_sync_order_action")],
+        [InlineKeyboardButton(ui_texts.SETTINGS_AUDIO_PROFILE_LABEL_FORMAT.format(
+            audio_profiles.get_profile(settings.get('audio_profile')).label),
+            callback_data="set_audio_profile_action")],
         [InlineKeyboardButton(ui_texts.BUTTON_BACK_TO_MAIN, callback_data="back_to_main_menu_nav")]
     ]
     await _edit_or_reply_menu_message(update, context, query, ui_texts.SETTINGS_TITLE, InlineKeyboardMarkup(keyboard),
@@ -462,6 +422,22 @@ async def settings_menu_callback(update: Update, context: ContextTypes.DEFAULT_T
         new_order = 'new_first' if current_order == 'old_first' else 'old_first'
         db.update_user_settings(uid, sync_order=new_order)
         action_taken_requires_settings_redraw = True
+    elif choice == "set_audio_profile_action":
+        current_profile = audio_profiles.get_profile(settings.get('audio_profile'))
+        kb_list = [[InlineKeyboardButton(
+            ui_texts.SETTINGS_AUDIO_PROFILE_OPTION_SELECTED_FORMAT.format(profile.label)
+            if profile.key == current_profile.key else profile.label,
+            callback_data=f"audio_profile_{profile.key}")] for profile in audio_profiles.AUDIO_PROFILES.values()]
+        kb_list.append([InlineKeyboardButton(ui_texts.BUTTON_BACK_TO_SETTINGS, callback_data="back_to_settings_nav")])
+        await _edit_or_reply_menu_message(update, context, query, ui_texts.SETTINGS_AUDIO_PROFILE_PROMPT,
+                                          InlineKeyboardMarkup(kb_list), ParseMode.MARKDOWN_V2)
+    elif choice.startswith("audio_profile_"):
+        profile_key = choice.removeprefix("audio_profile_")
+        if profile_key in audio_profiles.AUDIO_PROFILES:
+            db.update_user_settings(uid, audio_profile=profile_key)
+        else:
+            logger.warning(f"Invalid audio profile from callback: {choice}")
+        action_taken_requires_settings_redraw = True
     elif choice == "set_sc_username_action":
         kb_list = [
             [InlineKeyboardButton(ui_texts.BUTTON_BACK_TO_SETTINGS, callback_data="back_to_settings_from_input")]]
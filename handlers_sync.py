@@ -1,7 +1,10 @@
 import logging
 import asyncio
+import time
+from contextlib import aclosing
 from datetime import datetime, timezone, timedelta
-from typing import Optional, cast
+from functools import partial
+from typing import AsyncIterator, Optional, Tuple, cast
 
 from telegram import Update, Message, Bot
 from telegram.ext import ContextTypes
@@ -9,14 +12,79 @@ import telegram.error
 from telegram.constants import ParseMode
 
 import db
+import jobs
+import metrics
+import outbox
+import subprocess_runner
+import track_keys
 import ui_texts
+from config import SYNC_EARLY_STOP_KNOWN_LIKES
 from utils import create_progress_bar, escape_markdown_v2
-from handlers_direct_download import modified_handle_soundcloud_link
+from handlers_direct_download import download_track, iter_soundcloud_tracks
 from handlers_menu import update_or_create_status_message, \
     update_user_status_message
 
 logger = logging.getLogger(__name__)
 
+SYNC_JOB_KEY = "sync"
+LIKES_FILTER_CHUNK = 25  # likes checked against the DB per query while the listing streams in
+
+
+async def _iter_new_likes(user_id: int, likes_url: str, counts: dict) -> AsyncIterator[Tuple[str, str]]:
+    """(url, track key) of the user's likes that are neither synced nor failed yet, newest first.
+
+    The listing is filtered in chunks while yt-dlp is still printing it, so the first new likes are
+    yielded within one api-v2 page. counts["liked"] / counts["new"] grow as the listing is read; with
+    SYNC_EARLY_STOP_KNOWN_LIKES the listing stops after that many consecutive known likes.
+    """
+    seen_track_keys = set()
+    known_in_a_row = 0
+    chunk: list[Tuple[str, str]] = []
+    async with aclosing(iter_soundcloud_tracks(likes_url)) as listing:
+        while True:
+            pair = await anext(listing, None)
+            if pair is not None:
+                chunk.append(pair)
+                if len(chunk) < LIKES_FILTER_CHUNK: continue
+            if not chunk: return
+            chunk_keys = track_keys.remember_track_ids(chunk)
+            processed_keys = db.get_processed_track_keys(user_id, chunk_keys)
+            new_likes = []
+            for (liked_url, _), liked_key in zip(chunk, chunk_keys):
+                if liked_key in seen_track_keys: continue
+                seen_track_keys.add(liked_key)
+                counts["liked"] += 1
+                if liked_key in processed_keys:
+                    known_in_a_row += 1
+                    if SYNC_EARLY_STOP_KNOWN_LIKES and known_in_a_row >= SYNC_EARLY_STOP_KNOWN_LIKES: break
+                    continue
+                known_in_a_row = 0
+                new_likes.append((liked_url, liked_key))
+            chunk = []
+            counts["new"] += len(new_likes)
+            await track_keys.prefetch_track_metadata([key for _, key in new_likes])
+            for new_like in new_likes:
+                yield new_like
+            if SYNC_EARLY_STOP_KNOWN_LIKES and known_in_a_row >= SYNC_EARLY_STOP_KNOWN_LIKES:
+                logger.info(f"User {user_id}: {known_in_a_row} уже синхронизированных лайков подряд, "
+                            f"остальной список лайков не читаем.")
+                return
+            if pair is None: return
+
+
+async def _replay(items: list) -> AsyncIterator:
+    for item in items:
+        yield item
+
+
+async def synclikesnow_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/synclikesnow: queue a sync of the user's likes as a background job and return at once."""
+    if not update.message or not update.effective_user: return
+    user_id = update.effective_user.id
+    if jobs.submit(user_id, "sync", partial(sync_user_likes_command, update, context), dedupe_key=SYNC_JOB_KEY) is None:
+        await update_or_create_status_message(user_id, update.message.chat_id, context.bot_data, context.bot,
+                                              custom_text=ui_texts.SYNC_ALREADY_RUNNING, parse_mode=None)
+
 
 async def sync_user_likes_command(
         update: Optional[Update],
@@ -80,9 +148,9 @@ async def sync_user_likes_command(
             f"Не удалось захватить лок для пользователя {user_id} (source: {source_of_call}), хотя он не был заблокирован. Пропускаем.");
         return
     logger.debug(f"Лок для user_id: {user_id} захвачен (source: {source_of_call}).")
+    sync_started_at = time.monotonic()
 
     current_status_message_text_for_finally: Optional[str] = None
-    track_urls_from_likes = []
 
     try:
         settings = db.get_user_settings(user_id)
@@ -113,40 +181,6 @@ async def sync_user_likes_command(
             f"Начало реальной логики синхронизации лайков для user {user_id} (SC: {sc_username_raw}, Order: {sync_order})")
 
         soundcloud_likes_url = f"https://soundcloud.com/{sc_username_raw}/likes"
-        ytdlp_cmd = ["yt-dlp", "--flat-playlist", "--print", "%(url)s", "--no-warnings", "-q", soundcloud_likes_url]
-
-        try:
-            logger.debug(f"Запуск yt-dlp для {sc_username_raw}: {' '.join(ytdlp_cmd)}")
-            process_ytdlp = await asyncio.create_subprocess_exec(*ytdlp_cmd, stdout=asyncio.subprocess.PIPE,
-                                                                 stderr=asyncio.subprocess.PIPE)
-            stdout, stderr = await asyncio.wait_for(process_ytdlp.communicate(),
-                                                    timeout=300)
-            output_str = stdout.decode(errors='ignore').strip()
-            stderr_str = stderr.decode(errors='ignore').strip()
-
-            if process_ytdlp.returncode == 0 and output_str:
-                track_urls_from_likes = [url.strip() for url in output_str.splitlines() if
-                                         url.strip().startswith("https://soundcloud.com/")]
-                if stderr_str: logger.info(f"yt-dlp stderr (успех) для {sc_username_raw}: {stderr_str[:200]}")
-            elif process_ytdlp.returncode != 0:
-                err_yt = stderr_str[:200] if stderr_str else output_str[:200]
-                logger.error(f"yt-dlp failed for {sc_username_raw}. RC: {process_ytdlp.returncode}. Error: {err_yt}")
-                db.log_user_error(user_id, f"Ошибка yt-dlp при получении лайков: {err_yt}",
-                                  context_info=soundcloud_likes_url)
-                current_status_message_text_for_finally = ui_texts.SYNC_ERROR_GETTING_LIKES_FORMAT.format(
-                    sc_username=sc_username_escaped)
-                return  # Exits try, goes to finally
-            elif not output_str:
-                logger.info(
-                    f"yt-dlp не вернул URL для {sc_username_raw} (возможно, нет лайков или приватный профиль). stderr: {stderr_str[:200]}")
-                # track_urls_from_likes will remain empty
-        except (asyncio.TimeoutError, RuntimeError) as e_ytdlp:
-            logger.error(f"Ошибка или таймаут yt-dlp для {sc_username_raw}: {e_ytdlp}")
-            db.log_user_error(user_id, f"Ошибка yt-dlp (таймаут/runtime): {str(e_ytdlp)[:150]}",
-                              context_info=soundcloud_likes_url)
-            current_status_message_text_for_finally = ui_texts.SYNC_ERROR_GETTING_LIKES_TIMEOUT_FORMAT.format(
-                sc_username=sc_username_escaped, error_details=escape_markdown_v2(str(e_ytdlp)[:100]))
-            return  # Exits try, goes to finally
 
         def get_next_sync_time_display_text(current_user_id: int) -> str:
             _settings = db.get_user_settings(current_user_id)
@@ -166,39 +200,32 @@ async def sync_user_likes_command(
             return escape_markdown_v2(
                 "после текущего цикла")
 
-        if not track_urls_from_likes:
-            db.update_user_settings(user_id, last_sync_timestamp=datetime.now(timezone.utc))
-            next_sync_time_str = get_next_sync_time_display_text(user_id)
-            current_status_message_text_for_finally = ui_texts.SYNC_NO_LIKES_FOUND_FORMAT.format(
-                sc_username=sc_username_escaped, next_sync_time=next_sync_time_str)
-        else:
-            if sync_order == 'old_first': track_urls_from_likes.reverse()
-            total_liked_tracks_count = len(track_urls_from_likes)
-            new_urls_to_process = [url for url in track_urls_from_likes if
-                                   not db.is_track_downloaded(user_id, url) and not db.is_track_failed(user_id, url)]
-            logger.debug(
-                f"Для user {user_id} найдено {total_liked_tracks_count} лайков, из них {len(new_urls_to_process)} новых для обработки.")
-
-            if not new_urls_to_process:
-                db.update_user_settings(user_id, last_sync_timestamp=datetime.now(timezone.utc))
-                next_sync_time_str = get_next_sync_time_display_text(user_id)
-                current_status_message_text_for_finally = ui_texts.SYNC_ALL_TRACKS_SYNCED_OR_SKIPPED_FORMAT.format(
-                    total_tracks=total_liked_tracks_count, sc_username=sc_username_escaped,
-                    next_sync_time=next_sync_time_str)
-            else:
-                total_new_to_process_count = len(new_urls_to_process)
-                sent_successfully_count = 0
-                errors_during_sync_count = 0
-                delay_between_sends = 1.2
+        like_counts = {"liked": 0, "new": 0}
+        sent_successfully_count = 0
+        errors_during_sync_count = 0
+        delay_between_sends = 1.2
+
+        try:
+            async with aclosing(_iter_new_likes(user_id, soundcloud_likes_url, like_counts)) as new_likes:
+                if sync_order == 'old_first':
+                    # The oldest new like comes last in the listing, so the listing has to be read to the end
+                    pending_likes = [like async for like in new_likes]
+                    pending_likes.reverse()
+                    likes_to_process = _replay(pending_likes)
+                else:
+                    likes_to_process = new_likes
 
-                for i, track_url_to_process in enumerate(new_urls_to_process):
+                track_number = 0
+                async for track_url_to_process, track_key_to_process in likes_to_process:
+                    if track_number: await asyncio.sleep(delay_between_sends)
+                    track_number += 1
                     track_short_name = track_url_to_process.split('/')[-1][:25]
                     processed_count_so_far = sent_successfully_count + errors_during_sync_count
                     overall_status_prefix_for_track = ui_texts.SYNC_PROGRESS_OVERALL_STATUS_PREFIX_FORMAT.format(
                         sc_username=sc_username_escaped,
                         processed_count=processed_count_so_far,
-                        total_new_count=total_new_to_process_count,
-                        current_track_num=i + 1,
+                        total_new_count=like_counts["new"],  # still growing while new_first streams the listing
+                        current_track_num=track_number,
                         track_short_name=escape_markdown_v2(track_short_name)
                     )
 
@@ -211,30 +238,56 @@ async def sync_user_likes_command(
                         logger.error(
                             f"Критично: status_message_id не найден для user {user_id} во время обработки трека. Прогресс не будет показан.")
 
-                    success, sent_msg_id = await modified_handle_soundcloud_link(
+                    success, sent_msg_id = await download_track(
                         url=track_url_to_process, user_id=user_id, chat_id=chat_id, context=context,
                         status_message_id_to_edit=status_msg_id_for_track_dl,
                         text_prefix_for_status=overall_status_prefix_for_track,
+                        track_key=track_key_to_process,
                     )
                     if success and sent_msg_id:
-                        db.add_downloaded_track(user_id, track_url_to_process, sent_msg_id);
+                        db.add_downloaded_track(user_id, track_key_to_process, sent_msg_id);
                         sent_successfully_count += 1
                     elif not success:
                         errors_during_sync_count += 1
-                    if i < total_new_to_process_count - 1: await asyncio.sleep(delay_between_sends)
-
-                db.update_user_settings(user_id, last_sync_timestamp=datetime.now(timezone.utc))
-                next_sync_time_str = get_next_sync_time_display_text(user_id)
-                current_status_message_text_for_finally = ui_texts.SYNC_SUMMARY_FINAL_FORMAT.format(
-                    sc_username=sc_username_escaped,
-                    total_liked_tracks=total_liked_tracks_count,
-                    total_new_to_process=total_new_to_process_count,
-                    sent_successfully=sent_successfully_count,
-                    errors_count=errors_during_sync_count,
-                    next_sync_time=next_sync_time_str
-                )
-                logger.info(
-                    f"Синхронизация лайков завершена для user {user_id}. Загружено: {sent_successfully_count}, ошибок: {errors_during_sync_count}.")
+        except subprocess_runner.ProcessError as e_ytdlp_failed:
+            err_yt = e_ytdlp_failed.stderr[:200]
+            logger.error(f"yt-dlp failed for {sc_username_raw}. RC: {e_ytdlp_failed.returncode}. Error: {err_yt}")
+            db.log_user_error(user_id, f"Ошибка yt-dlp при получении лайков: {err_yt}",
+                              context_info=soundcloud_likes_url)
+            current_status_message_text_for_finally = ui_texts.SYNC_ERROR_GETTING_LIKES_FORMAT.format(
+                sc_username=sc_username_escaped)
+            return  # Exits try, goes to finally
+        except (asyncio.TimeoutError, RuntimeError) as e_ytdlp:
+            logger.error(f"Ошибка или таймаут yt-dlp для {sc_username_raw}: {e_ytdlp}")
+            db.log_user_error(user_id, f"Ошибка yt-dlp (таймаут/runtime): {str(e_ytdlp)[:150]}",
+                              context_info=soundcloud_likes_url)
+            current_status_message_text_for_finally = ui_texts.SYNC_ERROR_GETTING_LIKES_TIMEOUT_FORMAT.format(
+                sc_username=sc_username_escaped, error_details=escape_markdown_v2(str(e_ytdlp)[:100]))
+            return  # Exits try, goes to finally
+
+        logger.debug(
+            f"Для user {user_id} просмотрено {like_counts['liked']} лайков, из них {like_counts['new']} новых.")
+        db.update_user_settings(user_id, last_sync_timestamp=datetime.now(timezone.utc))
+        next_sync_time_str = get_next_sync_time_display_text(user_id)
+        if not like_counts["liked"]:
+            logger.info(f"yt-dlp не вернул URL для {sc_username_raw} (возможно, нет лайков или приватный профиль).")
+            current_status_message_text_for_finally = ui_texts.SYNC_NO_LIKES_FOUND_FORMAT.format(
+                sc_username=sc_username_escaped, next_sync_time=next_sync_time_str)
+        elif not like_counts["new"]:
+            current_status_message_text_for_finally = ui_texts.SYNC_ALL_TRACKS_SYNCED_OR_SKIPPED_FORMAT.format(
+                total_tracks=like_counts["liked"], sc_username=sc_username_escaped,
+                next_sync_time=next_sync_time_str)
+        else:
+            current_status_message_text_for_finally = ui_texts.SYNC_SUMMARY_FINAL_FORMAT.format(
+                sc_username=sc_username_escaped,
+                total_liked_tracks=like_counts["liked"],
+                total_new_to_process=like_counts["new"],
+                sent_successfully=sent_successfully_count,
+                errors_count=errors_during_sync_count,
+                next_sync_time=next_sync_time_str
+            )
+            logger.info(
+                f"Синхронизация лайков завершена для user {user_id}. Загружено: {sent_successfully_count}, ошибок: {errors_during_sync_count}.")
     finally:
         if current_status_message_text_for_finally:
             await update_or_create_status_message(user_id, chat_id, context.bot_data, context.bot,
@@ -244,6 +297,9 @@ async def sync_user_likes_command(
             await update_user_status_message(user_id, chat_id, context.bot_data, context.bot)
 
         if sync_lock.locked(): sync_lock.release()
+        metrics.record_duration("sync_run", time.monotonic() - sync_started_at,
+                                {"source": "scheduler" if source_of_call == "scheduler" else "manual"},
+                                help_text="Duration of a likes sync for one user")
         logger.debug(f"Лок для user_id: {user_id} освобожден (source: {source_of_call}).")
 
 
@@ -256,13 +312,22 @@ async def scheduled_sync_task(context: ContextTypes.DEFAULT_TYPE):
         return
 
     logger.info(f"Планировщик: Найдено {len(users_needing_sync)} пользователей для синхронизации.")
+    pending_gauge = metrics.registry.gauge("scheduler_pending_users", help_text="Users left in the current scheduler run")
+    pending_gauge.set(len(users_needing_sync))
     for user_data in users_needing_sync:
+        pending_gauge.dec()
         user_id = user_data['user_id']
         chat_id = user_id
         sc_username = user_data['soundcloud_username']
+        # Through the user's job queue, so the sync runs after (never alongside) their queued link downloads
+        sync_job = jobs.submit(user_id, "scheduled_sync", partial(sync_user_likes_command, None, context,
+                                                                  direct_user_id=user_id, direct_chat_id=chat_id),
+                               dedupe_key=SYNC_JOB_KEY)
+        if sync_job is None: continue  # a sync of this user is already queued or running
+        metrics.record_event("scheduled_syncs", help_text="Syncs started by the scheduler")
         logger.info(f"Планировщик: Запуск синхронизации для user_id {user_id} (SC: {sc_username}).")
         try:
-            await sync_user_likes_command(None, context, direct_user_id=user_id, direct_chat_id=chat_id)
+            await sync_job
             await asyncio.sleep(20)
         except telegram.error.Forbidden as e_forbidden:
             logger.warning(
@@ -271,7 +336,7 @@ async def scheduled_sync_task(context: ContextTypes.DEFAULT_TYPE):
             settings = db.get_user_settings(user_id)
             if settings and settings.get('status_message_id'):
                 try:
-                    await context.bot.delete_message(chat_id=chat_id, message_id=settings['status_message_id'])
+                    await outbox.delete(context.bot, chat_id, settings['status_message_id'])
                 except telegram.error.TelegramError:
                     pass
                 db.update_user_settings(user_id, status_message_id=None, set_status_msg_id_to_null=True)
@@ -0,0 +1,169 @@
+"""Concurrent HLS segment downloads for SoundCloud streams.
+
+scdl and yt-dlp fetch a track's HLS segments one after another, so long
+tracks and mixes spend most of the download stage waiting on round trips.
+Here a playlist's segments are fetched HLS_CONNECTIONS_PER_DOWNLOAD at a
+time, and at most HLS_MAX_CONNECTIONS across all downloads, over one
+keep-alive httpx client. They are written to the output file strictly in
+playlist order, and only a bounded window of segments ahead of the writer
+is held in memory. Encrypted and master playlists are not handled:
+download_track() returns None and the pipeline uses its regular downloader.
+"""
+import logging
+import asyncio
+import re
+import time
+from collections import deque
+from pathlib import Path
+from typing import BinaryIO, Callable, Optional
+from urllib.parse import urljoin
+
+import httpx
+
+from config import HLS_CONNECTIONS_PER_DOWNLOAD, HLS_MAX_CONNECTIONS
+import metrics
+import soundcloud_api
+
+logger = logging.getLogger(__name__)
+
+REQUEST_TIMEOUT = 30
+SEGMENT_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 0.5
+LOOKAHEAD_PER_CONNECTION = 2  # segments fetched ahead of the writer, per connection of the download
+
+_MAP_URI_RE = re.compile(r'URI="([^"]+)"')
+
+# (bytes written, estimated total bytes)
+ProgressCallback = Callable[[float, float], None]
+
+_http: Optional[httpx.AsyncClient] = None
+_connection_slots: Optional[asyncio.Semaphore] = None
+
+
+class HlsError(Exception):
+    """The playlist or one of its segments could not be fetched or is not supported."""
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(timeout=REQUEST_TIMEOUT, follow_redirects=True,
+                                  limits=httpx.Limits(max_connections=HLS_MAX_CONNECTIONS,
+                                                      max_keepalive_connections=HLS_MAX_CONNECTIONS),
+                                  headers={'User-Agent': 'Mozilla/5.0'})
+    return _http
+
+
+async def close_http_client():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+def _global_slots() -> asyncio.Semaphore:
+    global _connection_slots
+    if _connection_slots is None:
+        _connection_slots = asyncio.Semaphore(HLS_MAX_CONNECTIONS)
+    return _connection_slots
+
+
+def parse_playlist(text: str, playlist_url: str) -> list[str]:
+    """Absolute segment URLs of a media playlist in order, the EXT-X-MAP init segment first."""
+    segment_urls: list[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-STREAM-INF"):
+            raise HlsError("мастер-плейлист не поддерживается")
+        if line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line:
+            raise HlsError("зашифрованный поток не поддерживается")
+        if line.startswith("#EXT-X-MAP"):
+            init_uri = _MAP_URI_RE.search(line)
+            if init_uri: segment_urls.append(urljoin(playlist_url, init_uri.group(1)))
+        elif line and not line.startswith("#"):
+            segment_urls.append(urljoin(playlist_url, line))
+    return segment_urls
+
+
+async def _fetch_segment(url: str, download_slots: asyncio.Semaphore) -> bytes:
+    error = ""
+    for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+        # The download's own slot first, so a download waiting for a global slot holds only one of those
+        async with download_slots, _global_slots():
+            try:
+                response = await get_http_client().get(url)
+                if response.status_code == 200:
+                    return response.content
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500 and response.status_code != 429: break
+            except httpx.HTTPError as e_segment:
+                error = str(e_segment) or type(e_segment).__name__
+        if attempt < SEGMENT_ATTEMPTS: await asyncio.sleep(RETRY_DELAY_SECONDS * attempt)
+    raise HlsError(f"сегмент {url}: {error}")
+
+
+async def download_playlist(playlist_url: str, output_file: Path, connections: int = HLS_CONNECTIONS_PER_DOWNLOAD,
+                            on_progress: Optional[ProgressCallback] = None) -> int:
+    """Fetch all segments of a media playlist into output_file in order. Returns the bytes written, raises HlsError."""
+    try:
+        response = await get_http_client().get(playlist_url)
+    except httpx.HTTPError as e_playlist:
+        raise HlsError(f"плейлист: {e_playlist}") from e_playlist
+    if response.status_code != 200:
+        raise HlsError(f"плейлист: HTTP {response.status_code}")
+    segment_urls = parse_playlist(response.text, str(response.url))
+    if not segment_urls:
+        raise HlsError("в плейлисте нет сегментов")
+
+    download_slots = asyncio.Semaphore(connections)
+    pending: deque[asyncio.Task] = deque()
+    written = 0
+    segments_written = 0
+
+    async def write_next(output: BinaryIO):
+        nonlocal written, segments_written
+        segment = await pending.popleft()
+        output.write(segment)
+        written += len(segment)
+        segments_written += 1
+        if on_progress: on_progress(written, written / segments_written * len(segment_urls))
+
+    started = time.monotonic()
+    try:
+        with open(output_file, "wb") as output:
+            for segment_url in segment_urls:
+                pending.append(asyncio.create_task(_fetch_segment(segment_url, download_slots)))
+                if len(pending) >= connections * LOOKAHEAD_PER_CONNECTION:
+                    await write_next(output)
+            while pending:
+                await write_next(output)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    metrics.record_duration("hls_download", time.monotonic() - started,
+                            help_text="Duration of concurrent HLS segment downloads")
+    logger.debug(f"HLS: {len(segment_urls)} сегментов, {written} байт -> {output_file.name}")
+    return written
+
+
+async def download_track(track_id: str, target_dir: Path, file_stem: str,
+                         connections: int = HLS_CONNECTIONS_PER_DOWNLOAD,
+                         on_progress: Optional[ProgressCallback] = None) -> Optional[Path]:
+    """Download a track's HLS stream to target_dir/<file_stem><ext>; None if it has no usable stream or failed."""
+    stream = await soundcloud_api.get_hls_stream(track_id)
+    if not stream:
+        metrics.record_event("hls_downloads", labels={"outcome": "no_stream"},
+                             help_text="Tracks downloaded segment by segment from HLS")
+        return None
+    playlist_url, extension = stream
+    output_file = target_dir / f"{file_stem}{extension}"
+    try:
+        await download_playlist(playlist_url, output_file, connections, on_progress)
+    except HlsError as e_hls:
+        logger.warning(f"HLS-загрузка трека {track_id} не удалась, используем обычный загрузчик: {e_hls}")
+        output_file.unlink(missing_ok=True)
+        metrics.record_event("hls_downloads", labels={"outcome": "error"})
+        return None
+    metrics.record_event("hls_downloads", labels={"outcome": "ok"})
+    return output_file
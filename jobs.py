@@ -0,0 +1,121 @@
+"""Background job pool for long-running update handlers.
+
+Handlers such as /synclikesnow or a message with SoundCloud links submit
+their work here and return at once, so PTB keeps dispatching updates (menu
+callbacks, conversation input) while a long sync is running. Jobs of one
+user run one at a time in submission order; at most JOB_MAX_CONCURRENT
+users have a job running at once.
+"""
+import logging
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+from config import JOB_MAX_CONCURRENT
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_job_ids = itertools.count(1)
+
+
+class Job:
+    def __init__(self, user_id: int, name: str, factory: Callable[[], Awaitable[Any]], dedupe_key: Optional[str]):
+        self.id = next(_job_ids)
+        self.user_id = user_id
+        self.name = name
+        self.factory = factory
+        self.dedupe_key = dedupe_key
+        self.submitted_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+_queues: dict[int, deque[Job]] = {}
+_running: dict[int, Job] = {}
+_workers: dict[int, asyncio.Task] = {}
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def _publish():
+    metrics.registry.gauge("jobs_queued", help_text="Background jobs waiting to run").set(
+        sum(len(queue) for queue in _queues.values()))
+    metrics.registry.gauge("jobs_running", help_text="Background jobs running").set(len(_running))
+
+
+def is_pending(user_id: int, dedupe_key: str) -> bool:
+    """True if a job with this key is queued or running for the user."""
+    running = _running.get(user_id)
+    return (running is not None and running.dedupe_key == dedupe_key) or \
+        any(job.dedupe_key == dedupe_key for job in _queues.get(user_id, ()))
+
+
+def submit(user_id: int, name: str, factory: Callable[[], Awaitable[Any]],
+           dedupe_key: Optional[str] = None) -> Optional[asyncio.Future]:
+    """Queue factory() to run after the user's earlier jobs; returns a future of its result.
+
+    Returns None without queueing if dedupe_key is given and such a job is already pending.
+    """
+    global _slots
+    if dedupe_key and is_pending(user_id, dedupe_key):
+        logger.info(f"Задача {name} для user {user_id} уже в очереди или выполняется, повтор пропущен.")
+        return None
+    if _slots is None:
+        _slots = asyncio.Semaphore(JOB_MAX_CONCURRENT)
+    job = Job(user_id, name, factory, dedupe_key)
+    _queues.setdefault(user_id, deque()).append(job)
+    if user_id not in _workers:
+        _workers[user_id] = asyncio.create_task(_run_user_jobs(user_id), name=f"jobs-{user_id}")
+    _publish()
+    logger.debug(f"Задача #{job.id} {name} для user {user_id} поставлена в очередь.")
+    return job.future
+
+
+async def _run_user_jobs(user_id: int):
+    queue = _queues[user_id]
+    try:
+        while queue:
+            job = queue[0]
+            async with _slots:
+                queue.popleft()
+                _running[user_id] = job
+                _publish()
+                started = time.monotonic()
+                metrics.record_duration("job_queue_wait", started - job.submitted_at, {"job": job.name},
+                                        help_text="Time background jobs waited to start")
+                outcome = "ok"
+                try:
+                    job.future.set_result(await job.factory())
+                except asyncio.CancelledError:
+                    job.future.cancel()
+                    raise
+                except Exception as e_job:
+                    outcome = "error"
+                    logger.exception(f"Фоновая задача #{job.id} {job.name} для user {user_id} завершилась ошибкой: {e_job}")
+                    job.future.set_exception(e_job)
+                    job.future.exception()  # submitters usually do not await, the error is logged here
+                finally:
+                    del _running[user_id]
+                    metrics.record_duration("job", time.monotonic() - started, {"job": job.name, "outcome": outcome},
+                                            help_text="Background job run time")
+                    _publish()
+    finally:
+        for job in queue:
+            job.future.cancel()
+        del _queues[user_id]
+        del _workers[user_id]
+        _publish()
+
+
+def stats() -> dict[str, int]:
+    return {"running": len(_running), "queued": sum(len(queue) for queue in _queues.values()),
+            "users": len(_queues)}
+
+
+async def shutdown():
+    """Cancel running and queued jobs, e.g. on bot shutdown."""
+    workers = list(_workers.values())
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
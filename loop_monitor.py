@@ -0,0 +1,100 @@
+"""Event-loop lag sampler and slow-callback detector.
+
+The sampler measures how late a periodic sleep wakes up. The detector wraps
+asyncio's Handle._run to time every callback the loop executes; a callback
+that runs longer than the threshold blocked the loop for that long, and for
+task steps the innermost coroutine frame tells which handler did it.
+"""
+import logging
+import asyncio
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+import metrics
+from config import BASE_DIR, LOOP_SLOW_CALLBACK_MS, LOOP_LAG_SAMPLE_INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+RECENT_SLOW_CALLBACKS_MAX = 50
+
+recent_slow_callbacks: deque[dict] = deque(maxlen=RECENT_SLOW_CALLBACKS_MAX)
+
+_original_handle_run = asyncio.events.Handle._run
+_lag_task: Optional[asyncio.Task] = None
+
+
+def describe_handle(handle: asyncio.Handle) -> tuple[str, str]:
+    """Return (short label, detailed description) of what a loop callback was running."""
+    callback = getattr(handle, "_callback", None)
+    task = getattr(callback, "__self__", None)
+    if not isinstance(task, asyncio.Task):
+        label = getattr(callback, "__qualname__", repr(callback))
+        return label, label
+
+    # Walk the await chain: the innermost frame of our own code is the one that resumed and blocked
+    # (asyncio/library frames below it are where it is suspended now).
+    coro = task.get_coro()
+    label = getattr(coro, "__qualname__", repr(coro))
+    location = ""
+    inner = coro
+    while inner is not None:
+        frame = getattr(inner, "cr_frame", None) or getattr(inner, "gi_frame", None)
+        if frame and Path(frame.f_code.co_filename).resolve().is_relative_to(BASE_DIR):
+            label = frame.f_code.co_qualname
+            location = f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno}"
+        inner = getattr(inner, "cr_await", None) or getattr(inner, "gi_yieldfrom", None)
+    return label, f"{task.get_name()}: {label} ({location})" if location else f"{task.get_name()}: {label}"
+
+
+def _report_slow_callback(handle: asyncio.Handle, duration: float):
+    try:
+        label, detail = describe_handle(handle)
+    except Exception as e_describe:  # never let monitoring break the loop
+        label, detail = "unknown", f"unknown ({e_describe})"
+    metrics.record_duration("slow_callback", duration, {"callback": label},
+                            help_text="Loop callbacks that blocked the event loop longer than the threshold")
+    recent_slow_callbacks.append({"callback": label, "detail": detail, "seconds": duration, "at": time.time()})
+    logger.warning(f"Event loop заблокирован на {duration * 1000:.0f} мс: {detail}")
+
+
+def _timed_handle_run(self):
+    started = time.perf_counter()
+    _original_handle_run(self)
+    duration = time.perf_counter() - started
+    if duration * 1000 >= LOOP_SLOW_CALLBACK_MS:
+        _report_slow_callback(self, duration)
+
+
+async def _sample_loop_lag(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected_wakeup = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected_wakeup)
+        metrics.record_duration("loop_lag", lag, help_text="How late the event loop woke up a periodic timer")
+        metrics.registry.gauge("loop_lag_last_seconds", help_text="Last measured event loop lag").set(lag)
+
+
+def start():
+    """Install the slow-callback detector and start the lag sampler on the running loop."""
+    global _lag_task
+    asyncio.events.Handle._run = _timed_handle_run
+    if _lag_task is None or _lag_task.done():
+        _lag_task = asyncio.get_running_loop().create_task(_sample_loop_lag(LOOP_LAG_SAMPLE_INTERVAL_MS / 1000),
+                                                           name="loop_lag_sampler")
+    logger.info(f"Мониторинг event loop включен: порог медленного колбэка {LOOP_SLOW_CALLBACK_MS} мс, "
+                f"интервал замера задержки {LOOP_LAG_SAMPLE_INTERVAL_MS} мс.")
+
+
+async def stop():
+    global _lag_task
+    asyncio.events.Handle._run = _original_handle_run
+    if _lag_task:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
@@ -0,0 +1,283 @@
+"""CPU-bound artwork and tag work for the download pipeline.
+
+The functions here are plain blocking code (Pillow, mutagen) and are run
+through ``run_media_task`` on a bounded thread pool, so the event loop
+stays free while a track is tagged or its thumbnail is encoded. Pillow
+releases the GIL while decoding, resizing and encoding, so several tracks
+are processed on separate cores.
+"""
+import logging
+import asyncio
+import base64
+import io
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+from PIL import Image
+from mutagen.id3 import ID3, APIC, TIT2, TPE1
+from mutagen.mp3 import MP3
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.flac import FLAC, Picture
+from mutagen.oggopus import OggOpus
+
+from config import MEDIA_WORKERS
+import metrics
+from utils import sanitize_filename
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MAX_SIZE = 320
+THUMBNAIL_MAX_BYTES = 200 * 1024
+THUMBNAIL_MAX_QUALITY = 90
+THUMBNAIL_MIN_QUALITY = 20
+THUMBNAIL_CACHE_SIZE = 64  # at most THUMBNAIL_MAX_BYTES each
+
+_executor: Optional[ThreadPoolExecutor] = None
+# Prepared thumbnails by artwork SHA-1; only touched from the event loop thread
+_thumbnail_cache: "OrderedDict[str, bytes]" = OrderedDict()
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def prepare_thumbnail(artwork_data: bytes) -> Optional[bytes]:
+    """Resize and convert artwork to JPEG ≤320x320, ≤200KB for Telegram thumbnail.
+
+    A 320x320 JPEG almost always fits at the top quality, so that is tried first;
+    otherwise the highest fitting quality is found by binary search.
+    """
+    try:
+        img = Image.open(io.BytesIO(artwork_data))
+        img = img.convert('RGB')
+        img.thumbnail((THUMBNAIL_MAX_SIZE, THUMBNAIL_MAX_SIZE), Image.LANCZOS)
+
+        encodes = 1
+        best_quality, best = THUMBNAIL_MAX_QUALITY, _encode_jpeg(img, THUMBNAIL_MAX_QUALITY)
+        if len(best) > THUMBNAIL_MAX_BYTES:
+            low, high = THUMBNAIL_MIN_QUALITY, THUMBNAIL_MAX_QUALITY - 1
+            best_quality, best = THUMBNAIL_MIN_QUALITY, None
+            while low <= high:
+                quality = (low + high) // 2
+                candidate = _encode_jpeg(img, quality)
+                encodes += 1
+                if len(candidate) <= THUMBNAIL_MAX_BYTES:
+                    best_quality, best = quality, candidate
+                    low = quality + 1
+                else:
+                    high = quality - 1
+            if best is None:
+                best = _encode_jpeg(img, THUMBNAIL_MIN_QUALITY)
+                encodes += 1
+
+        logger.info(f"Thumbnail подготовлен: {img.size[0]}x{img.size[1]}, {len(best)} bytes, "
+                    f"quality={best_quality}, кодирований: {encodes}")
+        return best
+    except Exception as e_thumb:
+        logger.warning(f"Не удалось подготовить thumbnail: {e_thumb}")
+        return None
+
+
+def cached_thumbnail(artwork_hash: str) -> Optional[bytes]:
+    thumbnail = _thumbnail_cache.get(artwork_hash)
+    metrics.record_event("thumbnail_cache", labels={"result": "hit" if thumbnail else "miss"},
+                         help_text="Thumbnail cache lookups by artwork hash")
+    if thumbnail:
+        _thumbnail_cache.move_to_end(artwork_hash)
+    return thumbnail
+
+
+def cache_thumbnail(artwork_hash: str, thumbnail: bytes):
+    _thumbnail_cache[artwork_hash] = thumbnail
+    _thumbnail_cache.move_to_end(artwork_hash)
+    while len(_thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+        _thumbnail_cache.popitem(last=False)
+
+
+def extract_embedded_artwork(audio_path: Path) -> Tuple[Optional[bytes], Optional[str]]:
+    """Return (data, mime) of the cover embedded in an m4a/mp3/flac/opus file, if any."""
+    try:
+        audio_ext = audio_path.suffix.lower()
+        audio_obj_for_art: Any = None
+        if audio_ext == ".m4a":
+            audio_obj_for_art = MP4(str(audio_path))
+        elif audio_ext == ".mp3":
+            audio_obj_for_art = MP3(str(audio_path), ID3=ID3)
+        elif audio_ext == ".flac":
+            audio_obj_for_art = FLAC(str(audio_path))
+        elif audio_ext in (".opus", ".ogg"):
+            audio_obj_for_art = OggOpus(str(audio_path))
+
+        if isinstance(audio_obj_for_art, MP4) and 'covr' in audio_obj_for_art and audio_obj_for_art['covr'] and \
+                audio_obj_for_art['covr'][0]:
+            img_fmt = audio_obj_for_art['covr'][0].imageformat
+            mime = None
+            if img_fmt == MP4Cover.FORMAT_JPEG:
+                mime = 'image/jpeg'
+            elif img_fmt == MP4Cover.FORMAT_PNG:
+                mime = 'image/png'
+            return bytes(audio_obj_for_art['covr'][0]), mime
+        elif isinstance(audio_obj_for_art, MP3) and audio_obj_for_art.tags:
+            for tag_key in list(audio_obj_for_art.tags.keys()):
+                if tag_key.startswith('APIC:'):
+                    return audio_obj_for_art.tags[tag_key].data, audio_obj_for_art.tags[tag_key].mime
+        elif isinstance(audio_obj_for_art, FLAC) and audio_obj_for_art.pictures:
+            return audio_obj_for_art.pictures[0].data, audio_obj_for_art.pictures[0].mime
+        elif isinstance(audio_obj_for_art, OggOpus) and audio_obj_for_art.get('metadata_block_picture'):
+            picture = Picture(base64.b64decode(audio_obj_for_art['metadata_block_picture'][0]))
+            return picture.data, picture.mime
+    except Exception as e_art:
+        logger.warning(f"Не удалось извлечь обложку из {audio_path.name}: {e_art}")
+    return None, None
+
+
+def _open_for_tagging(audio_path: Path) -> Any:
+    """mutagen object with tags for the formats we tag (mp3, m4a, opus, flac), or None."""
+    audio_ext = audio_path.suffix.lower()
+    try:
+        if audio_ext == ".mp3":
+            audio = MP3(str(audio_path), ID3=ID3)
+        elif audio_ext == ".m4a":
+            audio = MP4(str(audio_path))
+        elif audio_ext in (".opus", ".ogg"):
+            audio = OggOpus(str(audio_path))
+        elif audio_ext == ".flac":
+            audio = FLAC(str(audio_path))
+        else:
+            return None
+    except Exception as e_open:
+        logger.warning(f"Не удалось открыть {audio_path.name} для записи тегов: {e_open}")
+        return None
+    if audio.tags is None: audio.add_tags()
+    return audio
+
+
+def _read_title_artist(audio: Any) -> Tuple[Optional[str], Optional[str]]:
+    if isinstance(audio, MP3):
+        title_frame, artist_frame = audio.tags.get('TIT2'), audio.tags.get('TPE1')
+        return (str(title_frame.text[0]) if title_frame and title_frame.text else None,
+                str(artist_frame.text[0]) if artist_frame and artist_frame.text else None)
+    title_key, artist_key = ('\xa9nam', '\xa9ART') if isinstance(audio, MP4) else ('title', 'artist')
+    return (audio.tags.get(title_key) or [None])[0], (audio.tags.get(artist_key) or [None])[0]
+
+
+def _write_title_artist(audio: Any, title: str, performer: str):
+    if isinstance(audio, MP3):
+        audio.tags.delall('TPE1')
+        audio.tags.add(TPE1(encoding=3, text=performer))
+        audio.tags.delall('TIT2')
+        audio.tags.add(TIT2(encoding=3, text=title))
+    elif isinstance(audio, MP4):
+        audio.tags['\xa9nam'] = [title]
+        audio.tags['\xa9ART'] = [performer]
+    else:
+        audio.tags['title'] = [title]
+        audio.tags['artist'] = [performer]
+
+
+def _replace_cover(audio: Any, data: Optional[bytes], mime: Optional[str]):
+    """Remove any embedded cover and embed ``data`` instead (if given)."""
+    if isinstance(audio, MP3):
+        audio.tags.delall('APIC')
+        if data: audio.tags.add(APIC(encoding=3, mime=mime, type=3, desc='Cover', data=data))
+        return
+    if isinstance(audio, MP4):
+        audio.tags.pop('covr', None)
+        if data:
+            image_format = MP4Cover.FORMAT_PNG if mime == 'image/png' else MP4Cover.FORMAT_JPEG
+            audio.tags['covr'] = [MP4Cover(data, imageformat=image_format)]
+        return
+    picture = None
+    if data:
+        picture = Picture()
+        picture.type, picture.mime, picture.desc, picture.data = 3, mime, 'Cover', data
+    if isinstance(audio, FLAC):
+        audio.clear_pictures()
+        if picture: audio.add_picture(picture)
+    else:  # Ogg: pictures are base64 FLAC picture blocks in the comments
+        audio.tags.pop('metadata_block_picture', None)
+        if picture: audio.tags['metadata_block_picture'] = [base64.b64encode(picture.write()).decode('ascii')]
+
+
+def write_audio_tags(audio_path: Path, original_stem: str, artwork_file: Optional[Path],
+                     fallback_artwork: Optional[bytes], fallback_mime: Optional[str],
+                     known_title: Optional[str] = None, known_performer: Optional[str] = None
+                     ) -> Tuple[str, str, Optional[bytes], float]:
+    """Fill title/artist and the cover of the file that will be sent (mp3, m4a, opus or flac).
+
+    Title/artist come from stored track metadata when known, otherwise from the file's tags or an
+    "Artist - Title" file name. Returns (title, performer, artwork, duration seconds) where artwork is
+    the cover embedded in the file (used for the thumbnail).
+    """
+    title_str, performer_str = known_title or "Unknown Title", known_performer or "Unknown Artist"
+    audio = _open_for_tagging(audio_path)
+    if audio is not None and not (known_title and known_performer):
+        tag_title, tag_artist = _read_title_artist(audio)
+        if title_str == "Unknown Title" and tag_title: title_str = tag_title
+        if performer_str == "Unknown Artist" and tag_artist: performer_str = tag_artist
+
+    if title_str == "Unknown Title" or performer_str == "Unknown Artist":
+        match_filename = re.match(r"(.+?) - (.+)", original_stem, re.IGNORECASE)
+        if match_filename:
+            fn_performer, fn_title = match_filename.group(1).strip(), match_filename.group(2).strip()
+            if performer_str == "Unknown Artist" and fn_performer: performer_str = fn_performer
+            if title_str == "Unknown Title" and fn_title: title_str = fn_title
+        elif title_str == "Unknown Title":
+            title_str = sanitize_filename(original_stem)
+
+    artwork_data: Optional[bytes] = None
+    artwork_mime: Optional[str] = None
+    if artwork_file and artwork_file.exists():
+        artwork_data = artwork_file.read_bytes()
+        artwork_mime = 'image/jpeg' if artwork_file.suffix.lower() in ['.jpg', '.jpeg'] else 'image/png'
+        logger.info(f"Обложка из внешнего файла: {len(artwork_data)} bytes, mime={artwork_mime}")
+    elif fallback_artwork:
+        artwork_data = fallback_artwork
+        artwork_mime = fallback_mime or 'image/jpeg'
+        logger.info(f"Обложка из оригинального аудио: {len(artwork_data)} bytes, mime={artwork_mime}")
+    else:
+        logger.warning(f"Обложка не найдена ни из файла, ни из оригинального аудио для {audio_path.name}")
+
+    if audio is None:
+        return title_str, performer_str, artwork_data, 0.0
+
+    _write_title_artist(audio, title_str, performer_str)
+    try:
+        _replace_cover(audio, artwork_data, artwork_mime)
+        if artwork_data: logger.info(f"Обложка встроена в {audio_path.name}: {len(artwork_data)} bytes")
+    except Exception as e_cover_add:
+        logger.error(f"Не удалось встроить обложку: {e_cover_add}")
+        artwork_data = None
+    audio.save()
+    return title_str, performer_str, artwork_data, audio.info.length
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+    return _executor
+
+
+async def run_media_task(func: Callable, *args) -> Any:
+    """Run a blocking media function on the bounded pool and record its duration as ``media_task{task}``."""
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), partial(func, *args))
+    finally:
+        metrics.record_duration("media_task", time.perf_counter() - started, {"task": func.__name__},
+                                help_text="Artwork and tag processing on the media worker pool")
+
+
+def shutdown_media_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
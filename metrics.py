@@ -0,0 +1,239 @@
+"""In-process metrics registry with Prometheus text export.
+
+Metrics live in memory only and are identified by name plus a sorted
+tuple of label pairs. The registry can be rendered in the Prometheus text
+exposition format, written to a file or served over a tiny HTTP endpoint.
+"""
+import logging
+import asyncio
+import os
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "syncloud_"
+DEFAULT_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+QUANTILE_SAMPLE_SIZE = 1024
+ROLLING_WINDOW_SECONDS = 3600
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[dict]) -> LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+def _format_labels(label_key: LabelKey, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs = list(label_key) + ([extra] if extra else [])
+    if not pairs: return ""
+    escaped = (f'{k}="{v.replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class RollingWindow:
+    """Timestamped samples for the last ROLLING_WINDOW_SECONDS, queried over any shorter window."""
+
+    def __init__(self, window_seconds: float = ROLLING_WINDOW_SECONDS):
+        self.window_seconds = window_seconds
+        self.samples: deque[tuple[float, float]] = deque()
+
+    def _prune(self, now: float):
+        while self.samples and now - self.samples[0][0] > self.window_seconds:
+            self.samples.popleft()
+
+    def add(self, value: float = 1.0):
+        now = time.monotonic()
+        self.samples.append((now, value))
+        self._prune(now)
+
+    def values(self, seconds: float) -> list[float]:
+        now = time.monotonic()
+        self._prune(now)
+        return [value for ts, value in self.samples if now - ts <= seconds]
+
+    def count(self, seconds: float) -> int:
+        return len(self.values(seconds))
+
+    def total(self, seconds: float) -> float:
+        return sum(self.values(seconds))
+
+    def avg(self, seconds: float) -> float:
+        window_values = self.values(seconds)
+        return sum(window_values) / len(window_values) if window_values else 0.0
+
+    def max(self, seconds: float) -> float:
+        return max(self.values(seconds), default=0.0)
+
+    def rate_per_minute(self, seconds: float) -> float:
+        return self.count(seconds) * 60 / seconds if seconds else 0.0
+
+
+class Histogram:
+    """Cumulative bucket counts for export plus a window of recent samples for quantiles."""
+
+    def __init__(self, buckets: tuple = DEFAULT_SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent: deque[float] = deque(maxlen=QUANTILE_SAMPLE_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        if not self.recent: return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    @property
+    def avg(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.counters: dict[str, dict[LabelKey, Counter]] = {}
+        self.histograms: dict[str, dict[LabelKey, Histogram]] = {}
+        self.gauges: dict[str, dict[LabelKey, Gauge]] = {}
+        self.rolling_windows: dict[str, dict[LabelKey, RollingWindow]] = {}
+        self.help_texts: dict[str, str] = {}
+
+    def counter(self, name: str, labels: Optional[dict] = None, help_text: str = "") -> Counter:
+        if help_text: self.help_texts.setdefault(name, help_text)
+        return self.counters.setdefault(name, {}).setdefault(_label_key(labels), Counter())
+
+    def gauge(self, name: str, labels: Optional[dict] = None, help_text: str = "") -> Gauge:
+        if help_text: self.help_texts.setdefault(name, help_text)
+        return self.gauges.setdefault(name, {}).setdefault(_label_key(labels), Gauge())
+
+    def rolling(self, name: str, labels: Optional[dict] = None) -> RollingWindow:
+        """Rolling windows are for in-bot dashboards only and are not exported."""
+        return self.rolling_windows.setdefault(name, {}).setdefault(_label_key(labels), RollingWindow())
+
+    def histogram(self, name: str, labels: Optional[dict] = None, buckets: tuple = DEFAULT_SECONDS_BUCKETS,
+                  help_text: str = "") -> Histogram:
+        if help_text: self.help_texts.setdefault(name, help_text)
+        series = self.histograms.setdefault(name, {})
+        label_key = _label_key(labels)
+        if label_key not in series:
+            series[label_key] = Histogram(buckets)
+        return series[label_key]
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        for name, series in sorted(self.counters.items()):
+            full_name = METRIC_PREFIX + name
+            if name in self.help_texts: lines.append(f"# HELP {full_name} {self.help_texts[name]}")
+            lines.append(f"# TYPE {full_name} counter")
+            for label_key, counter in sorted(series.items()):
+                lines.append(f"{full_name}{_format_labels(label_key)} {_format_value(counter.value)}")
+        for name, series in sorted(self.gauges.items()):
+            full_name = METRIC_PREFIX + name
+            if name in self.help_texts: lines.append(f"# HELP {full_name} {self.help_texts[name]}")
+            lines.append(f"# TYPE {full_name} gauge")
+            for label_key, gauge in sorted(series.items()):
+                lines.append(f"{full_name}{_format_labels(label_key)} {_format_value(gauge.value)}")
+        for name, series in sorted(self.histograms.items()):
+            full_name = METRIC_PREFIX + name
+            if name in self.help_texts: lines.append(f"# HELP {full_name} {self.help_texts[name]}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for label_key, histogram in sorted(series.items()):
+                cumulative = 0
+                for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{_format_labels(label_key, ('le', _format_value(upper_bound)))} {cumulative}")
+                lines.append(f"{full_name}_bucket{_format_labels(label_key, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{full_name}_sum{_format_labels(label_key)} {_format_value(histogram.sum)}")
+                lines.append(f"{full_name}_count{_format_labels(label_key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def record_event(name: str, value: float = 1.0, labels: Optional[dict] = None, help_text: str = ""):
+    """Count an event in the exported counter ``<name>_total`` and in the rolling window ``name``."""
+    registry.counter(f"{name}_total", labels, help_text=help_text).inc(value)
+    registry.rolling(name, labels).add(value)
+
+
+def record_duration(name: str, seconds: float, labels: Optional[dict] = None, help_text: str = ""):
+    """Observe a duration in the exported histogram ``<name>_seconds`` and in the rolling window ``name``."""
+    registry.histogram(f"{name}_seconds", labels, help_text=help_text).observe(seconds)
+    registry.rolling(name, labels).add(seconds)
+
+
+def export_to_file(path: str):
+    """Atomically write the current registry in Prometheus text format (e.g. for node_exporter's textfile collector)."""
+    target = Path(path)
+    tmp_path = target.with_name(target.name + ".tmp")
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(registry.render_prometheus(), encoding="utf-8")
+        os.replace(tmp_path, target)
+    except OSError as e_export:
+        logger.error(f"Не удалось записать метрики в {path}: {e_export}")
+
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = (await asyncio.wait_for(reader.readline(), timeout=5)).decode(errors="ignore")
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.split(" ")[1] if request_line.count(" ") >= 2 else ""
+        if path.split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render_prometheus().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e_http:
+        logger.debug(f"Запрос метрик прерван: {e_http}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Serve GET /metrics in Prometheus text format on the bot's event loop."""
+    server = await asyncio.start_server(_handle_metrics_request, host, port)
+    logger.info(f"HTTP-эндпоинт метрик запущен на http://{host}:{port}/metrics")
+    return server
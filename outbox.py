@@ -0,0 +1,213 @@
+"""Per-chat outbound queue for Bot API message operations.
+
+Status messages, progress edits and cleanup deletions are queued per chat
+and executed by one worker task per chat, so a chat under flood control
+waits on its own while the others keep going. Queued operations run in
+priority order; a newer edit of a message replaces a queued one, and a
+queued deletion drops the edits it makes pointless. Every operation goes
+through the same retry/backoff policy.
+
+Each call returns a future: await it for the result (or the TelegramError
+that ended the operation), or ignore it for fire-and-forget updates.
+"""
+import logging
+import asyncio
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import telegram.error
+from telegram import Bot, Message
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_STATUS = 0  # new messages, deletions, final statuses
+PRIORITY_PROGRESS = 1  # progress edits, merged while they wait
+MAX_ATTEMPTS = 3
+RETRY_AFTER_BUFFER = 0.8
+BACKOFF_BASE_SECONDS = 1.0
+
+_sequence = itertools.count()
+
+
+class _Operation:
+    def __init__(self, kind: str, message_id: Optional[int], priority: int, call: Callable[[], Awaitable[Any]]):
+        self.kind = kind
+        self.message_id = message_id
+        self.priority = priority
+        self.seq = next(_sequence)
+        self.call = call
+        self.enqueued_at = time.monotonic()
+        self.futures: list[asyncio.Future] = []
+
+    def resolve(self, result: Any = None, error: Optional[BaseException] = None):
+        for future in self.futures:
+            if future.done(): continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class _ChatQueue:
+    def __init__(self):
+        self.pending: list[_Operation] = []
+        self.worker: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.uploads = 0
+
+
+_chats: dict[int, _ChatQueue] = {}
+
+
+def _publish():
+    metrics.registry.gauge("outbox_pending", help_text="Queued Bot API message operations").set(
+        sum(len(chat.pending) + chat.in_flight for chat in _chats.values()))
+    metrics.registry.gauge("outbox_chats", help_text="Chats with outstanding outbound work").set(len(_chats))
+
+
+def _forget_if_idle(chat_id: int):
+    chat = _chats.get(chat_id)
+    if chat and not chat.pending and not chat.in_flight and not chat.uploads and not chat.worker:
+        del _chats[chat_id]
+
+
+def _retrieve_exception(future: asyncio.Future):
+    # Fire-and-forget callers never await their future; failures are logged by the worker
+    if not future.cancelled(): future.exception()
+
+
+async def _run_with_retries(chat_id: int, op: _Operation) -> Any:
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            return await op.call()
+        except telegram.error.RetryAfter as e_retry:
+            wait_time = float(e_retry.retry_after) + RETRY_AFTER_BUFFER
+            metrics.record_duration("flood_wait", wait_time, {"source": "bot_api"})
+            logger.warning(f"Flood control: {op.kind} в чате {chat_id} отложено на {wait_time:.1f}с "
+                           f"(попытка {attempt}/{MAX_ATTEMPTS}).")
+            if attempt == MAX_ATTEMPTS: raise
+            await asyncio.sleep(wait_time)
+        except telegram.error.BadRequest as e_bad_request:
+            if "message is not modified" in str(e_bad_request).lower():
+                return True
+            raise
+        except (telegram.error.TimedOut, telegram.error.NetworkError) as e_network:
+            logger.warning(f"Сетевая ошибка: {op.kind} в чате {chat_id} (попытка {attempt}/{MAX_ATTEMPTS}): {e_network}")
+            if attempt == MAX_ATTEMPTS: raise
+            await asyncio.sleep(BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))
+    return None
+
+
+async def _drain(chat_id: int):
+    chat = _chats[chat_id]
+    try:
+        while chat.pending:
+            op = min(chat.pending, key=lambda queued: (queued.priority, queued.seq))
+            chat.pending.remove(op)
+            chat.in_flight += 1
+            metrics.record_duration("outbox_queue_wait", time.monotonic() - op.enqueued_at, {"kind": op.kind},
+                                    help_text="Time Bot API operations waited in the per-chat outbox")
+            try:
+                op.resolve(await _run_with_retries(chat_id, op))
+            except Exception as e_op:
+                logger.warning(f"Outbox: {op.kind} в чате {chat_id} не выполнено: {e_op}")
+                op.resolve(error=e_op)
+            finally:
+                chat.in_flight -= 1
+                _publish()
+    finally:
+        chat.worker = None
+        for op in chat.pending:  # only left behind when the worker is cancelled on shutdown
+            for future in op.futures: future.cancel()
+        chat.pending.clear()
+        _forget_if_idle(chat_id)
+        _publish()
+
+
+def _submit(chat_id: int, kind: str, priority: int, call: Callable[[], Awaitable[Any]],
+            message_id: Optional[int] = None) -> asyncio.Future:
+    chat = _chats.setdefault(chat_id, _ChatQueue())
+    future = asyncio.get_running_loop().create_future()
+    future.add_done_callback(_retrieve_exception)
+
+    if kind == "edit":
+        queued_edit = next((op for op in chat.pending if op.kind == "edit" and op.message_id == message_id), None)
+        if queued_edit:
+            queued_edit.call = call
+            queued_edit.priority = min(queued_edit.priority, priority)
+            queued_edit.futures.append(future)
+            metrics.record_event("outbox_merged", help_text="Queued edits replaced by a newer edit of the same message")
+            return future
+    elif kind == "delete":
+        for superseded in [op for op in chat.pending if op.kind == "edit" and op.message_id == message_id]:
+            chat.pending.remove(superseded)
+            superseded.resolve(False)
+            metrics.record_event("outbox_merged")
+
+    op = _Operation(kind, message_id, priority, call)
+    op.futures.append(future)
+    chat.pending.append(op)
+    if chat.worker is None:
+        chat.worker = asyncio.create_task(_drain(chat_id), name=f"outbox-{chat_id}")
+    _publish()
+    return future
+
+
+def edit_text(bot: Bot, chat_id: int, message_id: int, text: str, parse_mode: Optional[str] = None,
+              reply_markup: Any = None, priority: int = PRIORITY_PROGRESS) -> asyncio.Future:
+    """Edit a message's text; resolves to True, or False if a newer deletion made the edit pointless."""
+    async def call():
+        await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode=parse_mode,
+                                    reply_markup=reply_markup)
+        return True
+    return _submit(chat_id, "edit", priority, call, message_id)
+
+
+def send_text(bot: Bot, chat_id: int, text: str, parse_mode: Optional[str] = None, reply_markup: Any = None,
+              reply_to_message_id: Optional[int] = None, priority: int = PRIORITY_STATUS) -> asyncio.Future:
+    """Send a new message; resolves to the sent Message."""
+    async def call() -> Message:
+        return await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=reply_markup,
+                                      reply_to_message_id=reply_to_message_id)
+    return _submit(chat_id, "send", priority, call)
+
+
+def delete(bot: Bot, chat_id: int, message_id: int, priority: int = PRIORITY_STATUS) -> asyncio.Future:
+    """Delete a message, dropping its queued edits; resolves to True."""
+    async def call():
+        return await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    return _submit(chat_id, "delete", priority, call, message_id)
+
+
+def pin(bot: Bot, chat_id: int, message_id: int, priority: int = PRIORITY_STATUS) -> asyncio.Future:
+    async def call():
+        return await bot.pin_chat_message(chat_id=chat_id, message_id=message_id, disable_notification=True)
+    return _submit(chat_id, "pin", priority, call, message_id)
+
+
+@asynccontextmanager
+async def upload(chat_id: int) -> AsyncIterator[None]:
+    """Count an audio upload to the chat as outstanding work.
+
+    Uploads go through Pyrogram and its FloodWait limiter, not through the chat
+    worker, so that progress edits are not stuck behind a long upload.
+    """
+    chat = _chats.setdefault(chat_id, _ChatQueue())
+    chat.uploads += 1
+    _publish()
+    try:
+        yield
+    finally:
+        chat.uploads -= 1
+        _forget_if_idle(chat_id)
+        _publish()
+
+
+def outstanding() -> dict[int, dict[str, int]]:
+    """Queued and running operations plus audio uploads, per chat."""
+    return {chat_id: {"queued": len(chat.pending), "in_flight": chat.in_flight, "uploads": chat.uploads}
+            for chat_id, chat in _chats.items()}
@@ -0,0 +1,142 @@
+"""Rate-limited progress of one track through the pipeline stages.
+
+Each stage (download, transcode, upload) owns a span of the track's progress
+bar and reports how many of its units are done: bytes for the downloader and
+the upload, seconds of audio for ffmpeg. The channel turns that into a
+percentage, a throughput and an ETA, and publishes at most one update per
+PROGRESS_UPDATE_INTERVAL_SECONDS; when a stage ends its average rate goes to
+the pipeline_stage_rate histograms, so slow stages show up per track kind.
+"""
+import logging
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, Optional
+
+from config import PROGRESS_UPDATE_INTERVAL_SECONDS
+from utils import format_bytes
+import metrics
+import ui_texts
+
+logger = logging.getLogger(__name__)
+
+UNIT_BYTES = "bytes"
+UNIT_MEDIA_SECONDS = "media_seconds"  # seconds of audio processed, the rate is a multiple of real time
+RATE_BUCKETS = {
+    UNIT_BYTES: tuple(kb * 1024 for kb in (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)),
+    UNIT_MEDIA_SECONDS: (1, 2, 5, 10, 20, 50, 100, 200, 500),
+}
+
+FFMPEG_PROGRESS_LINE_RE = re.compile(r"[a-z0-9_]+=\S*")  # key=value lines of ffmpeg -progress
+FFMPEG_DURATION_RE = re.compile(r"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+# tqdm progress bars (scdl): "| 2.10M/7.21M [00:01<00:03, 3.1MB/s]"
+TQDM_BYTES_RE = re.compile(r"\|\s*(\d+(?:\.\d+)?)([kMGT]?)/(\d+(?:\.\d+)?)([kMGT]?)\s*\[")
+SI_PREFIXES = {"": 1, "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12}
+
+# publish(percent, stage text key, detail such as "1.2 MB/с, ~5с")
+ProgressPublisher = Callable[[int, str, str], Awaitable[None]]
+
+
+class ProgressChannel:
+    def __init__(self, publish: ProgressPublisher, min_interval: float = PROGRESS_UPDATE_INTERVAL_SECONDS):
+        self._publish = publish
+        self.min_interval = min_interval
+        self._last_push = 0.0
+        self._tasks: set[asyncio.Task] = set()
+        self._stage: Optional[str] = None
+        self._stage_text_key = ""
+        self._unit = UNIT_BYTES
+        self._span = (0, 0)
+        self._stage_started = 0.0
+        self._done = 0.0
+        self._total: Optional[float] = None
+
+    def stage(self, name: str, stage_text_key: str, start_percent: int, end_percent: int,
+              unit: str = UNIT_BYTES, total: Optional[float] = None):
+        """Start a stage: its progress fills the bar from start_percent to end_percent."""
+        self._finish_stage()
+        self._stage, self._stage_text_key, self._unit = name, stage_text_key, unit
+        self._span = (start_percent, end_percent)
+        self._stage_started = time.monotonic()
+        self._done, self._total = 0.0, total
+        self._push(start_percent, "")
+
+    def set_total(self, total: float):
+        if total > 0: self._total = total
+
+    def update(self, done: float, total: Optional[float] = None):
+        if self._stage is None: return
+        if total: self._total = total
+        self._done = done
+        now = time.monotonic()
+        finished = bool(self._total) and done >= self._total
+        if now - self._last_push < self.min_interval and not finished: return
+        start_percent, end_percent = self._span
+        percent = start_percent
+        if self._total:
+            percent += int((end_percent - start_percent) * min(1.0, done / self._total))
+        self._push(percent, self._detail(now), now)
+
+    def complete(self):
+        """The stage's tool reported it is done; fill its span even if the total was an estimate."""
+        if self._total: self.update(max(self._done, self._total))
+
+    def _detail(self, now: float) -> str:
+        elapsed = now - self._stage_started
+        if not self._done or elapsed <= 0: return ""
+        rate = self._done / elapsed
+        speed = (ui_texts.TRACK_PROGRESS_SPEED_REALTIME_FORMAT.format(speed=rate) if self._unit == UNIT_MEDIA_SECONDS
+                 else ui_texts.TRACK_PROGRESS_SPEED_BYTES_FORMAT.format(speed=format_bytes(rate)))
+        if not self._total or self._done >= self._total: return speed
+        return ui_texts.TRACK_PROGRESS_ETA_FORMAT.format(speed=speed, eta=max(1, round((self._total - self._done) / rate)))
+
+    def _push(self, percent: int, detail: str, now: Optional[float] = None):
+        self._last_push = now or time.monotonic()
+        task = asyncio.create_task(self._publish(percent, self._stage_text_key, detail))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _finish_stage(self):
+        if self._stage is None or not self._done: return
+        elapsed = time.monotonic() - self._stage_started
+        if elapsed > 0:
+            metrics.registry.histogram("pipeline_stage_rate", {"stage": self._stage, "unit": self._unit},
+                                       buckets=RATE_BUCKETS[self._unit],
+                                       help_text="Average rate of pipeline stages that report progress").observe(
+                self._done / elapsed)
+        self._stage = None
+
+    def close(self):
+        """End the current stage and drop publishes that have not run yet."""
+        self._finish_stage()
+        for task in self._tasks:
+            task.cancel()
+
+
+def ffmpeg_output_parser(channel: ProgressChannel) -> Callable[[str], bool]:
+    """subprocess_runner line callback for ffmpeg run with -progress pipe:1; consumes the progress lines."""
+    def on_line(line: str) -> bool:
+        if FFMPEG_PROGRESS_LINE_RE.fullmatch(line):
+            key, _, value = line.partition("=")
+            if key == "out_time_us" and value.isdigit():
+                channel.update(int(value) / 1_000_000)
+            elif key == "progress" and value == "end":
+                channel.complete()
+            return True
+        duration = FFMPEG_DURATION_RE.search(line)
+        if duration:
+            hours, minutes, seconds = duration.groups()
+            channel.set_total(int(hours) * 3600 + int(minutes) * 60 + float(seconds))
+        return False
+    return on_line
+
+
+def download_output_parser(channel: ProgressChannel) -> Callable[[str], bool]:
+    """subprocess_runner line callback for the downloader's tqdm byte counts; consumes the progress lines."""
+    def on_line(line: str) -> bool:
+        counts = TQDM_BYTES_RE.search(line)
+        if not counts: return False
+        done, done_prefix, total, total_prefix = counts.groups()
+        channel.update(float(done) * SI_PREFIXES[done_prefix], float(total) * SI_PREFIXES[total_prefix])
+        return True
+    return on_line
@@ -6,18 +6,39 @@ Falls back gracefully if Pyrogram client is unavailable.
 import logging
 import asyncio
 import io
+import os
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Awaitable, BinaryIO, Callable, NamedTuple, Optional, Union
 
 from pyrogram import Client
-from pyrogram.errors import FloodWait, RPCError
+from pyrogram.errors import (FloodWait, RPCError, FileIdInvalid, FileReferenceEmpty, FileReferenceExpired,
+                             FileReferenceInvalid, MediaEmpty, MediaInvalid)
 
-from config import API_ID, API_HASH, TELEGRAM_BOT_TOKEN
+from config import (API_ID, API_HASH, TELEGRAM_BOT_TOKEN, PYROGRAM_MAX_CONCURRENT_TRANSMISSIONS,
+                    UPLOAD_PROGRESS_INTERVAL_SECONDS)
+import metrics
 
 logger = logging.getLogger(__name__)
 
+KB = 1024
+THROUGHPUT_BUCKETS = tuple(kb * KB for kb in (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+PARKED_RESUME_INTERVAL = 1.0
+# Telegram rejects the file itself: a cached file_id is stale and the track has to be uploaded again
+FILE_REJECTED_ERRORS = (FileIdInvalid, FileReferenceEmpty, FileReferenceExpired, FileReferenceInvalid, MediaEmpty,
+                        MediaInvalid)
+
+UploadProgressCallback = Callable[[int, int], Awaitable[None]]
+
 _pyro_client: Optional[Client] = None
 _pyro_lock = asyncio.Lock()
+_session_name = "syncloud_bot"
+
+
+def use_session(name: str):
+    """Use a session file of its own, e.g. one per download worker process; call before the first upload."""
+    global _session_name
+    _session_name = name
 
 
 async def get_pyrogram_client() -> Client:
@@ -26,12 +47,15 @@ async def get_pyrogram_client() -> Client:
     async with _pyro_lock:
         if _pyro_client is None:
             _pyro_client = Client(
-                name="syncloud_bot",
+                name=_session_name,
                 api_id=API_ID,
                 api_hash=API_HASH,
                 bot_token=TELEGRAM_BOT_TOKEN,
                 workdir=str(Path(__file__).resolve().parent),
                 no_updates=True,
+                # Number of files uploaded at once; Pyrogram itself uploads parts of files
+                # over 10 MB with 4 parallel workers per file
+                max_concurrent_transmissions=PYROGRAM_MAX_CONCURRENT_TRANSMISSIONS,
             )
         if not _pyro_client.is_connected:
             await _pyro_client.start()
@@ -49,64 +73,213 @@ async def stop_pyrogram_client():
             _pyro_client = None
 
 
+class SentAudio(NamedTuple):
+    message_id: int
+    file_id: Optional[str]
+
+
+class FloodLimiter:
+    """Bot-wide FloodWait window learned from the penalties Telegram returns.
+
+    A send that hits FloodWait, or starts while a window is open, is parked: the
+    caller is told to give up its download slot, and the send waits here together
+    with its prepared file. Parked sends resume in FIFO order, one every
+    PARKED_RESUME_INTERVAL, so they do not all hit Telegram the moment the window ends.
+    """
+
+    def __init__(self):
+        self.until = 0.0
+        self._resume_lock = asyncio.Lock()
+
+    @property
+    def remaining(self) -> float:
+        return max(0.0, self.until - time.monotonic())
+
+    def penalize(self, seconds: float):
+        self.until = max(self.until, time.monotonic() + seconds)
+        metrics.registry.gauge("flood_window_seconds", help_text="Remaining learned FloodWait window").set(
+            self.remaining)
+
+    async def wait_turn(self, on_parked: Optional[Callable[[], None]] = None):
+        if not self.remaining and not self._resume_lock.locked():
+            return
+        if on_parked: on_parked()
+        parked_gauge = metrics.registry.gauge("uploads_parked", help_text="Sends waiting out a FloodWait window")
+        parked_gauge.inc()
+        started = time.monotonic()
+        try:
+            async with self._resume_lock:
+                while self.remaining:
+                    await asyncio.sleep(self.remaining)
+                await asyncio.sleep(PARKED_RESUME_INTERVAL)
+        finally:
+            parked_gauge.dec()
+            metrics.record_duration("upload_parked", time.monotonic() - started,
+                                    help_text="Time sends spent parked by the FloodWait limiter")
+
+
+flood_limiter = FloodLimiter()
+
+
+class _UploadProgress:
+    """Pyrogram progress callback (on_part): tracks throughput and forwards throttled updates to the caller.
+
+    Pyrogram awaits the callback between parts only if it is a coroutine function; an object with an
+    async __call__ is not one and would be run in an executor thread, so on_part is what gets passed.
+    The caller's callback (usually a message edit that may hit flood control) runs as a separate task
+    and is skipped while the previous one is still running.
+    """
+
+    def __init__(self, on_progress: Optional[UploadProgressCallback]):
+        self.on_progress = on_progress
+        self.started = time.monotonic()
+        self.first_part_at: Optional[float] = None
+        self.uploaded = 0
+        self._last_report = 0.0
+        self._report_task: Optional[asyncio.Task] = None
+
+    async def on_part(self, current: int, total: int):
+        now = time.monotonic()
+        if self.first_part_at is None:
+            self.first_part_at = now
+        self.uploaded = current
+        if not self.on_progress or not total or now - self._last_report < UPLOAD_PROGRESS_INTERVAL_SECONDS:
+            return
+        if self._report_task and not self._report_task.done():
+            return
+        self._last_report = now
+        self._report_task = asyncio.create_task(self._report(current, total))
+
+    async def _report(self, current: int, total: int):
+        try:
+            await self.on_progress(current, total)
+        except Exception as e_progress:
+            logger.debug(f"Ошибка обновления прогресса загрузки: {e_progress}")
+
+    def finish(self):
+        """Drop a pending report so it cannot overwrite the message the caller shows next."""
+        if self._report_task and not self._report_task.done():
+            self._report_task.cancel()
+
+    def throughput(self, size: int) -> float:
+        """Bytes per second counted from the first uploaded part, excluding connection and FloodWait time."""
+        return size / max(time.monotonic() - (self.first_part_at or self.started), 1e-6)
+
+
+async def _send_audio_with_retries(client: Client, chat_id: int, max_retries: int,
+                                   on_parked: Optional[Callable[[], None]] = None, **send_kwargs):
+    for attempt in range(1, max_retries + 1):
+        await flood_limiter.wait_turn(on_parked)
+        try:
+            return await client.send_audio(chat_id=chat_id, **send_kwargs)
+        except FloodWait as e:
+            logger.warning(
+                f"Pyrogram FloodWait: отправка в чат {chat_id} отложена на {e.value}с (попытка {attempt}/{max_retries})"
+            )
+            metrics.record_duration("flood_wait", e.value + 1, {"source": "pyrogram"},
+                                    help_text="Time spent waiting out Telegram flood control")
+            flood_limiter.penalize(e.value + 1)
+            if attempt == max_retries:
+                logger.error(f"Pyrogram: превышено макс. попыток для чата {chat_id}")
+                raise
+        except FILE_REJECTED_ERRORS:
+            raise  # the same file will be rejected again
+        except RPCError as e:
+            logger.error(
+                f"Pyrogram RPC error (попытка {attempt}/{max_retries}): {e}"
+            )
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(1 + attempt)
+    return None
+
+
 async def send_audio_pyrogram(
     chat_id: int,
-    audio_path: str,
+    audio_path: Union[str, BinaryIO],
     filename: str,
     title: str,
     performer: str,
-    thumbnail_data: Optional[io.BytesIO] = None,
+    thumbnail_data: Optional[bytes] = None,
     reply_to_message_id: Optional[int] = None,
     max_retries: int = 3,
-) -> Optional[int]:
+    on_progress: Optional[UploadProgressCallback] = None,
+    on_parked: Optional[Callable[[], None]] = None,
+) -> Optional[SentAudio]:
     """Send audio file via Pyrogram (MTProto), supporting up to 2GB.
 
-    Returns the message_id of the sent message, or None on failure.
+    on_progress(uploaded_bytes, total_bytes) is called at most every
+    UPLOAD_PROGRESS_INTERVAL_SECONDS while the file is uploading; on_parked() is
+    called once if the send has to wait out a FloodWait window (see FloodLimiter).
+    The audio may be a path or an in-memory binary file; the thumbnail JPEG is
+    handed to Pyrogram from memory, without a temporary file.
+    Returns the message_id and the Telegram file_id of the sent audio, or None on failure.
     """
     client = await get_pyrogram_client()
 
-    thumb_path = None
+    thumb = None
+    if thumbnail_data:
+        # A fresh file object per send: Pyrogram seeks in it and takes the file name from .name
+        thumb = io.BytesIO(thumbnail_data)
+        thumb.name = "thumb.jpg"
+    if isinstance(audio_path, io.BytesIO):
+        audio_size = audio_path.getbuffer().nbytes
+    elif isinstance(audio_path, str):
+        audio_size = os.path.getsize(audio_path)
+    else:
+        audio_size = os.fstat(audio_path.fileno()).st_size
+    progress = _UploadProgress(on_progress)
     try:
-        if thumbnail_data:
-            thumb_path = str(Path(audio_path).parent / "thumb_pyro.jpg")
-            thumbnail_data.seek(0)
-            with open(thumb_path, "wb") as f:
-                f.write(thumbnail_data.read())
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                msg = await client.send_audio(
-                    chat_id=chat_id,
-                    audio=audio_path,
-                    file_name=filename,
-                    title=title,
-                    performer=performer,
-                    thumb=thumb_path,
-                    reply_to_message_id=reply_to_message_id,
-                )
-                logger.info(f"Pyrogram: аудио отправлено в чат {chat_id}, msg_id={msg.id}")
-                return msg.id
-            except FloodWait as e:
-                logger.warning(
-                    f"Pyrogram FloodWait: ждём {e.value}с (попытка {attempt}/{max_retries})"
-                )
-                await asyncio.sleep(e.value + 1)
-                if attempt == max_retries:
-                    logger.error(f"Pyrogram: превышено макс. попыток для чата {chat_id}")
-                    raise
-            except RPCError as e:
-                logger.error(
-                    f"Pyrogram RPC error (попытка {attempt}/{max_retries}): {e}"
-                )
-                if attempt == max_retries:
-                    raise
-                await asyncio.sleep(1 + attempt)
+        upload_started = time.monotonic()
+        msg = await _send_audio_with_retries(
+            client, chat_id, max_retries, on_parked,
+            audio=audio_path,
+            file_name=filename,
+            title=title,
+            performer=performer,
+            thumb=thumb,
+            reply_to_message_id=reply_to_message_id,
+            progress=progress.on_part,
+        )
+        if msg is None:
+            return None
+        upload_seconds = time.monotonic() - upload_started
+        throughput = progress.throughput(audio_size)
+        metrics.record_duration("upload", upload_seconds, help_text="send_audio_pyrogram upload time")
+        metrics.record_event("uploaded_bytes", audio_size, help_text="Bytes uploaded via Pyrogram")
+        metrics.registry.histogram("upload_throughput_bytes_per_second", buckets=THROUGHPUT_BUCKETS,
+                                   help_text="Per-upload throughput from the first part to the last").observe(throughput)
+        logger.info(f"Pyrogram: аудио отправлено в чат {chat_id}, msg_id={msg.id}, "
+                    f"{audio_size / 1024:.0f} KB за {upload_seconds:.1f}с, {throughput / KB:.0f} KB/s")
+        # Telegram may keep .opus/.ogg files as a voice message or a document instead of audio
+        sent_media = msg.audio or msg.voice or msg.document
+        return SentAudio(msg.id, sent_media.file_id if sent_media else None)
     finally:
-        if thumb_path:
-            try:
-                Path(thumb_path).unlink(missing_ok=True)
-            except OSError:
-                pass
+        progress.finish()
 
-    return None
 
+async def send_cached_audio_pyrogram(
+    chat_id: int,
+    file_id: str,
+    reply_to_message_id: Optional[int] = None,
+    max_retries: int = 3,
+    on_parked: Optional[Callable[[], None]] = None,
+) -> Optional[int]:
+    """Re-send an already uploaded audio by its Telegram file_id, without uploading it again.
+
+    Returns the message_id, or None if Telegram no longer accepts the file_id. FloodWait after
+    max_retries and other errors (e.g. the user blocked the bot) are raised: uploading the
+    track again would not help with those.
+    """
+    client = await get_pyrogram_client()
+    try:
+        msg = await _send_audio_with_retries(client, chat_id, max_retries, on_parked, audio=file_id,
+                                             reply_to_message_id=reply_to_message_id)
+    except FILE_REJECTED_ERRORS as e:
+        logger.warning(f"Pyrogram: не удалось переотправить аудио по file_id в чат {chat_id}: {e}")
+        return None
+    if msg is None:
+        return None
+    metrics.record_event("cached_resends", help_text="Audio re-sent by Telegram file_id without upload")
+    logger.info(f"Pyrogram: аудио переотправлено по file_id в чат {chat_id}, msg_id={msg.id}")
+    return msg.id
@@ -0,0 +1,53 @@
+"""Single-flight registry: one in-flight computation per key, shared by concurrent callers.
+
+The track pipeline keys it by (track key, audio profile): when several syncs
+or direct downloads ask for the same track at once, the first one downloads,
+converts and uploads it, and the others wait for its Telegram file_id and
+re-send that instead of running the pipeline again.
+
+    waiting = singleflight.claim(key)
+    if waiting is None:  # leader
+        try: result = ...
+        finally: singleflight.resolve(key, result)
+    else:
+        result = await singleflight.wait(waiting)
+"""
+import logging
+import asyncio
+from typing import Any, Hashable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_flights: dict[Hashable, asyncio.Future] = {}
+
+
+def _publish():
+    metrics.registry.gauge("singleflight_in_flight", help_text="Keys with a computation in flight").set(len(_flights))
+
+
+def claim(key: Hashable) -> Optional[asyncio.Future]:
+    """None if the caller now leads the flight for key and must resolve() it, else the leader's result future."""
+    flight = _flights.get(key)
+    if flight is not None:
+        metrics.record_event("singleflight", labels={"role": "waiter"},
+                             help_text="Callers of the single-flight registry by role")
+        return flight
+    _flights[key] = asyncio.get_running_loop().create_future()
+    metrics.record_event("singleflight", labels={"role": "leader"})
+    _publish()
+    return None
+
+
+def resolve(key: Hashable, result: Any):
+    """Hand the leader's result (None on failure) to the waiters and end the flight."""
+    flight = _flights.pop(key, None)
+    if flight is not None and not flight.done():
+        flight.set_result(result)
+    _publish()
+
+
+async def wait(flight: asyncio.Future) -> Any:
+    # Shielded: a cancelled waiter must not cancel the result for the others
+    return await asyncio.shield(flight)
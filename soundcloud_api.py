@@ -0,0 +1,177 @@
+"""Minimal async client for SoundCloud's public api-v2.
+
+Used for structured track metadata (title, artist, duration, artwork) so the
+pipeline never has to download and scrape a track's HTML page. The public
+client_id is discovered from the web player's JS bundles (the same way
+yt-dlp does it) unless SOUNDCLOUD_CLIENT_ID is configured, and is re-discovered
+once when the API starts rejecting it. Requests wait while the circuit breaker
+has SoundCloud paused, and report their outcome to it.
+"""
+import logging
+import asyncio
+import re
+from pathlib import Path
+from typing import Any, Optional
+
+import httpx
+
+from config import SOUNDCLOUD_CLIENT_ID
+import circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://api-v2.soundcloud.com"
+SOUNDCLOUD_HOME_URL = "https://soundcloud.com/"
+REQUEST_TIMEOUT = 15
+TRACKS_BATCH_SIZE = 50
+ARTWORK_SIZE = "t500x500"
+
+_SCRIPT_SRC_RE = re.compile(r'<script[^>]+src="(https://a-v2\.sndcdn\.com/assets/[^"]+\.js)"')
+_CLIENT_ID_RE = re.compile(r'client_id\s*:\s*"([0-9a-zA-Z]{32})"')
+_ARTWORK_SIZE_RE = re.compile(r'-(?:large|original|crop|t\d+x\d+)\.')
+# Plain HLS transcodings by preference, with the extension of their concatenated segments
+HLS_MIME_EXTENSIONS = (("audio/mpeg", ".mp3"), ("audio/ogg", ".opus"), ("audio/mp4", ".m4a"))
+
+_client_id: Optional[str] = SOUNDCLOUD_CLIENT_ID or None
+_client_id_lock = asyncio.Lock()
+_http: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(timeout=REQUEST_TIMEOUT, follow_redirects=True,
+                                  headers={'User-Agent': 'Mozilla/5.0'})
+    return _http
+
+
+async def close_http_client():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+async def _discover_client_id() -> Optional[str]:
+    http = get_http_client()
+    try:
+        home_page = await http.get(SOUNDCLOUD_HOME_URL)
+        # The bundle defining client_id is one of the last scripts on the page
+        for script_url in reversed(_SCRIPT_SRC_RE.findall(home_page.text)):
+            script = await http.get(script_url)
+            match = _CLIENT_ID_RE.search(script.text)
+            if match:
+                logger.info("client_id SoundCloud API получен из скриптов веб-плеера.")
+                return match.group(1)
+    except httpx.HTTPError as e_discover:
+        logger.warning(f"Не удалось получить client_id SoundCloud API: {e_discover}")
+        return None
+    logger.warning("client_id SoundCloud API не найден в скриптах веб-плеера.")
+    return None
+
+
+async def _get_client_id(stale: Optional[str] = None) -> Optional[str]:
+    global _client_id
+    async with _client_id_lock:
+        if _client_id is None or _client_id == stale:
+            _client_id = await _discover_client_id()
+        return _client_id
+
+
+async def _api_get(path: str, params: dict) -> Optional[Any]:
+    """GET an api-v2 endpoint (or a full URL the API handed out) and return the decoded JSON, or None on any failure."""
+    async with circuit_breaker.request() as soundcloud_call:
+        client_id = await _get_client_id()
+        url = path if "://" in path else f"{API_BASE_URL}{path}"
+        for attempt in range(2):
+            if not client_id: return None
+            try:
+                response = await get_http_client().get(url, params={**params, "client_id": client_id})
+            except httpx.HTTPError as e_api:
+                logger.warning(f"Ошибка запроса к SoundCloud API {path}: {e_api}")
+                return None
+            if response.status_code in (401, 403) and attempt == 0:
+                logger.info(f"SoundCloud API отклонил client_id (HTTP {response.status_code}), получаем новый.")
+                client_id = await _get_client_id(stale=client_id)
+                continue
+            # Only a 429 is reported: a 403/404 is about this track, and an answer from api-v2 says nothing
+            # about whether downloads work again, so a probe that ends here lets the next request probe
+            if response.status_code == 429: soundcloud_call.report("HTTP 429")
+            if response.status_code != 200:
+                logger.warning(f"SoundCloud API {path}: HTTP {response.status_code}")
+                return None
+            try:
+                return response.json()
+            except ValueError as e_json:
+                logger.warning(f"SoundCloud API {path}: некорректный JSON: {e_json}")
+                return None
+    return None
+
+
+def artwork_url_for_size(artwork_url: str, size: str = ARTWORK_SIZE) -> str:
+    return _ARTWORK_SIZE_RE.sub(f'-{size}.', artwork_url, count=1)
+
+
+def parse_track(item: dict) -> Optional[dict]:
+    """Pick the fields we store from an api-v2 track object (artwork falls back to the uploader's avatar, like og:image)."""
+    if not isinstance(item, dict) or item.get("kind") != "track" or not item.get("id"):
+        return None
+    user = item.get("user") or {}
+    artwork_url = item.get("artwork_url") or user.get("avatar_url")
+    return {
+        "track_id": str(item["id"]),
+        "permalink_url": item.get("permalink_url"),
+        "title": item.get("title"),
+        "artist": user.get("username"),
+        "duration_ms": item.get("full_duration") or item.get("duration"),
+        "artwork_url": artwork_url_for_size(artwork_url) if artwork_url else None,
+    }
+
+
+async def fetch_tracks(track_ids: list[str]) -> list[dict]:
+    """Metadata for many tracks, TRACKS_BATCH_SIZE ids per request. Unknown or private ids are skipped."""
+    tracks: list[dict] = []
+    for start in range(0, len(track_ids), TRACKS_BATCH_SIZE):
+        batch = track_ids[start:start + TRACKS_BATCH_SIZE]
+        items = await _api_get("/tracks", {"ids": ",".join(batch)})
+        if not isinstance(items, list): continue
+        tracks.extend(track for track in map(parse_track, items) if track)
+    return tracks
+
+
+async def resolve_track(url: str) -> Optional[dict]:
+    """Metadata for a track page URL, or None if it is not a (public) track."""
+    return parse_track(await _api_get("/resolve", {"url": url}))
+
+
+async def get_hls_stream(track_id: str) -> Optional[tuple[str, str]]:
+    """(HLS playlist URL, file extension) of a track's preferred unencrypted HLS transcoding, or None."""
+    item = await _api_get(f"/tracks/{track_id}", {})
+    if not isinstance(item, dict): return None
+    hls_transcodings = [transcoding for transcoding in (item.get("media") or {}).get("transcodings") or []
+                        if transcoding.get("url") and not transcoding.get("snipped")
+                        and (transcoding.get("format") or {}).get("protocol") == "hls"]
+    for mime_prefix, extension in HLS_MIME_EXTENSIONS:
+        for transcoding in hls_transcodings:
+            if not transcoding["format"].get("mime_type", "").startswith(mime_prefix): continue
+            stream = await _api_get(transcoding["url"], {"track_authorization": item.get("track_authorization", "")})
+            if isinstance(stream, dict) and stream.get("url"):
+                return stream["url"], extension
+    return None
+
+
+async def download_artwork(artwork_url: str, save_path: Path) -> Optional[Path]:
+    async with circuit_breaker.request() as soundcloud_call:
+        try:
+            response = await get_http_client().get(artwork_url)
+        except httpx.HTTPError as e_artwork:
+            logger.warning(f"Ошибка при скачивании обложки {artwork_url}: {e_artwork}")
+            return None
+        if response.status_code == 429: soundcloud_call.report("HTTP 429")
+    if response.status_code != 200 or len(response.content) <= 100:
+        logger.warning(f"Не удалось скачать обложку: HTTP {response.status_code}, {len(response.content)} bytes")
+        return None
+    artwork_file = save_path / "cover.jpg"
+    artwork_file.write_bytes(response.content)
+    logger.info(f"Обложка скачана с SoundCloud: {len(response.content)} bytes -> {artwork_file}")
+    return artwork_file
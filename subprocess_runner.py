@@ -0,0 +1,187 @@
+"""Runs the external tools (yt-dlp, scdl, ffmpeg) so that none of them outlives its caller.
+
+Output is collected as with communicate(), or streamed line by line (on \\n
+and \\r, for progress bars) to an on_line callback that can consume
+progress lines so they do not end up in the collected output. stream_lines()
+instead yields stdout lines to the caller as they are printed, so long
+listings can be consumed (and abandoned) before the tool finishes.
+
+Every child starts in its own process group. When the timeout expires or the
+awaiting task is cancelled, the whole group (scdl's ffmpeg included) gets
+SIGTERM, then SIGKILL after KILL_GRACE_SECONDS, and the child is reaped
+before the caller sees the error. Optional CPU time and address space
+limits (SUBPROCESS_CPU_SECONDS, SUBPROCESS_MEMORY_MB) are applied through
+the shell's ulimit, which unlike preexec_fn is safe next to the media
+worker threads.
+"""
+import logging
+import asyncio
+import os
+import re
+import signal
+from typing import AsyncIterator, Callable, NamedTuple, Optional, Sequence
+
+from config import SUBPROCESS_CPU_SECONDS, SUBPROCESS_MEMORY_MB
+import metrics
+
+logger = logging.getLogger(__name__)
+
+KILL_GRACE_SECONDS = 3.0
+UNKNOWN_DURATION_TIMEOUT = 300.0
+STREAM_CHUNK_SIZE = 4096
+LINE_SEPARATORS_RE = re.compile(rb"[\r\n]")
+
+# Called with every output line; returns True if the line was progress and should not be collected
+LineCallback = Callable[[str], bool]
+
+_live: dict[str, int] = {}
+
+
+class ProcessResult(NamedTuple):
+    returncode: int
+    stdout: bytes
+    stderr: bytes
+
+
+class ProcessError(RuntimeError):
+    """A streamed tool exited with a non-zero code."""
+
+    def __init__(self, kind: str, returncode: int, stderr: str):
+        super().__init__(f"{kind} завершился с кодом {returncode}: {stderr[-200:]}")
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def duration_timeout(duration_ms: Optional[int], base_seconds: float, seconds_per_audio_minute: float) -> float:
+    """Timeout for a tool whose run time grows with the track length; UNKNOWN_DURATION_TIMEOUT without one."""
+    if not duration_ms:
+        return UNKNOWN_DURATION_TIMEOUT
+    return base_seconds + seconds_per_audio_minute * duration_ms / 60000
+
+
+def _with_limits(cmd: Sequence[str]) -> list[str]:
+    limits = []
+    if SUBPROCESS_CPU_SECONDS: limits.append(f"ulimit -t {SUBPROCESS_CPU_SECONDS}")
+    if SUBPROCESS_MEMORY_MB: limits.append(f"ulimit -v {SUBPROCESS_MEMORY_MB * 1024}")
+    if not limits:
+        return list(cmd)
+    return ["/bin/sh", "-c", " && ".join(limits) + ' && exec "$@"', "sh", *cmd]
+
+
+def _publish(kind: str):
+    metrics.registry.gauge("subprocesses_live", {"kind": kind}, help_text="Running external tool processes").set(
+        _live[kind])
+
+
+async def _read_lines(stream: asyncio.StreamReader, on_line: LineCallback, collected: bytearray):
+    def handle(line: bytes):
+        if not line: return
+        try:
+            if on_line(line.decode(errors="ignore")): return
+        except Exception as e_callback:
+            logger.debug(f"Ошибка обработчика вывода процесса: {e_callback}")
+        collected.extend(line + b"\n")
+
+    pending = b""
+    while chunk := await stream.read(STREAM_CHUNK_SIZE):
+        *lines, pending = LINE_SEPARATORS_RE.split(pending + chunk)
+        for line in lines:
+            handle(line)
+    handle(pending)
+
+
+async def _stream_output(process: asyncio.subprocess.Process, on_line: LineCallback) -> tuple[bytes, bytes]:
+    stdout, stderr = bytearray(), bytearray()
+    await asyncio.gather(_read_lines(process.stdout, on_line, stdout), _read_lines(process.stderr, on_line, stderr))
+    await process.wait()
+    return bytes(stdout), bytes(stderr)
+
+
+def _signal_group(process: asyncio.subprocess.Process, signal_number: int):
+    try:
+        os.killpg(process.pid, signal_number)
+    except ProcessLookupError:
+        pass
+
+
+async def terminate(process: asyncio.subprocess.Process, kind: str, reason: str):
+    """Stop a child started with start_new_session=True together with its process group and reap it."""
+    if process.returncode is None:
+        _signal_group(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+    # Also whatever the tool started itself and left behind in its group
+    _signal_group(process, signal.SIGKILL)
+    await process.wait()
+    metrics.record_event("subprocess_killed", labels={"kind": kind, "reason": reason},
+                         help_text="External tool processes killed on timeout or cancellation")
+    (logger.info if reason == "closed" else logger.warning)(f"Процесс {kind} (pid {process.pid}) остановлен: {reason}.")
+
+
+async def _start(cmd: Sequence[str], kind: str, timeout: float) -> asyncio.subprocess.Process:
+    logger.debug(f"Запуск {kind} (таймаут {timeout:.0f}с): {' '.join(cmd)}")
+    process = await asyncio.create_subprocess_exec(*_with_limits(cmd), stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE, start_new_session=True)
+    _live[kind] = _live.get(kind, 0) + 1
+    _publish(kind)
+    return process
+
+
+async def run(cmd: Sequence[str], timeout: float, kind: Optional[str] = None,
+              on_line: Optional[LineCallback] = None) -> ProcessResult:
+    """Run cmd and collect its output; raises asyncio.TimeoutError after killing it when timeout expires."""
+    kind = kind or os.path.basename(cmd[0])
+    process = await _start(cmd, kind, timeout)
+    try:
+        output = process.communicate() if on_line is None else _stream_output(process, on_line)
+        stdout, stderr = await asyncio.wait_for(output, timeout=timeout)
+        return ProcessResult(process.returncode, stdout, stderr)
+    except asyncio.TimeoutError:
+        await asyncio.shield(terminate(process, kind, "timeout"))
+        raise
+    except asyncio.CancelledError:
+        await asyncio.shield(terminate(process, kind, "cancelled"))
+        raise
+    finally:
+        _live[kind] -= 1
+        _publish(kind)
+
+
+async def stream_lines(cmd: Sequence[str], idle_timeout: float, kind: Optional[str] = None) -> AsyncIterator[str]:
+    """Yield the stdout lines of cmd as it prints them.
+
+    idle_timeout bounds each wait for the next line, not the time the caller
+    spends between lines. Raises ProcessError if the tool exits with a
+    non-zero code; closing the generator early (use contextlib.aclosing)
+    kills the tool.
+    """
+    kind = kind or os.path.basename(cmd[0])
+    process = await _start(cmd, kind, idle_timeout)
+    stderr_reader = asyncio.create_task(process.stderr.read())
+    try:
+        while line := await asyncio.wait_for(process.stdout.readline(), timeout=idle_timeout):
+            yield line.decode(errors="ignore").rstrip("\r\n")
+        stderr = await asyncio.wait_for(stderr_reader, timeout=idle_timeout)
+        await asyncio.wait_for(process.wait(), timeout=idle_timeout)
+    except asyncio.TimeoutError:
+        await asyncio.shield(terminate(process, kind, "timeout"))
+        raise
+    except asyncio.CancelledError:
+        await asyncio.shield(terminate(process, kind, "cancelled"))
+        raise
+    except GeneratorExit:
+        # The caller has what it needed (e.g. the sync reached likes it already has)
+        if process.returncode is None: await asyncio.shield(terminate(process, kind, "closed"))
+        raise
+    finally:
+        stderr_reader.cancel()
+        _live[kind] -= 1
+        _publish(kind)
+    if process.returncode:
+        raise ProcessError(kind, process.returncode, stderr.decode(errors="ignore").strip())
+
+
+def live_counts() -> dict[str, int]:
+    return {kind: count for kind, count in _live.items() if count}
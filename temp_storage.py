@@ -0,0 +1,166 @@
+"""Byte-budgeted workspaces for the download pipeline.
+
+Every processed track gets its own directory under DOWNLOAD_FOLDER (or
+under TEMP_RAM_FOLDER, e.g. a tmpfs, when it is small enough). Space is
+reserved up front from an estimate of the track size; when the budget or
+the disk is exhausted, ``acquire`` waits until other tracks release their
+workspaces. Workspaces are removed recursively, and a periodic sweep
+removes directories leaked by crashes or killed processes.
+"""
+import logging
+import asyncio
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from config import (DOWNLOAD_FOLDER, TEMP_STORAGE_BUDGET_MB, TEMP_STORAGE_MIN_FREE_MB, TEMP_RAM_FOLDER,
+                    TEMP_RAM_BUDGET_MB, TEMP_RAM_MAX_ITEM_MB)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Source audio (up to 256 kbps) plus the 192 kbps MP3 made from it
+ESTIMATED_BYTES_PER_SECOND = (256 + 192) * 1000 // 8
+ESTIMATED_EXTRA_BYTES = 2 * MB  # artwork, thumbnail, tool leftovers
+DEFAULT_WORKSPACE_BYTES = 64 * MB  # when the duration is unknown
+WAIT_RECHECK_INTERVAL = 5
+WAIT_TIMEOUT = 1800
+WORKSPACE_PREFIX = "dl_"
+
+
+def estimate_workspace_bytes(duration_ms: Optional[int]) -> int:
+    if not duration_ms:
+        return DEFAULT_WORKSPACE_BYTES
+    return int(duration_ms / 1000 * ESTIMATED_BYTES_PER_SECOND) + ESTIMATED_EXTRA_BYTES
+
+
+class TempStorage:
+    def __init__(self, root: Path, budget_bytes: int, min_free_bytes: int,
+                 ram_root: Optional[Path] = None, ram_budget_bytes: int = 0, ram_max_item_bytes: int = 0):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.ram_root = ram_root
+        self.ram_budget_bytes = ram_budget_bytes
+        self.ram_max_item_bytes = ram_max_item_bytes
+        self.reserved = 0
+        self.ram_reserved = 0
+        self._workspaces: dict[Path, tuple[int, bool]] = {}
+        self._released = asyncio.Condition()
+
+    def _publish(self):
+        metrics.registry.gauge("temp_storage_reserved_bytes", {"tier": "disk"},
+                               help_text="Bytes reserved by active download workspaces").set(self.reserved)
+        metrics.registry.gauge("temp_storage_reserved_bytes", {"tier": "ram"}).set(self.ram_reserved)
+        metrics.registry.gauge("temp_storage_workspaces", help_text="Active download workspaces").set(
+            len(self._workspaces))
+
+    def _fits_ram(self, expected_bytes: int) -> bool:
+        return bool(self.ram_root) and expected_bytes <= self.ram_max_item_bytes and \
+            self.ram_reserved + expected_bytes <= self.ram_budget_bytes
+
+    def _fits_disk(self, expected_bytes: int) -> bool:
+        if self.reserved == 0:  # a single oversized track must not wait forever
+            within_budget = True
+        else:
+            within_budget = not self.budget_bytes or self.reserved + expected_bytes <= self.budget_bytes
+        if not within_budget: return False
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            free_bytes = shutil.disk_usage(self.root).free
+        except OSError as e_usage:
+            logger.warning(f"Не удалось узнать свободное место в {self.root}: {e_usage}")
+            return True
+        # Space already reserved by running tracks is mostly not written yet
+        return free_bytes - (self.reserved + expected_bytes) >= self.min_free_bytes
+
+    async def acquire(self, user_id: int, name: str, expected_bytes: int) -> Path:
+        """Reserve space and create an empty workspace directory; raises OSError if none frees up in time."""
+        started = time.monotonic()
+        async with self._released:
+            use_ram = self._fits_ram(expected_bytes)
+            if not use_ram and not self._fits_disk(expected_bytes):
+                logger.info(f"Временное хранилище заполнено ({self.reserved / MB:.0f} МБ занято), "
+                            f"трек user {user_id} ждет освобождения {expected_bytes / MB:.0f} МБ.")
+                waiting_gauge = metrics.registry.gauge("temp_storage_waiting",
+                                                       help_text="Tracks waiting for temp storage space")
+                waiting_gauge.inc()
+                try:
+                    while not self._fits_disk(expected_bytes):
+                        if time.monotonic() - started > WAIT_TIMEOUT:
+                            raise OSError(f"нет места во временном хранилище ({expected_bytes / MB:.0f} МБ)")
+                        try:
+                            # Free disk space can change without a release, so re-check periodically
+                            await asyncio.wait_for(self._released.wait(), timeout=WAIT_RECHECK_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    waiting_gauge.dec()
+                metrics.record_duration("temp_storage_wait", time.monotonic() - started,
+                                        help_text="Time tracks waited for temp storage space")
+            path = (self.ram_root if use_ram else self.root) / str(user_id) / name
+            path.mkdir(parents=True, exist_ok=True)
+            self._workspaces[path] = (expected_bytes, use_ram)
+            if use_ram:
+                self.ram_reserved += expected_bytes
+            else:
+                self.reserved += expected_bytes
+            self._publish()
+            return path
+
+    async def release(self, path: Path):
+        """Remove a workspace with everything in it and return its reservation."""
+        try:
+            shutil.rmtree(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e_clean:
+            logger.error(f"Ошибка очистки временной папки {path}: {e_clean}")
+        async with self._released:
+            expected_bytes, use_ram = self._workspaces.pop(path, (0, False))
+            if use_ram:
+                self.ram_reserved -= expected_bytes
+            else:
+                self.reserved -= expected_bytes
+            self._publish()
+            self._released.notify_all()
+
+    def sweep(self, max_age_seconds: float) -> int:
+        """Remove workspaces not owned by a running track and untouched for max_age_seconds, and empty user dirs."""
+        removed = 0
+        now = time.time()
+        for root in filter(None, (self.root, self.ram_root)):
+            if not root.is_dir(): continue
+            for user_dir in root.iterdir():
+                if not user_dir.is_dir(): continue
+                for workspace in user_dir.glob(f"{WORKSPACE_PREFIX}*"):
+                    if workspace in self._workspaces: continue
+                    try:
+                        if now - workspace.stat().st_mtime < max_age_seconds: continue
+                        if workspace.is_dir():
+                            shutil.rmtree(workspace)
+                        else:
+                            workspace.unlink()
+                        removed += 1
+                    except OSError as e_sweep:
+                        logger.warning(f"Не удалось удалить забытую временную папку {workspace}: {e_sweep}")
+                try:
+                    user_dir.rmdir()  # only succeeds when empty
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Очистка временного хранилища: удалено {removed} забытых папок.")
+            metrics.record_event("temp_storage_swept", removed, help_text="Leaked download workspaces removed")
+        return removed
+
+
+storage = TempStorage(
+    root=Path(DOWNLOAD_FOLDER),
+    budget_bytes=TEMP_STORAGE_BUDGET_MB * MB,
+    min_free_bytes=TEMP_STORAGE_MIN_FREE_MB * MB,
+    ram_root=Path(TEMP_RAM_FOLDER) if TEMP_RAM_FOLDER else None,
+    ram_budget_bytes=TEMP_RAM_BUDGET_MB * MB,
+    ram_max_item_bytes=TEMP_RAM_MAX_ITEM_MB * MB,
+)
@@ -0,0 +1,100 @@
+"""Per-track stage timing for the download pipeline.
+
+A TrackTrace is created per processed track; the pipeline calls
+``begin(stage)`` at each step, which closes the previous stage. Durations
+and byte counts go to the metrics registry, finished traces are kept in
+memory for the admin command and optionally appended to a JSON-lines file.
+"""
+import logging
+import json
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Optional
+
+from config import TRACE_LOG_FILE
+from metrics import registry, record_event
+
+logger = logging.getLogger(__name__)
+
+RECENT_TRACES_MAX = 200
+BYTES_BUCKETS = (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2, 256 * 1024 ** 2,
+                 1024 ** 3)
+
+recent_traces: deque[dict] = deque(maxlen=RECENT_TRACES_MAX)
+
+
+class TrackTrace:
+    def __init__(self, track_key: str):
+        self.track_key = track_key
+        self.started_at = time.monotonic()
+        self.stages: list[dict] = []
+        self._current: Optional[dict] = None
+
+    def begin(self, stage: str):
+        self.end()
+        self._current = {"stage": stage, "started": time.monotonic(), "bytes_in": 0, "bytes_out": 0}
+
+    def add_bytes(self, bytes_in: int = 0, bytes_out: int = 0):
+        if self._current:
+            self._current["bytes_in"] += bytes_in or 0
+            self._current["bytes_out"] += bytes_out or 0
+
+    def end(self):
+        if not self._current: return
+        current, self._current = self._current, None
+        duration = time.monotonic() - current.pop("started")
+        current["seconds"] = round(duration, 4)
+        self.stages.append(current)
+        stage_labels = {"stage": current["stage"]}
+        registry.histogram("pipeline_stage_seconds", stage_labels,
+                           help_text="Duration of download pipeline stages").observe(duration)
+        for direction in ("in", "out"):
+            stage_bytes = current[f"bytes_{direction}"]
+            if stage_bytes:
+                registry.counter("pipeline_stage_bytes_total", {**stage_labels, "direction": direction},
+                                 help_text="Bytes read/written by pipeline stages").inc(stage_bytes)
+                registry.histogram("pipeline_stage_bytes", {**stage_labels, "direction": direction},
+                                   buckets=BYTES_BUCKETS).observe(stage_bytes)
+
+    def finish(self, outcome: str):
+        self.end()
+        total_seconds = time.monotonic() - self.started_at
+        registry.histogram("pipeline_track_seconds", {"outcome": outcome},
+                           help_text="End-to-end processing time per track").observe(total_seconds)
+        record_event("tracks_processed", labels={"outcome": outcome},
+                     help_text="Tracks that went through the download pipeline")
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "track": self.track_key,
+            "outcome": outcome,
+            "seconds": round(total_seconds, 4),
+            "stages": self.stages,
+        }
+        recent_traces.append(record)
+        if TRACE_LOG_FILE:
+            try:
+                with open(TRACE_LOG_FILE, "a", encoding="utf-8") as trace_file:
+                    trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e_trace:
+                logger.warning(f"Не удалось записать трассировку в {TRACE_LOG_FILE}: {e_trace}")
+
+
+def stage_summary() -> list[dict]:
+    """Per-stage aggregates (count, avg/p50/p95/max seconds, total bytes) ordered by total time spent."""
+    summary = []
+    for label_key, histogram in registry.histograms.get("pipeline_stage_seconds", {}).items():
+        stage = dict(label_key).get("stage", "?")
+        bytes_counters = registry.counters.get("pipeline_stage_bytes_total", {})
+        summary.append({
+            "stage": stage,
+            "count": histogram.count,
+            "total": histogram.sum,
+            "avg": histogram.avg,
+            "p50": histogram.quantile(0.5),
+            "p95": histogram.quantile(0.95),
+            "max": histogram.max,
+            "bytes_in": sum(c.value for k, c in bytes_counters.items() if dict(k) == {"stage": stage, "direction": "in"}),
+            "bytes_out": sum(c.value for k, c in bytes_counters.items() if dict(k) == {"stage": stage, "direction": "out"}),
+        })
+    return sorted(summary, key=lambda item: item["total"], reverse=True)
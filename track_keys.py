@@ -0,0 +1,125 @@
+"""Canonical identifiers for SoundCloud tracks.
+
+Every table and cache keyed on a track uses the key returned from here:
+``sc:<numeric track id>`` once the id is known, otherwise the normalized
+permalink (see utils.normalize_soundcloud_url). Resolved aliases are kept
+in the ``track_aliases`` table, so each link is resolved only once. Track
+metadata from the SoundCloud API is stored in the ``tracks`` table under the
+same key.
+"""
+import logging
+import asyncio
+from typing import Optional
+
+import db
+import soundcloud_api
+import subprocess_runner
+from utils import normalize_soundcloud_url
+
+logger = logging.getLogger(__name__)
+
+TRACK_KEY_PREFIX = "sc:"
+RESOLVE_TIMEOUT = 60
+ALIAS_CACHE_MAX_SIZE = 20000
+
+_alias_cache: dict[str, str] = {}
+
+
+def track_key_from_id(track_id: object) -> Optional[str]:
+    track_id_str = str(track_id).strip() if track_id is not None else ""
+    if not track_id_str.isdigit():
+        return None
+    return f"{TRACK_KEY_PREFIX}{track_id_str}"
+
+
+def _cache_alias(alias: str, track_key: str):
+    if len(_alias_cache) >= ALIAS_CACHE_MAX_SIZE:
+        _alias_cache.clear()
+    _alias_cache[alias] = track_key
+
+
+def remember_track_ids(url_id_pairs: list[tuple[str, object]]) -> list[str]:
+    """Register (url, track id) pairs we already know (e.g. from a likes listing) and return their keys.
+
+    Entries without a usable id fall back to the normalized URL.
+    """
+    keys: list[str] = []
+    new_aliases: list[tuple[str, str]] = []
+    for url, track_id in url_id_pairs:
+        normalized = normalize_soundcloud_url(url) or url.strip()
+        track_key = track_key_from_id(track_id)
+        if not track_key:
+            keys.append(_alias_cache.get(normalized, normalized))
+            continue
+        keys.append(track_key)
+        if _alias_cache.get(normalized) != track_key:
+            new_aliases.append((normalized, track_key))
+            _cache_alias(normalized, track_key)
+    if new_aliases:
+        added = db.add_track_aliases(new_aliases)
+        if added: logger.info(f"Сохранено {added} новых алиасов треков.")
+    return keys
+
+
+async def _fetch_track_id(url: str) -> Optional[str]:
+    ytdlp_cmd = ["yt-dlp", "--print", "id", "--skip-download", "--no-playlist", "--no-warnings", "-q", url]
+    try:
+        result = await subprocess_runner.run(ytdlp_cmd, RESOLVE_TIMEOUT)
+    except (asyncio.TimeoutError, OSError) as e_resolve:
+        logger.warning(f"Не удалось получить ID трека для {url}: {e_resolve}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"yt-dlp не вернул ID трека для {url}: {result.stderr.decode(errors='ignore').strip()[:200]}")
+        return None
+    lines = result.stdout.decode(errors='ignore').strip().splitlines()
+    return lines[0].strip() if lines else None
+
+
+async def resolve_track_key(url: str) -> str:
+    """Return the canonical key for a track link, resolving its SoundCloud id if it is not cached yet."""
+    normalized = normalize_soundcloud_url(url) or url.strip()
+    cached = _alias_cache.get(normalized)
+    if cached: return cached
+    if normalized.startswith(TRACK_KEY_PREFIX): return normalized
+
+    stored = db.get_track_alias(normalized)
+    if stored:
+        _cache_alias(normalized, stored)
+        return stored
+
+    metadata = await soundcloud_api.resolve_track(url.strip())
+    if metadata:
+        track_key = track_key_from_id(metadata["track_id"])
+        db.upsert_tracks([{**metadata, "track_key": track_key}])
+    else:
+        track_key = track_key_from_id(await _fetch_track_id(url))
+    if not track_key:
+        logger.info(f"ID трека для {url} не определен, используется нормализованный URL.")
+        return normalized
+    db.add_track_aliases([(normalized, track_key)])
+    _cache_alias(normalized, track_key)
+    return track_key
+
+
+async def prefetch_track_metadata(track_keys: list[str]) -> int:
+    """Fetch and store API metadata for id-based keys that have none yet (batched). Returns the number stored."""
+    id_keys = list(dict.fromkeys(key for key in track_keys if key.startswith(TRACK_KEY_PREFIX)))
+    known = db.get_known_track_keys(id_keys)
+    missing_ids = [key.removeprefix(TRACK_KEY_PREFIX) for key in id_keys if key not in known]
+    if not missing_ids: return 0
+    tracks = await soundcloud_api.fetch_tracks(missing_ids)
+    stored = db.upsert_tracks([{**track, "track_key": track_key_from_id(track["track_id"])} for track in tracks])
+    logger.info(f"Метаданные SoundCloud: запрошено {len(missing_ids)}, сохранено {stored}.")
+    return stored
+
+
+async def get_track_metadata(track_key: str) -> Optional[dict]:
+    """Stored metadata for a track, fetched from the API first if the key is id-based and no API metadata is stored.
+
+    A row holding only what an earlier pipeline run derived from the file (no track_id) is fetched again.
+    """
+    metadata = db.get_track(track_key)
+    if (metadata is None or not metadata.get("track_id")) and track_key.startswith(TRACK_KEY_PREFIX):
+        await prefetch_track_metadata([track_key])
+        metadata = db.get_track(track_key)
+    return metadata
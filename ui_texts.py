@@ -13,6 +13,8 @@ BUTTON_SYNC_NOW = "🔄 Синхронизировать сейчас"
 BUTTON_SETTINGS = "⚙️ Настройки"
 BUTTON_ERROR_LOG = "📜 Журнал ошибок"
 BUTTON_INFO = "ℹ️ Информация"
+BUTTON_STATS = "📈 Статистика"
+BUTTON_STATS_REFRESH = "🔄 Обновить"
 BUTTON_CLOSE_MENU = "❌ Закрыть меню"
 BUTTON_BACK_TO_MAIN = "🔙 Назад"
 BUTTON_BACK_TO_SETTINGS = "🔙 Назад"
@@ -39,6 +41,9 @@ SETTINGS_SYNC_PERIOD_LABEL_FORMAT = "⏱️ Период синхронизац
 SETTINGS_SYNC_ORDER_OLD_FIRST = "Сначала старые 🔼"
 SETTINGS_SYNC_ORDER_NEW_FIRST = "Сначала новые 🔽"
 SETTINGS_SYNC_ORDER_LABEL_FORMAT = "📊 Порядок синхронизации: {}"
+SETTINGS_AUDIO_PROFILE_LABEL_FORMAT = "🎧 Формат аудио: {}"
+SETTINGS_AUDIO_PROFILE_PROMPT = "Выберите формат, в котором бот будет присылать треки\\. Файлы меньшего размера приходят быстрее\\."
+SETTINGS_AUDIO_PROFILE_OPTION_SELECTED_FORMAT = "✅ {}"
 SETTINGS_SYNC_PERIOD_PROMPT = "Выберите период автоматической синхронизации:"
 SETTINGS_SYNC_PERIOD_INPUT_PROMPT = "Введите период синхронизации в часах \\(например, `12` для 12 часов, от 1 до 720\\)\\:"
 SETTINGS_USERNAME_NOT_SET_ALERT = "Сначала укажите имя пользователя SoundCloud!"
@@ -98,6 +103,10 @@ SYNC_ERROR_SENDING_FINAL_SUMMARY_FORMAT = "🚫 Не удалось отправ
 DIRECT_DL_PREPARING = ""
 DIRECT_DL_ERROR_SENDING_INITIAL_PROGRESS_FORMAT = "🚫 Не удалось отправить временное сообщение о прогрессе для прямой загрузки: {error_details}"
 DIRECT_DL_ERROR_START_PROCESSING_FORMAT = "🚫 Не удалось начать обработку ссылки (ошибка Telegram): {error_details}"
+DIRECT_BATCH_PROGRESS_FORMAT = "{progress_bar}\n✅ Завершено {processed_count}/{total_count}"
+DIRECT_BATCH_SUMMARY_FORMAT = "✅ Отправлено {sent_count}/{total_count}\n🚫 Ошибок: {errors_count}. Подробности в журнале."
+DIRECT_BATCH_ALL_ALREADY_SENT_FORMAT = "✅ Все треки ({total_count}) уже были отправлены ранее."
+DIRECT_BATCH_NO_TRACKS_FOUND = "❌ Треки по ссылкам не найдены. Подробности в журнале."
 
 TRACK_STAGE_STARTING = ""
 TRACK_STAGE_DOWNLOADING = ""
@@ -105,11 +114,46 @@ TRACK_STAGE_PROCESSING_METADATA = ""
 TRACK_STAGE_CONVERTING = ""
 TRACK_STAGE_UPLOADING = ""
 TRACK_STAGE_INTERMEDIATE = ""
+TRACK_STAGE_SOUNDCLOUD_PAUSED = "⏸ SoundCloud ограничил запросы, ждём"
+TRACK_PROGRESS_SPEED_BYTES_FORMAT = "{speed}/с"
+TRACK_PROGRESS_SPEED_REALTIME_FORMAT = "×{speed:.0f}"
+TRACK_PROGRESS_ETA_FORMAT = "{speed}, осталось ~{eta}с"
 
 LOG_ERR_PROCESSING_FORMAT ="🚫 Ошибка обработки ({filename_short}...): {error_details}"
 LOG_ERR_TELEGRAM_FORMAT = "🚫 Ошибка Telegram ({filename_short}...): {error_details}"
 LOG_ERR_UNEXPECTED_FORMAT = "🚫 Неожиданная ошибка ({filename_short}...). Подробности в журнале."
 
 USER_ERR_PROCESSING_DIRECT_FORMAT = "🚫 Ошибка обработки ({filename_short}...): {error_details}"
+USER_ERR_SOUNDCLOUD_THROTTLED_DIRECT = "⏳ SoundCloud временно ограничил загрузки. Попробуйте отправить ссылку позже."
 USER_ERR_TELEGRAM_DIRECT_FORMAT = "🚫 Ошибка Telegram ({filename_short}...): {error_details}"
-USER_ERR_UNEXPECTED_DIRECT_FORMAT = "🚫 Неожиданная ошибка ({filename_short}...). Подробности в журнале."
\ No newline at end of file
+USER_ERR_UNEXPECTED_DIRECT_FORMAT = "🚫 Неожиданная ошибка ({filename_short}...). Подробности в журнале."
+
+ADMIN_STAGES_TITLE = "⏱️ Этапы обработки треков (по суммарному времени)\n"
+ADMIN_STAGES_EMPTY = "Данных пока нет: ни один трек не обрабатывался с момента запуска."
+ADMIN_STAGES_ROW_FORMAT = (
+    "\n▪️ {stage}: {count} шт., всего {total:.1f}с\n"
+    "   avg {avg:.2f}с · p50 {p50:.2f}с · p95 {p95:.2f}с · max {max:.2f}с\n"
+    "   in {bytes_in} · out {bytes_out}"
+)
+ADMIN_STAGES_RECENT_FORMAT = "\n\n🕒 Последний трек ({track}, {outcome}): {seconds:.1f}с\n{stages}"
+
+STATS_TITLE = "📈 Статистика бота (5 мин / 15 мин)\n"
+STATS_SYNCS_FORMAT = "\n🔄 Синхронизаций выполняется: {running_syncs}\n   запущено планировщиком: {scheduled_5m} / {scheduled_15m}, в очереди планировщика: {scheduler_pending}"
+STATS_POOL_FORMAT = "\n📥 Пул загрузки: активно {active}, ожидают {waiting}"
+STATS_TRACKS_FORMAT = "\n🎵 Треков в минуту: {rate_5m:.2f} / {rate_15m:.2f}\n   отправлено {ok_15m}, ошибок {errors_15m} за 15 мин"
+STATS_UPLOAD_FORMAT = "\n⬆️ Загрузка в Telegram: {uploads_15m} файлов, {bytes_15m}, средняя скорость {speed}/с"
+STATS_WORKERS_FORMAT = "\n🏭 Воркеры загрузки: {workers} процессов, задач в очереди {queued}, выполняется {running}"
+STATS_JOBS_FORMAT = "\n🧵 Фоновые задачи: выполняется {running}, в очереди {queued} (пользователей: {users})"
+STATS_SUBPROCESS_FORMAT = "\n⚙️ Внешние процессы: {live} ({by_kind}), остановлено за 15 мин {killed_15m}, из них по таймауту {timeouts_15m}"
+STATS_WARM_DOWNLOADERS_FORMAT = "\n🔥 Загрузчики yt-dlp: {processes}/{slots} запущено, занято {busy}"
+STATS_SOUNDCLOUD_FORMAT = "\n🚦 SoundCloud: {state}; ограничений запросов за 15 мин {throttled_15m}, пауз {opened_15m}"
+STATS_SOUNDCLOUD_CLOSED = "запросы идут"
+STATS_SOUNDCLOUD_HALF_OPEN = "пробный запрос"
+STATS_SOUNDCLOUD_OPEN_FORMAT = "пауза, осталось {seconds_left}с из {pause}с"
+STATS_OUTBOX_FORMAT = "\n📤 Исходящие: {queued} операций с сообщениями, {uploads} загрузок аудио в {chats} чатах"
+STATS_OUTBOX_BUSIEST_FORMAT = "\n   Больше всего в чате {chat_id}: {count}"
+STATS_FLOOD_FORMAT = "\n⏳ FloodWait за 15 мин: {count} шт., в среднем {avg:.1f}с, максимум {max:.1f}с"
+STATS_DB_FORMAT = "\n🗄️ БД: {rate_5m:.1f} запросов/мин, в среднем {avg_ms:.1f} мс, максимум {max_ms:.1f} мс"
+STATS_LOOP_FORMAT = ("\n🔁 Event loop: задержка в среднем {lag_avg_ms:.1f} мс, максимум {lag_max_ms:.1f} мс; "
+                     "медленных колбэков за 15 мин: {slow_count}")
+STATS_LOOP_SLOWEST_FORMAT = "\n   Самый долгий: {detail} — {ms:.0f} мс"
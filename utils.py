@@ -2,6 +2,8 @@ import unicodedata
 import re
 import logging
 import os
+from typing import Optional
+from urllib.parse import urlsplit
 
 logger = logging.getLogger(__name__)
 
@@ -47,6 +49,14 @@ def create_progress_bar(percentage: int, length: int = 10) -> str:
     return f"⏳ [{bar}] {percentage:3d}%"
 
 
+def format_bytes(num_bytes: float) -> str:
+    if num_bytes < 1024: return f"{num_bytes:.0f} B"
+    for unit in ("KB", "MB", "GB"):
+        num_bytes /= 1024
+        if num_bytes < 1024: break
+    return f"{num_bytes:.1f} {unit}"
+
+
 def escape_markdown_v2(text: str) -> str:
     if not isinstance(text, str): text = str(text)
     escape_chars = r'_*[]()~`>#+-=|{}.!'
@@ -65,4 +75,43 @@ def escape_markdown_legacy(text: str) -> str:
     text = text.replace('\\', '\\\\')
     for char_to_escape in escape_chars:
         text = text.replace(char_to_escape, f'\\{char_to_escape}')
-    return text
\ No newline at end of file
+    return text
+
+SOUNDCLOUD_HOST_ALIASES = ("soundcloud.com", "www.soundcloud.com", "m.soundcloud.com")
+
+
+def normalize_soundcloud_url(url: str) -> Optional[str]:
+    """Reduce a SoundCloud link to https://soundcloud.com/<path> without query, fragment or trailing slash.
+
+    Only the host is case-insensitive: private share links carry case-sensitive tokens
+    (.../s-AbCdE123), so the path keeps its case. The result is meant for keys and aliases;
+    downloaders and the resolver get the user's original link. Returns None for anything that is not a soundcloud.com page link
+    (e.g. on.soundcloud.com short links, which need to be resolved first).
+    """
+    if not url: return None
+    raw = url.strip()
+    if "://" not in raw: raw = "https://" + raw
+    try:
+        parts = urlsplit(raw)
+    except ValueError:
+        return None
+    host = (parts.hostname or "").lower()
+    if host not in SOUNDCLOUD_HOST_ALIASES:
+        return None
+    path = re.sub(r'/{2,}', '/', parts.path).rstrip('/')
+    if not path:
+        return None
+    return f"https://soundcloud.com{path}"
+
+
+SOUNDCLOUD_COLLECTION_SEGMENTS = ("sets", "likes", "tracks", "reposts", "albums", "popular-tracks", "toptracks")
+
+
+def is_soundcloud_collection_url(url: str) -> bool:
+    """True for links that list several tracks: sets/playlists, albums, likes or a profile page."""
+    normalized = normalize_soundcloud_url(url)
+    if not normalized: return False
+    segments = normalized.removeprefix("https://soundcloud.com/").lower().split('/')
+    if len(segments) == 1:
+        return segments[0] not in ("discover", "stream", "search", "you")
+    return segments[1] in SOUNDCLOUD_COLLECTION_SEGMENTS
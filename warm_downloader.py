@@ -0,0 +1,155 @@
+"""Warm downloader processes that fetch tracks instead of a fresh scdl per track.
+
+Starting scdl costs an interpreter start, its imports and a SoundCloud
+client_id discovery before any audio moves. With WARM_DOWNLOADERS > 0 the
+track pipeline hands downloads to that many ytdlp_worker.py processes,
+started on first use. Each keeps one YoutubeDL instance, so the client_id and
+HTTP connections are reused across tracks. Requests and results are JSON
+lines over the worker's stdin/stdout; callers queue for an idle worker. A
+worker that times out, or whose caller is cancelled, is killed with its
+process group (subprocess_runner.terminate) and replaced on next use.
+"""
+import logging
+import asyncio
+import itertools
+import json
+import sys
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+from config import WARM_DOWNLOADERS
+import metrics
+import subprocess_runner
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).resolve().parent / "ytdlp_worker.py"
+WORKER_KIND = "ytdlp_worker"
+STREAM_LIMIT = 1 << 20  # error lines carry yt-dlp's message, keep them off the 64 KiB readline limit
+STOP_TIMEOUT_SECONDS = 5.0
+
+# (downloaded bytes, total bytes or 0 when unknown)
+ProgressCallback = Callable[[float, float], None]
+
+_command: list[str] = [sys.executable, str(WORKER_SCRIPT)]
+_idle: Optional[asyncio.Queue] = None  # idle processes; None entries are slots without a running process
+_processes: set[asyncio.subprocess.Process] = set()
+_busy = 0
+_request_ids = itertools.count(1)
+
+
+def enabled() -> bool:
+    return WARM_DOWNLOADERS > 0
+
+
+def set_command(command: Sequence[str]):
+    """Start workers with another command (benchmarks use a fake yt-dlp module); affects new workers only."""
+    global _command
+    _command = list(command)
+
+
+def _publish():
+    metrics.registry.gauge("warm_downloaders", help_text="Running warm downloader processes").set(len(_processes))
+    metrics.registry.gauge("warm_downloaders_busy", help_text="Warm downloader processes with a track").set(_busy)
+
+
+async def _spawn() -> asyncio.subprocess.Process:
+    process = await asyncio.create_subprocess_exec(*_command, stdin=asyncio.subprocess.PIPE,
+                                                   stdout=asyncio.subprocess.PIPE, start_new_session=True,
+                                                   limit=STREAM_LIMIT)
+    _processes.add(process)
+    _publish()
+    logger.info(f"Запущен процесс загрузки yt-dlp (pid {process.pid}).")
+    return process
+
+
+async def _acquire() -> asyncio.subprocess.Process:
+    global _idle
+    if _idle is None:
+        _idle = asyncio.Queue()
+        for _ in range(WARM_DOWNLOADERS):
+            _idle.put_nowait(None)
+    process = await _idle.get()
+    if process is not None and process.returncode is None:
+        return process
+    if process is not None:
+        _processes.discard(process)
+        metrics.record_event("warm_downloader_exits", labels={"returncode": str(process.returncode)},
+                             help_text="Warm downloader processes that exited unexpectedly")
+    try:
+        return await _spawn()
+    except BaseException:
+        _idle.put_nowait(None)
+        raise
+
+
+async def _read_result(process: asyncio.subprocess.Process, request_id: int,
+                       on_progress: Optional[ProgressCallback]) -> Optional[str]:
+    while line := await process.stdout.readline():
+        message = json.loads(line)
+        if message.get("id") != request_id: continue
+        if "progress" in message:
+            if on_progress: on_progress(*message["progress"])
+            continue
+        return None if message.get("ok") else message.get("error") or "unknown error"
+    raise ConnectionError(f"процесс загрузки завершился с кодом {await process.wait()}")
+
+
+async def download(url: str, target_dir: Path, timeout: float,
+                   on_progress: Optional[ProgressCallback] = None) -> Optional[str]:
+    """Download url into target_dir on a warm worker: None on success, else the error message.
+
+    timeout starts once a worker is free; when it expires the worker is killed and asyncio.TimeoutError raised.
+    """
+    global _busy
+    process = await _acquire()
+    request_id = next(_request_ids)
+    reusable = False
+    _busy += 1
+    _publish()
+    try:
+        process.stdin.write(json.dumps({"id": request_id, "url": url, "path": str(target_dir)}).encode() + b"\n")
+        await process.stdin.drain()
+        error = await asyncio.wait_for(_read_result(process, request_id, on_progress), timeout=timeout)
+        reusable = True
+        metrics.record_event("warm_downloads", labels={"outcome": "error" if error else "ok"},
+                             help_text="Tracks downloaded by warm downloader processes")
+        return error
+    except (ConnectionError, ValueError) as e_protocol:
+        logger.error(f"Процесс загрузки yt-dlp (pid {process.pid}) не ответил на {url}: {e_protocol}")
+        metrics.record_event("warm_downloads", labels={"outcome": "lost"})
+        return str(e_protocol)
+    except asyncio.TimeoutError:
+        await asyncio.shield(subprocess_runner.terminate(process, WORKER_KIND, "timeout"))
+        raise
+    except asyncio.CancelledError:
+        await asyncio.shield(subprocess_runner.terminate(process, WORKER_KIND, "cancelled"))
+        raise
+    finally:
+        _busy -= 1
+        if not reusable:
+            if process.returncode is None: await asyncio.shield(subprocess_runner.terminate(process, WORKER_KIND,
+                                                                                            "broken"))
+            _processes.discard(process)
+        _idle.put_nowait(process if reusable else None)
+        _publish()
+
+
+async def stop():
+    """Close the workers' stdin so they exit, killing the ones that do not."""
+    global _idle
+    processes = list(_processes)
+    for process in processes:
+        if process.stdin and not process.stdin.is_closing(): process.stdin.close()
+    try:
+        await asyncio.wait_for(asyncio.gather(*(process.wait() for process in processes)), STOP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        for process in processes:
+            if process.returncode is None: await subprocess_runner.terminate(process, WORKER_KIND, "shutdown")
+    _processes.clear()
+    _idle = None
+    _publish()
+
+
+def stats() -> dict[str, int]:
+    return {"processes": len(_processes), "busy": _busy, "slots": WARM_DOWNLOADERS}
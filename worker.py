@@ -0,0 +1,153 @@
+"""Download worker process for DOWNLOAD_BACKEND=workers.
+
+Claims tracks from the download_jobs queue in the bot's SQLite database and
+runs them through the usual pipeline (modified_handle_soundcloud_link) with a
+Pyrogram session and Bot API client of its own. The bot starts and restarts
+WORKER_PROCESSES of these; one can also be run by hand:
+
+    python worker.py --worker-id 1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+from telegram import Bot
+
+from config import TELEGRAM_BOT_TOKEN, DOWNLOAD_CONCURRENCY, WORKER_LEASE_SECONDS
+from handlers_direct_download import modified_handle_soundcloud_link
+import db
+import download_queue
+import hls_download
+import pyrogram_sender
+import warm_downloader
+
+logger = logging.getLogger(__name__)
+
+CLAIM_POLL_INTERVAL = 0.5
+STOP_GRACE_SECONDS = 10.0  # below download_queue.STOP_TIMEOUT_SECONDS
+
+
+class WorkerContext:
+    """The part of PTB's CallbackContext the track pipeline uses."""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.bot_data: dict = {}
+
+
+async def _keep_lease(job_id: int, worker_id: str, pipeline: asyncio.Task):
+    """Renew the job's lease; once it is lost another worker may run the job, so this one stops it."""
+    while True:
+        await asyncio.sleep(WORKER_LEASE_SECONDS / 3)
+        if not db.renew_download_job_lease(job_id, worker_id, WORKER_LEASE_SECONDS):
+            logger.warning(f"Аренда задачи загрузки #{job_id} потеряна воркером {worker_id}, задача остановлена.")
+            pipeline.cancel()
+            return
+
+
+async def _run_job(job: dict, worker_id: str, context: WorkerContext):
+    pipeline = asyncio.create_task(modified_handle_soundcloud_link(
+        url=job["url"], user_id=job["user_id"], chat_id=job["chat_id"], context=context,
+        status_message_id_to_edit=job["status_message_id"],
+        text_prefix_for_status=job["text_prefix"] or "",
+        reply_to_message_id_for_final_audio=job["reply_to_message_id"],
+        track_key=job["track_key"],
+    ), name=f"download-pipeline-{job['id']}")
+    lease_keeper = asyncio.create_task(_keep_lease(job["id"], worker_id, pipeline))
+    try:
+        success, sent_message_id = await pipeline
+    except asyncio.CancelledError:
+        if lease_keeper.done():
+            return  # the lease was lost: the job belongs to another worker now, it is neither released nor finished
+        db.release_download_job(job["id"], worker_id)
+        raise
+    except Exception as e_job:
+        logger.exception(f"Задача загрузки #{job['id']} ({job['url']}) упала в воркере {worker_id}: {e_job}")
+        db.finish_download_job(job["id"], worker_id, False, None, error=str(e_job)[:200])
+        return
+    finally:
+        lease_keeper.cancel()
+    if success and sent_message_id and job["track_key"]:
+        # Recorded here too, so a track delivered while the bot restarts is not sent again by the next sync
+        db.add_downloaded_track(job["user_id"], job["track_key"], sent_message_id)
+    db.finish_download_job(job["id"], worker_id, success, sent_message_id)
+
+
+async def run_worker(worker_id: str, bot: Bot, stop: asyncio.Event):
+    """Claim and run up to DOWNLOAD_CONCURRENCY jobs at a time until stop is set or the parent process is gone.
+
+    Jobs still running STOP_GRACE_SECONDS after that are cancelled and put back in the queue.
+    """
+    context = WorkerContext(bot)
+    running: set[asyncio.Task] = set()
+    slot_freed = asyncio.Event()
+    parent_pid = os.getppid()
+
+    def job_done(task: asyncio.Task):
+        running.discard(task)
+        slot_freed.set()
+
+    while not stop.is_set() and os.getppid() == parent_pid:
+        job = None
+        if len(running) < DOWNLOAD_CONCURRENCY:
+            job = db.claim_download_job(worker_id, WORKER_LEASE_SECONDS, download_queue.MAX_ATTEMPTS)
+        if job:
+            logger.info(f"Воркер {worker_id} взял задачу #{job['id']} (попытка {job['attempts']}): {job['url']}")
+            task = asyncio.create_task(_run_job(job, worker_id, context), name=f"download-job-{job['id']}")
+            running.add(task)
+            task.add_done_callback(job_done)
+            continue
+        slot_freed.clear()
+        try:
+            await asyncio.wait_for(slot_freed.wait(), CLAIM_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    if running:
+        _, unfinished = await asyncio.wait(list(running), timeout=STOP_GRACE_SECONDS)
+        for task in unfinished:
+            task.cancel()
+        await asyncio.gather(*unfinished, return_exceptions=True)
+
+
+async def serve(worker_index: int, bot: Bot):
+    worker_id = f"worker-{worker_index}-{os.getpid()}"
+    pyrogram_sender.use_session(f"syncloud_worker_{worker_index}")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signal_number, stop.set)
+    logger.info(f"Воркер загрузки {worker_id} запущен.")
+    try:
+        await run_worker(worker_id, bot, stop)
+    finally:
+        await warm_downloader.stop()
+        from media_tasks import shutdown_media_executor
+        shutdown_media_executor()
+        from soundcloud_api import close_http_client
+        await close_http_client()
+        await hls_download.close_http_client()
+        await pyrogram_sender.stop_pyrogram_client()
+        logger.info(f"Воркер загрузки {worker_id} остановлен.")
+
+
+async def _main_async(worker_index: int):
+    async with Bot(TELEGRAM_BOT_TOKEN) as bot:
+        await serve(worker_index, bot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SoundCloud download worker")
+    parser.add_argument("--worker-id", type=int, default=1)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s - worker-{args.worker_id} %(name)s "
+                                                   f"[%(levelname)s] - %(message)s (%(filename)s:%(lineno)d)")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    db.initialize_db()
+    asyncio.run(_main_async(args.worker_id))
+
+
+if __name__ == "__main__":
+    main()
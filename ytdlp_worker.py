@@ -0,0 +1,58 @@
+"""Warm yt-dlp download process, started by warm_downloader.py.
+
+Reads {"id", "url", "path"} requests from stdin, one JSON object per line,
+and downloads each track into path with one long-lived YoutubeDL instance,
+so the SoundCloud client_id and HTTP connections are reused across tracks.
+While downloading it writes {"id", "progress": [done, total]} lines to
+stdout, then a final {"id", "ok", "error"} line. Exits when stdin closes.
+"""
+import json
+import os
+import sys
+import time
+
+import yt_dlp
+
+PROGRESS_INTERVAL_SECONDS = 0.5
+# Same "<artist> - <title>" file names as scdl, the pipeline falls back to them for tags
+OUTPUT_TEMPLATE = "%(uploader)s - %(title)s.%(ext)s"
+
+
+def main() -> int:
+    # stdout carries the protocol only, anything yt-dlp or its libraries print goes to stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+
+    def send(message: dict):
+        channel.write(json.dumps(message) + "\n")
+        channel.flush()
+
+    current = {"id": None, "reported": 0.0}
+
+    def on_progress(status: dict):
+        if status.get("status") != "downloading": return
+        now = time.monotonic()
+        if now - current["reported"] < PROGRESS_INTERVAL_SECONDS: return
+        current["reported"] = now
+        send({"id": current["id"], "progress": [status.get("downloaded_bytes") or 0,
+                                                status.get("total_bytes") or status.get("total_bytes_estimate") or 0]})
+
+    ydl = yt_dlp.YoutubeDL({"format": "bestaudio/best", "outtmpl": OUTPUT_TEMPLATE, "noplaylist": True,
+                            "overwrites": True, "quiet": True, "no_warnings": True, "noprogress": True,
+                            "progress_hooks": [on_progress]})
+    for line in sys.stdin:
+        request = json.loads(line)
+        current.update(id=request["id"], reported=0.0)
+        ydl.params["paths"] = {"home": request["path"]}
+        try:
+            ydl.download([request["url"]])
+        except Exception as e_download:  # DownloadError and anything else: report it and serve the next track
+            send({"id": request["id"], "ok": False, "error": str(e_download)})
+            continue
+        send({"id": request["id"], "ok": True})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())